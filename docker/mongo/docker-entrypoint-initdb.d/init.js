@@ -1,12 +1,21 @@
 // Insert initial data into a collection
+// Documents follow the layout written by the application so they can be queried:
+// an integer discount with is_percent, validity bounds as dates, and the version of
+// this layout so they are read without validation
 db.coupons.insertMany([
-    {name: "coupon_1", discount: 5},
-    {name: "coupon_2", discount: "20%"},
-    {name: "coupon_3", discount: 5, condition: {"category": "food"}},
-    {name: "coupon_4", discount: 20, condition: {"category": "food"}},
-    {name: "coupon_5", discount: 20, condition: {"price_above": 100}},
-    {name: "coupon_6", discount: 20, condition: {"price_above": 50}},
-    {name: "coupon_7", discount: 20, condition: {"price_above": 150}},
-    {name: "coupon_8", discount: 20, validity: {"start": "2022-01-01", "end": "2026-01-01"}},
-    {name: "coupon_9", discount: 20, validity: {"start": "2022-01-01", "end": "2022-01-01"}},
+    {name: "coupon_1", discount: 5, is_percent: false, schema_version: 1},
+    {name: "coupon_2", discount: 20, is_percent: true, schema_version: 1},
+    {name: "coupon_3", discount: 5, is_percent: false, condition: {"category": "food"}, schema_version: 1},
+    {name: "coupon_4", discount: 20, is_percent: false, condition: {"category": "food"}, schema_version: 1},
+    {name: "coupon_5", discount: 20, is_percent: false, condition: {"price_above": 100}, schema_version: 1},
+    {name: "coupon_6", discount: 20, is_percent: false, condition: {"price_above": 50}, schema_version: 1},
+    {name: "coupon_7", discount: 20, is_percent: false, condition: {"price_above": 150}, schema_version: 1},
+    {name: "coupon_8", discount: 20, is_percent: false, validity: {"start": ISODate("2022-01-01"), "end": ISODate("2026-01-01")}, schema_version: 1},
+    {name: "coupon_9", discount: 20, is_percent: false, validity: {"start": ISODate("2022-01-01"), "end": ISODate("2022-01-01")}, schema_version: 1},
 ]);
+
+// Indexes declared by MongoDBCouponStorage, also ensured when the API starts
+// Coupon names are unique, the application relies on it to detect duplicates
+db.coupons.createIndex({name: 1}, {unique: true});
+db.coupons.createIndex({"condition.category": 1, "condition.price_above": 1});
+db.coupons.createIndex({"validity.start": 1, "validity.end": 1});
@@ -0,0 +1 @@
+"""Performance benchmarks of the coupon challenge, run with `soldes-bench`."""
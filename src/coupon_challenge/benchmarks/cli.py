@@ -0,0 +1,221 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Annotated
+
+import typer
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+from coupon_challenge.benchmarks.load import (
+    SCENARIOS,
+    BenchmarkTarget,
+    ScenarioResult,
+    benchmark,
+    build_report,
+    compare_reports,
+    report_metadata,
+)
+from coupon_challenge.benchmarks.micro import (
+    KERNELS,
+    KernelResult,
+    ParityError,
+    find_regressions,
+    run_kernels,
+)
+from coupon_challenge.settings import DBBackendEnum
+
+app = typer.Typer()
+
+DEFAULT_MICRO_BASELINE = Path("benchmarks/micro_baseline.json")
+
+
+def print_results(results: list[ScenarioResult]) -> None:
+    table = Table(
+        "Scenario", "Backend", "Target", "Route", "Count", "Errors", "p50", "p95", "p99"
+    )
+    for result in results:
+        table.add_row(
+            result.scenario,
+            result.backend,
+            result.target,
+            f"{result.throughput_rps:.0f} req/s",
+            str(result.requests),
+            str(result.errors),
+        )
+        for route, stats in result.routes.items():
+            table.add_row(
+                "",
+                "",
+                "",
+                route,
+                str(stats.count),
+                str(stats.errors),
+                f"{stats.p50_ms:.2f} ms",
+                f"{stats.p95_ms:.2f} ms",
+                f"{stats.p99_ms:.2f} ms",
+            )
+
+    Console().print(table)
+
+
+@app.command()
+def http(
+    scenarios: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--scenario", help=f"One of {', '.join(SCENARIOS)}, all by default"
+        ),
+    ] = None,
+    backends: Annotated[
+        list[DBBackendEnum] | None,
+        typer.Option("--backend", help="sqlite and memory by default"),
+    ] = None,
+    targets: Annotated[
+        list[BenchmarkTarget] | None,
+        typer.Option("--target", help="in-process by default"),
+    ] = None,
+    requests: Annotated[int, typer.Option(min=1)] = 2000,
+    concurrency: Annotated[int, typer.Option(min=1)] = 16,
+    mongo_uri: Annotated[
+        str | None,
+        typer.Option(help="MongoDB to benchmark, e.g. the one of docker compose"),
+    ] = None,
+    output: Annotated[
+        Path | None, typer.Option(help="Write the JSON report to this file")
+    ] = None,
+) -> None:
+    """Load test the HTTP API and report throughput and latency percentiles."""
+    unknown = set(scenarios or []) - set(SCENARIOS)
+    if unknown:
+        raise typer.BadParameter(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = []
+    for scenario_name in scenarios or SCENARIOS:
+        for backend in backends or [DBBackendEnum.sqlite, DBBackendEnum.memory]:
+            for target in targets or [BenchmarkTarget.in_process]:
+                results.append(
+                    asyncio.run(
+                        benchmark(
+                            SCENARIOS[scenario_name],
+                            backend,
+                            target,
+                            requests,
+                            concurrency,
+                            mongo_uri,
+                        )
+                    )
+                )
+
+    print_results(results)
+    if output:
+        output.write_text(json.dumps(build_report(results), indent=2))
+        print(f"Report written to {output}")
+
+
+@app.command()
+def compare(
+    baseline: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    current: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+) -> None:
+    """Compare the p95 latency and throughput of two JSON reports."""
+    rows = compare_reports(
+        json.loads(baseline.read_text()), json.loads(current.read_text())
+    )
+
+    table = Table("Scenario", "Backend", "Target", "Route", "p95", "Throughput")
+    for row in rows:
+        table.add_row(
+            row["scenario"],
+            row["backend"],
+            row["target"],
+            row["route"],
+            f"{row['baseline_p95_ms']:.2f} -> {row['p95_ms']:.2f} ms",
+            f"{row['baseline_throughput_rps']:.0f} -> {row['throughput_rps']:.0f} req/s",
+        )
+
+    Console().print(table)
+
+
+def print_kernel_results(
+    results: list[KernelResult], baseline: dict[str, float]
+) -> None:
+    table = Table("Kernel", "ns/op", "Baseline ns/op", "Peak allocated")
+    for result in results:
+        table.add_row(
+            result.name,
+            f"{result.ns_per_op:.1f}",
+            f"{baseline[result.name]:.1f}" if result.name in baseline else "",
+            f"{result.peak_alloc_bytes} B",
+        )
+
+    Console().print(table)
+
+
+@app.command()
+def micro(
+    kernels: Annotated[
+        list[str] | None,
+        typer.Option("--kernel", help=f"One of {', '.join(KERNELS)}, all by default"),
+    ] = None,
+    operations: Annotated[int, typer.Option(min=1)] = 1_000_000,
+    repeat: Annotated[int, typer.Option(min=1)] = 3,
+    seed: int = 0,
+    baseline: Annotated[
+        Path, typer.Option(help="ns/op of every kernel to compare with")
+    ] = DEFAULT_MICRO_BASELINE,
+    threshold: Annotated[
+        float, typer.Option(min=0, help="Tolerated slowdown, 0.1 is 10%")
+    ] = 0.25,
+    save_baseline: Annotated[
+        bool, typer.Option(help="Store these results as the new baseline")
+    ] = False,
+) -> None:
+    """Time the pricing and eligibility kernel after checking it against legacy.py.
+
+    Exits with 1 when results differ from legacy or when a kernel is slower than
+    its baseline by more than the threshold.
+    """
+    unknown = set(kernels or []) - set(KERNELS)
+    if unknown:
+        raise typer.BadParameter(f"Unknown kernels: {', '.join(sorted(unknown))}")
+
+    try:
+        results = run_kernels(
+            [KERNELS[name] for name in kernels or KERNELS], operations, repeat, seed
+        )
+    except ParityError as error:
+        print(f"[bold red]Legacy parity broken: {error}")
+        raise typer.Exit(1)
+
+    baseline_ns_per_op = (
+        json.loads(baseline.read_text())["ns_per_op"] if baseline.exists() else {}
+    )
+    print_kernel_results(results, baseline_ns_per_op)
+
+    if save_baseline:
+        baseline.parent.mkdir(parents=True, exist_ok=True)
+        baseline.write_text(
+            json.dumps(
+                {
+                    "metadata": report_metadata(),
+                    "ns_per_op": {
+                        **baseline_ns_per_op,
+                        **{result.name: result.ns_per_op for result in results},
+                    },
+                },
+                indent=2,
+            )
+        )
+        print(f"Baseline written to {baseline}")
+        return
+
+    regressions = find_regressions(results, baseline_ns_per_op, threshold)
+    for regression in regressions:
+        print(
+            f"[bold red]{regression.name} is {regression.slowdown:.0%} slower than"
+            f" its baseline"
+        )
+    if regressions:
+        raise typer.Exit(1)
@@ -0,0 +1,535 @@
+"""End to end load tests of the HTTP API.
+
+A scenario seeds coupons through the API, then replays a scripted request mix
+with a fixed number of concurrent clients against a target: the application
+driven in-process through its ASGI interface, or a local uvicorn server. Each
+(scenario, backend, target) run starts from an empty storage and reports its
+throughput plus latency percentiles per route.
+"""
+
+import asyncio
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from enum import StrEnum
+from typing import Any, AsyncIterator, Callable, Iterator
+
+import httpx
+
+from coupon_challenge.models.product import ProductCategory
+from coupon_challenge.settings import (
+    DBBackendEnum,
+    get_app_settings,
+    get_mongodb_settings,
+    get_sqlite_settings,
+)
+
+
+class BenchmarkTarget(StrEnum):
+    in_process = "in-process"
+    uvicorn = "uvicorn"
+
+
+@dataclass
+class RequestSpec:
+    method: str
+    url: str
+    # Route template the latency is reported under, e.g. GET /coupons/{name}
+    route: str
+    json: Any = None
+    params: dict[str, Any] | None = None
+    headers: dict[str, str] | None = None
+
+
+@dataclass
+class ScenarioState:
+    """Coupons known to exist, updated by the requests of the scenario."""
+
+    rng: random.Random
+    prefix: str
+    names: list[str] = field(default_factory=list)
+    created: int = 0
+
+    def pick(self) -> str:
+        return self.rng.choice(self.names)
+
+    def new_name(self) -> str:
+        self.created += 1
+        return f"{self.prefix}{self.created:08}"
+
+
+def random_coupon(state: ScenarioState, name: str) -> dict[str, Any]:
+    rng = state.rng
+    coupon: dict[str, Any] = {
+        "name": name,
+        "discount": f"{rng.randint(1, 60)}%"
+        if rng.random() < 0.5
+        else rng.randint(1, 50),
+    }
+    condition = rng.choice(
+        [None, {"category": rng.choice(list(ProductCategory))}, {"price_above": 50}]
+    )
+    if condition:
+        coupon["condition"] = condition
+    if rng.random() < 0.3:
+        coupon["validity"] = {"start": "2024-01-01", "end": "2030-01-01"}
+
+    return coupon
+
+
+def random_product(state: ScenarioState) -> dict[str, Any]:
+    return {
+        "name": "product",
+        "price": state.rng.randint(1, 500),
+        "category": state.rng.choice(list(ProductCategory)),
+    }
+
+
+def read_heavy(state: ScenarioState) -> Iterator[RequestSpec]:
+    while True:
+        if state.rng.random() < 0.9:
+            yield RequestSpec("GET", f"/coupons/{state.pick()}", "GET /coupons/{name}")
+        else:
+            yield RequestSpec(
+                "GET",
+                "/coupons/",
+                "GET /coupons/?limit",
+                params={"limit": 50, "after": state.pick()},
+            )
+
+
+def apply_storm(state: ScenarioState) -> Iterator[RequestSpec]:
+    while True:
+        yield RequestSpec(
+            "POST",
+            f"/coupons/{state.pick()}/apply_product",
+            "POST /coupons/{name}/apply_product",
+            json=random_product(state),
+        )
+
+
+def mixed_crud(state: ScenarioState) -> Iterator[RequestSpec]:
+    while True:
+        draw = state.rng.random()
+        if draw < 0.4:
+            yield RequestSpec("GET", f"/coupons/{state.pick()}", "GET /coupons/{name}")
+        elif draw < 0.6:
+            name = state.new_name()
+            state.names.append(name)
+            yield RequestSpec(
+                "POST", "/coupons/", "POST /coupons/", json=random_coupon(state, name)
+            )
+        elif draw < 0.8:
+            yield RequestSpec(
+                "PUT",
+                "/coupons/",
+                "PUT /coupons/",
+                json={"name": state.pick(), "discount": state.rng.randint(1, 50)},
+            )
+        elif draw < 0.9 and len(state.names) > 1:
+            name = state.names.pop(state.rng.randrange(len(state.names)))
+            yield RequestSpec("DELETE", f"/coupons/{name}", "DELETE /coupons/{name}")
+        else:
+            yield RequestSpec(
+                "GET", "/coupons/", "GET /coupons/?limit", params={"limit": 50}
+            )
+
+
+def large_list(state: ScenarioState) -> Iterator[RequestSpec]:
+    while True:
+        if state.rng.random() < 0.5:
+            yield RequestSpec("GET", "/coupons/", "GET /coupons/")
+        else:
+            yield RequestSpec(
+                "GET",
+                "/coupons/",
+                "GET /coupons/ (ndjson)",
+                headers={"Accept": "application/x-ndjson"},
+            )
+
+
+@dataclass
+class Scenario:
+    name: str
+    # Coupons created before measuring
+    seed: int
+    requests: Callable[[ScenarioState], Iterator[RequestSpec]]
+
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("read_heavy", 1000, read_heavy),
+        Scenario("apply_storm", 1000, apply_storm),
+        Scenario("mixed_crud", 500, mixed_crud),
+        Scenario("large_list", 10_000, large_list),
+    ]
+}
+
+
+def percentile(sorted_values: list[float], rank: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+
+    return sorted_values[max(0, math.ceil(rank / 100 * len(sorted_values)) - 1)]
+
+
+@dataclass
+class RouteStats:
+    count: int
+    # Responses with a 5xx status or failed requests
+    errors: int
+    # Responses with a 4xx status, expected in some scenarios (not applicable...)
+    client_errors: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+    @classmethod
+    def from_samples(
+        cls, latencies_ns: list[int], errors: int, client_errors: int
+    ) -> "RouteStats":
+        values = sorted(latency / 1e6 for latency in latencies_ns)
+        return cls(
+            count=len(values),
+            errors=errors,
+            client_errors=client_errors,
+            p50_ms=percentile(values, 50),
+            p95_ms=percentile(values, 95),
+            p99_ms=percentile(values, 99),
+            max_ms=values[-1] if values else 0.0,
+        )
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    backend: str
+    target: str
+    requests: int
+    concurrency: int
+    errors: int
+    duration_s: float
+    throughput_rps: float
+    routes: dict[str, RouteStats]
+
+
+class LatencyRecorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[int]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.client_errors: dict[str, int] = defaultdict(int)
+
+    def record(self, route: str, latency_ns: int, status_code: int | None) -> None:
+        self.latencies[route].append(latency_ns)
+        if status_code is None or status_code >= 500:
+            self.errors[route] += 1
+        elif status_code >= 400:
+            self.client_errors[route] += 1
+
+    def routes(self) -> dict[str, RouteStats]:
+        return {
+            route: RouteStats.from_samples(
+                latencies, self.errors[route], self.client_errors[route]
+            )
+            for route, latencies in sorted(self.latencies.items())
+        }
+
+
+async def send(client: httpx.AsyncClient, spec: RequestSpec) -> int | None:
+    try:
+        response = await client.request(
+            spec.method,
+            spec.url,
+            json=spec.json,
+            params=spec.params,
+            headers=spec.headers,
+        )
+    except httpx.HTTPError:
+        return None
+
+    return response.status_code
+
+
+async def run_concurrently(
+    specs: Iterator[RequestSpec],
+    count: int,
+    concurrency: int,
+    handle: Callable[[RequestSpec], Any],
+) -> None:
+    """Send `count` requests from `specs`, `concurrency` at a time."""
+    remaining = count
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await handle(next(specs))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def seed_coupons(
+    client: httpx.AsyncClient, state: ScenarioState, count: int, concurrency: int
+) -> None:
+    def creations() -> Iterator[RequestSpec]:
+        while True:
+            name = state.new_name()
+            state.names.append(name)
+            yield RequestSpec(
+                "POST", "/coupons/", "seed", json=random_coupon(state, name)
+            )
+
+    await run_concurrently(
+        creations(), count, concurrency, lambda spec: send(client, spec)
+    )
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    requests: int,
+    concurrency: int,
+    seed: int = 0,
+) -> tuple[dict[str, RouteStats], float, ScenarioState]:
+    """Seed the coupons of a scenario, then replay and time its request mix."""
+    # Prefixed names so runs sharing a database do not collide
+    state = ScenarioState(random.Random(seed), prefix=f"bench-{uuid.uuid4().hex[:8]}-")
+    await seed_coupons(client, state, scenario.seed, concurrency)
+
+    recorder = LatencyRecorder()
+
+    async def timed(spec: RequestSpec) -> None:
+        started = time.perf_counter_ns()
+        status_code = await send(client, spec)
+        recorder.record(spec.route, time.perf_counter_ns() - started, status_code)
+
+    started = time.perf_counter()
+    await run_concurrently(scenario.requests(state), requests, concurrency, timed)
+    duration = time.perf_counter() - started
+
+    return recorder.routes(), duration, state
+
+
+async def delete_coupons(
+    client: httpx.AsyncClient, state: ScenarioState, concurrency: int
+) -> None:
+    names = iter(
+        RequestSpec("DELETE", f"/coupons/{name}", "cleanup") for name in state.names
+    )
+    await run_concurrently(
+        names, len(state.names), concurrency, lambda spec: send(client, spec)
+    )
+
+
+def backend_environment(
+    backend: DBBackendEnum, directory: str, mongo_uri: str | None
+) -> dict[str, str]:
+    environment = {"COUPON_CHALLENGE_DB_BACKEND": backend.value}
+    if backend == DBBackendEnum.sqlite:
+        environment["COUPON_CHALLENGE_SQLITE_DB_PATH"] = os.path.join(
+            directory, "bench.db"
+        )
+    elif backend == DBBackendEnum.mongo:
+        if not mongo_uri:
+            raise ValueError("A MongoDB URI is required to benchmark the mongo backend")
+        environment["COUPON_CHALLENGE_MONGO_DB_URI"] = mongo_uri
+
+    return environment
+
+
+@contextmanager
+def patched_environment(environment: dict[str, str]) -> Iterator[None]:
+    """Apply settings through environment variables, restoring them afterwards."""
+    previous = {key: os.environ.get(key) for key in environment}
+    os.environ.update(environment)
+    for get_settings in (get_app_settings, get_sqlite_settings, get_mongodb_settings):
+        get_settings.cache_clear()
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        for get_settings in (
+            get_app_settings,
+            get_sqlite_settings,
+            get_mongodb_settings,
+        ):
+            get_settings.cache_clear()
+
+
+@asynccontextmanager
+async def in_process_client(
+    environment: dict[str, str],
+) -> AsyncIterator[httpx.AsyncClient]:
+    """Client calling the application through ASGI, without any network."""
+    from coupon_challenge.main import app
+
+    with patched_environment(environment):
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://benchmark"
+            ) as client:
+                yield client
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def uvicorn_client(
+    environment: dict[str, str], startup_timeout: float = 30.0
+) -> AsyncIterator[httpx.AsyncClient]:
+    """Client of a uvicorn server started for the run, on a free local port."""
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "coupon_challenge.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env={**os.environ, **environment},
+    )
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60
+        ) as client:
+            deadline = time.monotonic() + startup_timeout
+            while True:
+                try:
+                    await client.get("/docs")
+                    break
+                except httpx.TransportError:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("The uvicorn server did not start")
+                    await asyncio.sleep(0.1)
+
+            yield client
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+TARGET_CLIENTS = {
+    BenchmarkTarget.in_process: in_process_client,
+    BenchmarkTarget.uvicorn: uvicorn_client,
+}
+
+
+async def benchmark(
+    scenario: Scenario,
+    backend: DBBackendEnum,
+    target: BenchmarkTarget,
+    requests: int,
+    concurrency: int,
+    mongo_uri: str | None = None,
+    seed: int = 0,
+) -> ScenarioResult:
+    with tempfile.TemporaryDirectory() as directory:
+        environment = backend_environment(backend, directory, mongo_uri)
+        async with TARGET_CLIENTS[target](environment) as client:
+            routes, duration, state = await run_scenario(
+                client, scenario, requests, concurrency, seed
+            )
+            if backend == DBBackendEnum.mongo:
+                # The only backend outliving the run
+                await delete_coupons(client, state, concurrency)
+
+    return ScenarioResult(
+        scenario=scenario.name,
+        backend=backend.value,
+        target=target.value,
+        requests=requests,
+        concurrency=concurrency,
+        errors=sum(route.errors for route in routes.values()),
+        duration_s=duration,
+        throughput_rps=requests / duration if duration else 0.0,
+        routes=routes,
+    )
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report_metadata() -> dict[str, Any]:
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def build_report(results: list[ScenarioResult]) -> dict[str, Any]:
+    return {
+        "metadata": report_metadata(),
+        "results": [asdict(result) for result in results],
+    }
+
+
+def compare_reports(
+    baseline: dict[str, Any], current: dict[str, Any]
+) -> list[dict[str, Any]]:
+    """p95 latency and throughput of every run found in both reports."""
+
+    def runs(report: dict[str, Any]) -> dict[tuple[str, str, str], dict[str, Any]]:
+        return {
+            (result["scenario"], result["backend"], result["target"]): result
+            for result in report["results"]
+        }
+
+    baseline_runs = runs(baseline)
+    rows = []
+    for key, result in runs(current).items():
+        if key not in baseline_runs:
+            continue
+        before = baseline_runs[key]
+        for route, stats in result["routes"].items():
+            if route not in before["routes"]:
+                continue
+            rows.append(
+                {
+                    "scenario": key[0],
+                    "backend": key[1],
+                    "target": key[2],
+                    "route": route,
+                    "baseline_p95_ms": before["routes"][route]["p95_ms"],
+                    "p95_ms": stats["p95_ms"],
+                    "baseline_throughput_rps": before["throughput_rps"],
+                    "throughput_rps": result["throughput_rps"],
+                }
+            )
+
+    return rows
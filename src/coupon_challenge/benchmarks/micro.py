@@ -0,0 +1,344 @@
+"""Micro benchmarks of the pricing and eligibility kernel.
+
+Every kernel runs over synthetic coupon/product pairs: the cartesian product of
+two pools of random coupons and products, large enough to give as many distinct
+pairs as operations. Timings are the best of a few repeats, in nanoseconds per
+operation including the loop itself. Allocations are the peak of memory traced by
+tracemalloc while running a sample of operations, nothing being kept between two
+of them.
+
+Before timing, the kernels are checked against legacy.py on every pair.
+"""
+
+import gc
+import itertools
+import math
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator
+
+from coupon_challenge.models.coupon import Coupon, CouponCreate
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.clock import FrozenClock, SystemClock
+from coupon_challenge.services.coupons import CompiledCoupon, CouponApplicabilityService
+
+Pair = tuple[Any, Any]
+
+
+def random_coupon_data(rng: random.Random, name: str) -> dict[str, Any]:
+    """A coupon as received by the API or by the legacy add_coupon command."""
+    data: dict[str, Any] = {
+        "name": name,
+        "discount": f"{rng.randint(0, 120)}%"
+        if rng.random() < 0.5
+        else rng.randint(0, 300),
+    }
+    condition = rng.choice(
+        [
+            None,
+            {"category": rng.choice(list(ProductCategory))},
+            {"price_above": rng.randint(0, 200)},
+            {"category": rng.choice(list(ProductCategory)), "price_above": 0},
+        ]
+    )
+    if condition:
+        data["condition"] = condition
+    # Years away from now, the validity of a pair does not change during a run
+    data["validity"] = rng.choice(
+        [
+            None,
+            ("2000-01-01", "2100-01-01"),
+            ("2000-01-01", "2001-01-01"),
+            ("2099-01-01", "2100-01-01"),
+        ]
+    )
+    if data["validity"] is None:
+        del data["validity"]
+
+    return data
+
+
+def random_product(rng: random.Random, name: str) -> Product:
+    return Product(
+        name=name,
+        price=rng.randint(0, 500),
+        category=rng.choice(list(ProductCategory)),
+    )
+
+
+def synthetic_pairs(left: list[Any], right: list[Any], count: int) -> Iterator[Pair]:
+    return itertools.islice(itertools.cycle(itertools.product(left, right)), count)
+
+
+@dataclass
+class Pools:
+    coupon_data: list[dict[str, Any]]
+    coupons: list[Coupon]
+    compiled_coupons: list[CompiledCoupon]
+    products: list[Product]
+
+    @classmethod
+    def generate(cls, operations: int, seed: int = 0) -> "Pools":
+        """Pools giving at least `operations` distinct pairs."""
+        rng = random.Random(seed)
+        size = math.isqrt(max(operations - 1, 0)) + 1
+        coupon_data = [random_coupon_data(rng, f"coupon_{i}") for i in range(size)]
+        coupons = [Coupon.model_validate(dict(data)) for data in coupon_data]
+        compiled_coupons = [CompiledCoupon.from_coupon(coupon) for coupon in coupons]
+        products = [random_product(rng, f"product_{i}") for i in range(size)]
+
+        return cls(coupon_data, coupons, compiled_coupons, products)
+
+    def coupon_product_pairs(self, count: int) -> Iterator[Pair]:
+        return synthetic_pairs(self.coupons, self.products, count)
+
+    def compiled_coupon_product_pairs(self, count: int) -> Iterator[Pair]:
+        return synthetic_pairs(self.compiled_coupons, self.products, count)
+
+    def coupon_data_pairs(self, count: int) -> Iterator[Pair]:
+        # Products are not needed to validate a coupon, pairs are only used to
+        # go through every coupon the same number of times as the other kernels
+        return synthetic_pairs(self.coupon_data, [None], count)
+
+
+@dataclass
+class Kernel:
+    name: str
+    # Runs the kernel on every pair
+    run: Callable[[Iterable[Pair]], None]
+    pairs: Callable[[Pools, int], Iterator[Pair]]
+
+
+def run_service_coupon_is_applicable(pairs: Iterable[Pair]) -> None:
+    # Frozen like the clock of a request
+    coupon_is_applicable = CouponApplicabilityService(
+        SystemClock().freeze()
+    ).coupon_is_applicable
+    for coupon, product in pairs:
+        coupon_is_applicable(coupon, product)
+
+
+def run_legacy_coupon_is_applicable(pairs: Iterable[Pair]) -> None:
+    # Imported when needed, legacy.py creates coupon.db in the working directory
+    from coupon_challenge import legacy
+
+    coupon_is_applicable = legacy.coupon_is_applicable
+    for coupon, product in pairs:
+        coupon_is_applicable(coupon, product)
+
+
+def run_service_apply_discount(pairs: Iterable[Pair]) -> None:
+    apply_discount = CouponApplicabilityService(SystemClock().freeze()).apply_discount
+    for coupon, product in pairs:
+        apply_discount(coupon, product)
+
+
+def run_legacy_apply_discount(pairs: Iterable[Pair]) -> None:
+    from coupon_challenge import legacy
+
+    apply_discount = legacy.apply_discount
+    for coupon, product in pairs:
+        apply_discount(coupon, product)
+
+
+def run_compiled_price_for(pairs: Iterable[Pair]) -> None:
+    # Eligibility and discount at once, a cart or a batch reads the clock once
+    now = SystemClock().epoch()
+    for coupon, product in pairs:
+        coupon.price_for(product.price, product.category, now)
+
+
+def run_coupon_validation(pairs: Iterable[Pair]) -> None:
+    # Also the validation of the legacy add_coupon and get_coupon commands
+    model_validate = Coupon.model_validate
+    for data, _ in pairs:
+        # save_discount rewrites the data it validates, validate a copy
+        model_validate(dict(data))
+
+
+def run_coupon_create_validation(pairs: Iterable[Pair]) -> None:
+    model_validate = CouponCreate.model_validate
+    for data, _ in pairs:
+        # Copied like in run_coupon_validation so both kernels do the same work
+        model_validate(dict(data))
+
+
+KERNELS: dict[str, Kernel] = {
+    kernel.name: kernel
+    for kernel in [
+        Kernel(
+            "service.coupon_is_applicable",
+            run_service_coupon_is_applicable,
+            Pools.coupon_product_pairs,
+        ),
+        Kernel(
+            "legacy.coupon_is_applicable",
+            run_legacy_coupon_is_applicable,
+            Pools.coupon_product_pairs,
+        ),
+        Kernel(
+            "service.apply_discount",
+            run_service_apply_discount,
+            Pools.coupon_product_pairs,
+        ),
+        Kernel(
+            "legacy.apply_discount",
+            run_legacy_apply_discount,
+            Pools.coupon_product_pairs,
+        ),
+        Kernel(
+            "CompiledCoupon.price_for",
+            run_compiled_price_for,
+            Pools.compiled_coupon_product_pairs,
+        ),
+        Kernel("Coupon.model_validate", run_coupon_validation, Pools.coupon_data_pairs),
+        Kernel(
+            "CouponCreate.model_validate",
+            run_coupon_create_validation,
+            Pools.coupon_data_pairs,
+        ),
+    ]
+}
+
+
+class ParityError(AssertionError):
+    pass
+
+
+def check_legacy_parity(pools: Pools, count: int) -> int:
+    """Compare the service and the models with legacy.py on `count` pairs.
+
+    Returns the number of pairs checked, raises a ParityError on the first pair
+    giving a different result.
+    """
+    from coupon_challenge import legacy
+
+    # Everything is evaluated at the same instant, naive for legacy.py
+    moment = datetime.now()
+    service = CouponApplicabilityService(FrozenClock(moment))
+    now = service.clock.epoch()
+    compiled_coupons = dict(zip(map(id, pools.coupons), pools.compiled_coupons))
+    checked = 0
+    for coupon, product in pools.coupon_product_pairs(count):
+        applicable = service.coupon_is_applicable(coupon, product)
+        if applicable != legacy.coupon_is_applicable(coupon, product, moment):
+            raise ParityError(
+                f"coupon_is_applicable differs for {coupon!r} and {product!r}"
+            )
+        price = None
+        if applicable:
+            price = service.apply_discount(coupon, product).price
+            # Unlike legacy.py, percent discounts above 100% bring prices to 0
+            if price != max(legacy.apply_discount(coupon, product), 0):
+                raise ParityError(
+                    f"apply_discount differs for {coupon!r} and {product!r}"
+                )
+        compiled_coupon = compiled_coupons[id(coupon)]
+        if compiled_coupon.price_for(product.price, product.category, now) != price:
+            raise ParityError(
+                f"CompiledCoupon.price_for differs for {coupon!r} and {product!r}"
+            )
+        checked += 1
+
+    # Coupons created through the API must be stored as legacy would have
+    for data in pools.coupon_data:
+        coupon_create = CouponCreate.model_validate(dict(data))
+        created = Coupon.model_validate(coupon_create.model_dump())
+        if created != Coupon.model_validate(dict(data)):
+            raise ParityError(f"Coupon validation differs for {data!r}")
+
+    return checked
+
+
+@dataclass
+class KernelResult:
+    name: str
+    operations: int
+    ns_per_op: float
+    # Peak of memory allocated while running the kernel, nothing outliving an
+    # operation this is what a single operation allocates at most
+    peak_alloc_bytes: int
+
+
+def time_kernel(kernel: Kernel, pools: Pools, operations: int, repeat: int) -> float:
+    best = math.inf
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            pairs = kernel.pairs(pools, operations)
+            started = time.perf_counter_ns()
+            kernel.run(pairs)
+            best = min(best, time.perf_counter_ns() - started)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return best / operations
+
+
+def trace_allocations(kernel: Kernel, pools: Pools, operations: int) -> int:
+    # Built beforehand so the iterator state is not traced
+    pairs = list(kernel.pairs(pools, operations))
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        kernel.run(pairs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak - start
+
+
+def run_kernels(
+    kernels: Iterable[Kernel],
+    operations: int,
+    repeat: int = 3,
+    seed: int = 0,
+    allocation_sample: int = 1000,
+) -> list[KernelResult]:
+    pools = Pools.generate(operations, seed)
+    check_legacy_parity(pools, operations)
+
+    return [
+        KernelResult(
+            name=kernel.name,
+            operations=operations,
+            ns_per_op=time_kernel(kernel, pools, operations, repeat),
+            peak_alloc_bytes=trace_allocations(
+                kernel, pools, min(operations, allocation_sample)
+            ),
+        )
+        for kernel in kernels
+    ]
+
+
+@dataclass
+class Regression:
+    name: str
+    baseline_ns_per_op: float
+    ns_per_op: float
+
+    @property
+    def slowdown(self) -> float:
+        return self.ns_per_op / self.baseline_ns_per_op - 1
+
+
+def find_regressions(
+    results: list[KernelResult], baseline: dict[str, float], threshold: float
+) -> list[Regression]:
+    """Kernels slower than their baseline ns/op by more than `threshold` (0.1 is 10%)."""
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+        regression = Regression(result.name, baseline[result.name], result.ns_per_op)
+        if regression.slowdown > threshold:
+            regressions.append(regression)
+
+    return regressions
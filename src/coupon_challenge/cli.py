@@ -1,12 +1,15 @@
 import asyncio
+import os
+import sys
+from contextlib import ExitStack, contextmanager
 from functools import wraps
-from typing import Annotated
+from pathlib import Path
+from typing import TYPE_CHECKING, Annotated, Iterator
 
 import typer
 from rich import print
-from rich.console import Console
-from rich.table import Table
 
+from coupon_challenge.models.cart import Cart, CartApplication
 from coupon_challenge.models.coupon import (
     Coupon,
     CouponCondition,
@@ -15,37 +18,96 @@ from coupon_challenge.models.coupon import (
     CouponValidity,
 )
 from coupon_challenge.models.product import Product
+from coupon_challenge.services.bulk import (
+    BulkImportReport,
+    CouponFileFormat,
+    ImportCheckpoint,
+    export_coupons,
+    import_coupons,
+)
+from coupon_challenge.services.clock import SystemClock
 from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.profiling import new_profile_id, profile_path, profiled
 from coupon_challenge.services.storage import (
+    CouponStorage,
     CouponStorageAlreadyExistsError,
     CouponStorageError,
     CouponStorageNotFoundError,
     CouponStorageProductNotApplicableError,
 )
-from coupon_challenge.services.storage.mongodb import MongoDBCouponStorage
-from coupon_challenge.services.storage.sqlite import SQLiteCouponStorage
-from coupon_challenge.settings import (
-    DBBackendEnum,
-    get_app_settings,
-    get_mongodb_settings,
-)
+from coupon_challenge.settings import get_app_settings, get_profiling_settings
+
+if TYPE_CHECKING:
+    # Imported by the commands using them only, with multiprocessing and sqlite3
+    from coupon_challenge.services.batch import BatchApplyReport
+    from coupon_challenge.services.migration import MigrationReport
 
 app = typer.Typer()
 coupons_app = typer.Typer()
 app.add_typer(coupons_app, name="coupons")
+db_app = typer.Typer()
+app.add_typer(db_app, name="db")
+migrate_app = typer.Typer()
+app.add_typer(migrate_app, name="migrate")
+
+
+@contextmanager
+def profiled_command() -> Iterator[None]:
+    directory = get_profiling_settings().directory
+    profile_id = new_profile_id()
+    try:
+        with profiled(directory, profile_id):
+            yield
+    finally:
+        # Even when the command failed, the profile is written all the same
+        typer.echo(
+            f"Profile written to {profile_path(directory, profile_id)}", err=True
+        )
 
 
 @app.callback()
-def main(ctx: typer.Context):
-    settings = get_app_settings()
-    if settings.db_backend == DBBackendEnum.mongo:
-        mongo_settings = get_mongodb_settings()
-        ctx.params["storage"] = MongoDBCouponStorage(mongo_settings.db_uri)
-    elif settings.db_backend == DBBackendEnum.sqlite:
-        ctx.params["storage"] = SQLiteCouponStorage()
+def main(
+    ctx: typer.Context,
+    profile: Annotated[
+        bool,
+        typer.Option(
+            "--profile", help="Profile the command, see COUPON_CHALLENGE_PROFILING_*"
+        ),
+    ] = False,
+):
+    if profile:
+        ctx.with_resource(profiled_command())
+
+    # The storage is created by the first command using it, see get_storage
+    ctx.obj = {}
+
+
+async def get_storage(ctx: typer.Context, initialize: bool = True) -> CouponStorage:
+    """The storage of the configured backend, created on first use and closed
+    when the command ends.
+
+    It is initialized like in the API lifespan, MongoDB relies on its unique
+    index to refuse duplicate names. `initialize=False` leaves the database
+    untouched, to inspect it.
+    """
+    if "storage" not in ctx.obj:
+        # Imported here with the backend it selects, --help and commands without
+        # storage do not pay for them
+        from coupon_challenge.services.storage.registry import create_coupon_storage
+
+        coupon_storage = create_coupon_storage(get_app_settings())
+        ctx.find_root().call_on_close(coupon_storage.close)
+        ctx.obj["storage"] = coupon_storage
+        if initialize:
+            await coupon_storage.initialize()
+
+    return ctx.obj["storage"]
 
 
 def print_coupons(coupons: list[Coupon]) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
     console = Console()
 
     table = Table("Name", "Discount", "Validity", "Condition")
@@ -70,6 +132,9 @@ def print_coupon(coupon: Coupon) -> None:
 
 
 def print_product(product: Product) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
     console = Console()
 
     table = Table("Name", "Price", "Category")
@@ -78,6 +143,33 @@ def print_product(product: Product) -> None:
     console.print(table)
 
 
+def print_cart_application(cart_application: CartApplication) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+
+    table = Table("Name", "Category", "Price", "Applicable", "Discounted price")
+    for line in cart_application.lines:
+        table.add_row(
+            line.product.name,
+            line.product.category,
+            str(line.product.price),
+            "yes" if line.applicable else "no",
+            str(line.price),
+        )
+    table.add_section()
+    table.add_row(
+        "Total",
+        "",
+        str(cart_application.total_price),
+        "",
+        str(cart_application.total_discounted_price),
+    )
+
+    console.print(table)
+
+
 def prompt_for_coupon_update() -> CouponUpdate:
     answers = {}
     # Very simple prompting
@@ -171,7 +263,8 @@ def handle_errors(func):
 @async_command
 async def list(ctx: typer.Context) -> None:
     """List all registered coupons"""
-    coupons = await ctx.params["storage"].get_all()
+    coupon_storage = await get_storage(ctx)
+    coupons = await coupon_storage.get_all()
     print_coupons(coupons)
 
 
@@ -180,7 +273,8 @@ async def list(ctx: typer.Context) -> None:
 @async_command
 async def get(ctx: typer.Context, name: str) -> None:
     """Get an existing coupon"""
-    coupon = await ctx.params["storage"].get(name)
+    coupon_storage = await get_storage(ctx)
+    coupon = await coupon_storage.get(name)
     print_coupon(coupon)
 
 
@@ -196,7 +290,8 @@ async def update(
     """Update an existing coupon"""
     coupon_update = coupon_update or prompt_for_coupon_update()
 
-    coupon = await ctx.params["storage"].update(coupon_update)
+    coupon_storage = await get_storage(ctx)
+    coupon = await coupon_storage.update(coupon_update)
     print("Coupon Updated :)")
     print_coupon(coupon)
 
@@ -213,7 +308,8 @@ async def create(
     """Create a coupon"""
     coupon_create = coupon_create or prompt_for_coupon_create()
 
-    coupon = await ctx.params["storage"].create(coupon_create)
+    coupon_storage = await get_storage(ctx)
+    coupon = await coupon_storage.create(coupon_create)
     print("Coupon Created :)")
     print_coupon(coupon)
 
@@ -223,7 +319,8 @@ async def create(
 @async_command
 async def delete(ctx: typer.Context, name: str) -> None:
     """Delete an existing coupon"""
-    await ctx.params["storage"].delete(name)
+    coupon_storage = await get_storage(ctx)
+    await coupon_storage.delete(name)
 
     print(f"Coupon {name} Deleted :)")
 
@@ -237,16 +334,30 @@ async def apply(
     product: Annotated[
         Product | None, typer.Argument(parser=Product.model_validate_json)
     ] = None,
+    cart: Annotated[
+        Cart | None,
+        typer.Option(
+            parser=Cart.model_validate_json,
+            help="JSON list of products to price in a single batch",
+        ),
+    ] = None,
 ) -> None:
-    """Test applicability of a Coupon over a Product"""
-    product = product or prompt_for_product()
+    """Test applicability of a Coupon over a Product, or over a whole cart"""
+    service = CouponApplicabilityService(SystemClock().freeze())
 
-    service = CouponApplicabilityService()
-
-    coupon = await ctx.params["storage"].get(coupon_name)
+    coupon_storage = await get_storage(ctx)
+    coupon = await coupon_storage.get(coupon_name)
 
     print_coupon(coupon)
 
+    if cart is not None:
+        cart_application = service.apply_discount_to_cart(coupon, cart)
+        print_cart_application(cart_application)
+        print(f"Total discount: {cart_application.total_discount}")
+        return
+
+    product = product or prompt_for_product()
+
     if not service.coupon_is_applicable(coupon, product):
         print("Coupon not applicable for this product :(")
         return
@@ -258,3 +369,228 @@ async def apply(
 
     print("Here your discount :)")
     print_product(new_product)
+
+
+def print_batch_progress(report: "BatchApplyReport") -> None:
+    typer.echo(
+        f"{report.read} lines read, {report.priced} priced, {report.rejected} rejected "
+        f"({report.throughput:.0f} lines/s)",
+        err=True,
+    )
+
+
+@coupons_app.command("apply-batch")
+@handle_errors
+@async_command
+async def apply_batch(
+    ctx: typer.Context,
+    path: Annotated[
+        Path, typer.Argument(help="JSONL file of products, - for stdin")
+    ] = Path("-"),
+    coupon_name: Annotated[
+        str | None,
+        typer.Option("--coupon", help="Only apply this coupon, all of them by default"),
+    ] = None,
+    output: Annotated[
+        Path, typer.Option("--output", "-o", help="JSONL results, - for stdout")
+    ] = Path("-"),
+    workers: Annotated[
+        int, typer.Option(min=1, help="Processes pricing inputs larger than a chunk")
+    ] = os.cpu_count() or 1,
+    chunk_size: Annotated[int, typer.Option(min=1)] = 1000,
+) -> None:
+    """Price a stream of products against coupons, one JSONL result per product"""
+    from coupon_challenge.services.batch import apply_coupons_to_products
+
+    coupon_storage = await get_storage(ctx)
+    if coupon_name is not None:
+        coupons = [await coupon_storage.get(coupon_name)]
+    else:
+        coupons = [coupon async for coupon in coupon_storage.iter_all()]
+
+    with ExitStack() as stack:
+        products = (
+            sys.stdin
+            if str(path) == "-"
+            else stack.enter_context(path.open(encoding="utf-8"))
+        )
+        results = (
+            sys.stdout
+            if str(output) == "-"
+            else stack.enter_context(output.open("w", encoding="utf-8"))
+        )
+        report = apply_coupons_to_products(
+            coupons,
+            products,
+            results,
+            # Every product is priced at the same instant
+            now=SystemClock().epoch(),
+            workers=workers,
+            chunk_size=chunk_size,
+            on_chunk=print_batch_progress,
+            on_error=print_import_error,
+        )
+
+    typer.echo(
+        f"{report.priced} products priced against {len(coupons)} coupons, "
+        f"{report.rejected} rejected in {report.elapsed:.1f}s "
+        f"({report.throughput:.0f} lines/s)",
+        err=True,
+    )
+
+
+def print_import_progress(report: BulkImportReport) -> None:
+    typer.echo(
+        f"{report.resumed_from + report.read} lines read, {report.imported} imported, "
+        f"{report.rejected} rejected ({report.throughput:.0f} lines/s)",
+        err=True,
+    )
+
+
+def print_import_error(line_number: int, reason: str) -> None:
+    typer.echo(f"line {line_number}: {reason}", err=True)
+
+
+@coupons_app.command("import")
+@handle_errors
+@async_command
+async def import_file(
+    ctx: typer.Context,
+    path: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    file_format: Annotated[
+        CouponFileFormat | None,
+        typer.Option("--format", help="Guessed from the file extension by default"),
+    ] = None,
+    chunk_size: Annotated[int, typer.Option(min=1)] = 1000,
+    resume: Annotated[
+        bool, typer.Option(help="Skip lines already imported by an interrupted run")
+    ] = True,
+) -> None:
+    """Import coupons from a JSONL or CSV file"""
+    checkpoint = ImportCheckpoint(path.with_name(f"{path.name}.checkpoint"))
+    if not resume:
+        checkpoint.clear()
+
+    with path.open(newline="") as file:
+        report = await import_coupons(
+            await get_storage(ctx),
+            file,
+            file_format or CouponFileFormat.from_path(path),
+            checkpoint=checkpoint,
+            chunk_size=chunk_size,
+            on_chunk=print_import_progress,
+            on_error=print_import_error,
+        )
+
+    if report.resumed_from:
+        print(f"Resumed after line {report.resumed_from}")
+    print(
+        f"{report.imported} coupons imported, {report.rejected} rejected "
+        f"in {report.elapsed:.1f}s ({report.throughput:.0f} lines/s)"
+    )
+
+
+@coupons_app.command("export")
+@handle_errors
+@async_command
+async def export_file(
+    ctx: typer.Context,
+    path: Annotated[Path, typer.Argument(help="Output file, - for stdout")],
+    file_format: Annotated[
+        CouponFileFormat | None,
+        typer.Option("--format", help="Guessed from the file extension by default"),
+    ] = None,
+    batch_size: Annotated[int, typer.Option(min=1)] = 1000,
+) -> None:
+    """Export every coupon to a JSONL or CSV file"""
+    file_format = file_format or CouponFileFormat.from_path(path)
+
+    if str(path) == "-":
+        count = await export_coupons(
+            await get_storage(ctx), sys.stdout, file_format, batch_size
+        )
+    else:
+        with path.open("w", newline="") as file:
+            count = await export_coupons(
+                await get_storage(ctx), file, file_format, batch_size
+            )
+
+    typer.echo(f"{count} coupons exported", err=True)
+
+
+@db_app.command()
+@handle_errors
+@async_command
+async def check(ctx: typer.Context) -> None:
+    """Check the database has every index the storage relies on"""
+    # Not initialized, that would create the missing indexes
+    coupon_storage = await get_storage(ctx, initialize=False)
+    missing = await coupon_storage.missing_indexes()
+
+    if missing:
+        for name in missing:
+            print(f"Missing index: {name}")
+        print("Indexes are created when the API or a command opens the database")
+        raise typer.Exit(code=1)
+
+    print("Every index is present :)")
+
+
+def print_migration_progress(report: "MigrationReport") -> None:
+    typer.echo(
+        f"{report.read} rows read, {report.migrated} migrated, "
+        f"{report.rejected} rejected ({report.throughput:.0f} rows/s)",
+        err=True,
+    )
+
+
+def print_migration_error(rowid: int, reason: str) -> None:
+    typer.echo(f"row {rowid}: {reason}", err=True)
+
+
+@migrate_app.command("legacy")
+@handle_errors
+@async_command
+async def migrate_legacy(
+    ctx: typer.Context,
+    path: Annotated[
+        Path,
+        typer.Argument(exists=True, dir_okay=False, help="Database of legacy.py"),
+    ],
+    chunk_size: Annotated[int, typer.Option(min=1)] = 1000,
+    resume: Annotated[
+        bool, typer.Option(help="Skip rows already migrated by an interrupted run")
+    ] = True,
+) -> None:
+    """Copy the coupons of the legacy.py database into the configured backend"""
+    from coupon_challenge.services.migration import (
+        migrate_legacy_coupons,
+        open_legacy_database,
+    )
+
+    checkpoint = ImportCheckpoint(path.with_name(f"{path.name}.migration.checkpoint"))
+    if not resume:
+        checkpoint.clear()
+
+    # Opened first: with the SQLite backend both databases default to coupon.db,
+    # the legacy table being read while the coupons table is written
+    coupon_storage = await get_storage(ctx)
+    connection = open_legacy_database(path)
+    try:
+        report = await migrate_legacy_coupons(
+            connection,
+            coupon_storage,
+            checkpoint=checkpoint,
+            chunk_size=chunk_size,
+            on_chunk=print_migration_progress,
+            on_error=print_migration_error,
+        )
+    finally:
+        connection.close()
+
+    if report.resumed_from:
+        print(f"Resumed after row {report.resumed_from}")
+    print(
+        f"{report.migrated} coupons migrated, {report.rejected} rejected "
+        f"in {report.elapsed:.1f}s ({report.throughput:.0f} rows/s)"
+    )
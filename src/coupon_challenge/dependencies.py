@@ -1,9 +1,12 @@
-from typing import Generator
+from typing import AsyncGenerator
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 
-from coupon_challenge.exceptions import CouponChallengeSettingsError
+from coupon_challenge.services.clock import Clock, SystemClock
 from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.metrics import STORAGE_ERRORS
+from coupon_challenge.services.responses import CouponResponseCache
+from coupon_challenge.services.search import CouponSearchEngine
 from coupon_challenge.services.storage import (
     CouponStorage,
     CouponStorageAlreadyExistsError,
@@ -11,11 +14,9 @@ from coupon_challenge.services.storage import (
     CouponStorageNotFoundError,
     CouponStorageProductNotApplicableError,
 )
-from coupon_challenge.services.storage.mongodb import MongoDBCouponStorage
-from coupon_challenge.services.storage.sqlite import SQLiteCouponStorage
+from coupon_challenge.services.storage.registry import CouponStorageRegistry
 from coupon_challenge.settings import (
     AppChallengeSettings,
-    DBBackendEnum,
     MongoDBSettings,
     get_app_settings,
     get_mongodb_settings,
@@ -30,41 +31,74 @@ def dep_mongo_settings() -> MongoDBSettings:
     return get_mongodb_settings()
 
 
-def get_mongo_storage(settings: MongoDBSettings) -> MongoDBCouponStorage:
-    return MongoDBCouponStorage(settings.db_uri)
+def dep_storage_registry(request: Request) -> CouponStorageRegistry:
+    # Populated by the application lifespan, see main.py
+    return request.app.state.coupon_storage_registry
 
 
-def get_coupon_storage(
+# Any other storage error is an internal error
+STORAGE_ERROR_RESPONSES: list[tuple[type[CouponStorageError], int, str]] = [
+    (CouponStorageAlreadyExistsError, 409, "Coupon with this name already exists"),
+    (CouponStorageNotFoundError, 404, "Coupon not found"),
+    (
+        CouponStorageProductNotApplicableError,
+        422,
+        "The coupon is not applicable to this product",
+    ),
+]
+
+
+def storage_error_response(error: CouponStorageError) -> tuple[int, str]:
+    for error_type, status_code, detail in STORAGE_ERROR_RESPONSES:
+        if isinstance(error, error_type):
+            return status_code, detail
+
+    return 500, "An internal storage error occurred"
+
+
+async def get_coupon_storage(
     settings: AppChallengeSettings = Depends(dep_app_settings),
-) -> Generator[CouponStorage, None]:
-    if settings.db_backend == DBBackendEnum.mongo:
-        coupon_storage = get_mongo_storage(get_mongodb_settings())
-    elif settings.db_backend == DBBackendEnum.sqlite:
-        # TODO: make settings for sqlite backend
-        coupon_storage = SQLiteCouponStorage()
-    else:
-        raise CouponChallengeSettingsError()
+    registry: CouponStorageRegistry = Depends(dep_storage_registry),
+) -> AsyncGenerator[CouponStorage, None]:
+    # The storage is shared by the whole worker, it must not be closed here
+    coupon_storage = registry.get(settings.db_backend)
 
     try:
         yield coupon_storage
-    except CouponStorageAlreadyExistsError:
-        raise HTTPException(
-            status_code=409, detail="Coupon with this name already exists"
-        )
-    except CouponStorageNotFoundError:
-        raise HTTPException(status_code=404, detail="Coupon not found")
-    except CouponStorageProductNotApplicableError:
-        raise HTTPException(
-            status_code=422, detail="The coupon is not applicable to this product"
-        )
-    except CouponStorageError:
-        raise HTTPException(
-            status_code=500, detail="An internal storage error occurred"
-        )
-    finally:
-        # We properly close the connection
-        coupon_storage.close()
-
-
-def get_coupon_service() -> CouponApplicabilityService:
-    return CouponApplicabilityService()
+    except CouponStorageError as error:
+        STORAGE_ERRORS.labels(type(error).__name__).inc()
+        status_code, detail = storage_error_response(error)
+        raise HTTPException(status_code=status_code, detail=detail)
+
+
+def get_clock() -> Clock:
+    # Overridden by tests and benchmarks to freeze time
+    return SystemClock()
+
+
+def get_coupon_service(clock: Clock = Depends(get_clock)) -> CouponApplicabilityService:
+    # Every coupon of a request is checked at the same instant
+    return CouponApplicabilityService(clock.freeze())
+
+
+def dep_coupon_search_engine(request: Request) -> CouponSearchEngine:
+    # Built by the application lifespan, see main.py. Writes update it in place,
+    # they never wait for a reload
+    return request.app.state.coupon_search_engine
+
+
+async def get_coupon_search_engine(
+    settings: AppChallengeSettings = Depends(dep_app_settings),
+    coupon_storage: CouponStorage = Depends(get_coupon_storage),
+    coupon_search_engine: CouponSearchEngine = Depends(dep_coupon_search_engine),
+) -> CouponSearchEngine:
+    await coupon_search_engine.refresh_if_stale(
+        coupon_storage, settings.search_refresh_interval
+    )
+
+    return coupon_search_engine
+
+
+def get_coupon_response_cache(request: Request) -> CouponResponseCache:
+    # Built by the application lifespan, see main.py
+    return request.app.state.coupon_response_cache
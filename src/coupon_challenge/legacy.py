@@ -76,17 +76,20 @@ def apply_discount(coupon: Coupon, product: Product) -> int:
     return _apply_fixed_discount(coupon.discount, product.price)
 
 
-def coupon_is_valid(coupon: Coupon) -> bool:
+def coupon_is_valid(coupon: Coupon, now: datetime | None = None) -> bool:
     # If coupon has no validity period, it means it is always valid
     if not coupon.validity:
         return True
 
-    # I do not handle TZ
-    return coupon.validity.start <= datetime.now() <= coupon.validity.end
+    # I do not handle TZ, `now` must be as naive or aware as the validity
+    now = now or datetime.now()
+    return coupon.validity.start <= now <= coupon.validity.end
 
 
-def coupon_is_applicable(coupon: Coupon, product: Product) -> bool:
-    if not coupon_is_valid(coupon):
+def coupon_is_applicable(
+    coupon: Coupon, product: Product, now: datetime | None = None
+) -> bool:
+    if not coupon_is_valid(coupon, now):
         return False
 
     if not coupon.condition:
@@ -1,6 +1,50 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 
-from coupon_challenge.routers import coupons
+from coupon_challenge.middlewares import MetricsMiddleware, ProfilingMiddleware
+from coupon_challenge.routers import coupons, metrics, products
+from coupon_challenge.services.responses import CouponResponseCache
+from coupon_challenge.services.search import CouponSearchEngine
+from coupon_challenge.services.storage.registry import CouponStorageRegistry
+from coupon_challenge.settings import get_app_settings, get_response_cache_settings
+
+
+def build_response_cache() -> CouponResponseCache:
+    settings = get_response_cache_settings()
+    return CouponResponseCache(
+        # Nothing is kept when disabled, ETags are still computed
+        ttl=settings.ttl if get_app_settings().response_cache_enabled else 0,
+        max_size=settings.max_size,
+        gzip_min_size=settings.gzip_min_size,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # One pooled storage client per worker, shared by every request
+    registry = CouponStorageRegistry()
+    app.state.coupon_storage_registry = registry
+
+    try:
+        coupon_storage = await registry.open(get_app_settings())
+
+        coupon_search_engine = CouponSearchEngine()
+        await coupon_search_engine.load(coupon_storage)
+        app.state.coupon_search_engine = coupon_search_engine
+
+        app.state.coupon_response_cache = build_response_cache()
+
+        yield
+    finally:
+        registry.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(coupons.router)
+app.include_router(products.router)
+app.include_router(metrics.router)
+app.add_middleware(ProfilingMiddleware)
+# Outermost, its timings include the profiling overhead
+app.add_middleware(MetricsMiddleware)
@@ -0,0 +1,131 @@
+import time
+from urllib.parse import parse_qs
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from coupon_challenge.services.metrics import (
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS_IN_FLIGHT_CHILD,
+)
+from coupon_challenge.services.profiling import is_signed_profile_request, profiled
+from coupon_challenge.settings import (
+    ProfilingSettings,
+    get_app_settings,
+    get_profiling_settings,
+)
+
+# Route label of the requests not matching any route, the raw path would give an
+# unbounded number of series
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """Count in-flight requests and time them by method, route template and status.
+
+    Plain ASGI rather than BaseHTTPMiddleware so that it costs a couple of
+    function calls per request and does not buffer streamed responses, which are
+    timed until their last chunk is sent.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT_CHILD.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT_CHILD.dec()
+            # Set on the scope by the router once a route matched
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"],
+                getattr(route, "path", UNMATCHED_ROUTE),
+                str(status_code),
+            ).observe(time.perf_counter() - started)
+
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY_PARAMETER = "profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+
+class ProfilingMiddleware:
+    """Profile the requests asking for it with a signature, or one out of N.
+
+    A request is profiled when its X-Profile header or its profile query parameter
+    holds the signature of its path (see sign_profile_request), or when it is
+    sampled. The ID of the profile written is returned in the X-Profile-Id header.
+
+    cProfile follows the thread of the event loop: the other requests served
+    while awaiting show up in the profile too. A single request is profiled at a
+    time, the others go on unprofiled.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._requests = 0
+        self._profiling = False
+
+    def _should_profile(self, scope: Scope, settings: ProfilingSettings) -> bool:
+        self._requests += 1
+        if settings.sample_every and self._requests % settings.sample_every == 0:
+            return True
+
+        if settings.secret is None:
+            return False
+
+        signatures = [
+            value.decode("latin-1")
+            for name, value in scope["headers"]
+            if name == PROFILE_HEADER.lower().encode()
+        ]
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        signatures += query.get(PROFILE_QUERY_PARAMETER, [])
+
+        secret = settings.secret.get_secret_value()
+        return any(
+            is_signed_profile_request(secret, scope["path"], signature)
+            for signature in signatures
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or not get_app_settings().profiling_enabled
+            or self._profiling
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        settings = get_profiling_settings()
+        if not self._should_profile(scope, settings):
+            await self.app(scope, receive, send)
+            return
+
+        self._profiling = True
+        try:
+            with profiled(settings.directory) as profile_id:
+
+                async def send_with_profile_id(message: Message) -> None:
+                    if message["type"] == "http.response.start":
+                        MutableHeaders(scope=message)[PROFILE_ID_HEADER] = profile_id
+                    await send(message)
+
+                await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self._profiling = False
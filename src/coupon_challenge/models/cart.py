@@ -0,0 +1,22 @@
+from pydantic import BaseModel, NonNegativeInt, RootModel
+
+from coupon_challenge.models.product import Product
+
+
+class Cart(RootModel[list[Product]]):
+    root: list[Product]
+
+
+class CartLine(BaseModel):
+    product: Product
+    applicable: bool
+    # Price after discount, the original price when the coupon is not applicable
+    price: NonNegativeInt
+
+
+class CartApplication(BaseModel):
+    coupon: str
+    lines: list[CartLine]
+    total_price: NonNegativeInt
+    total_discounted_price: NonNegativeInt
+    total_discount: NonNegativeInt
@@ -6,6 +6,24 @@ from pydantic import BaseModel, ConfigDict, NonNegativeInt, model_validator
 
 from coupon_challenge.models.product import ProductCategory
 
+# Faster than calling ProductCategory on each value
+CATEGORIES = {category.value: category for category in ProductCategory}
+
+
+def construct_trusted[M: BaseModel](model_cls: type[M], values: dict[str, Any]) -> M:
+    """Instance of a model holding `values` as is, every field being set.
+
+    What model_construct does, without handling defaults, aliases and extra or
+    private attributes, which is several times cheaper than validating.
+    """
+    model = object.__new__(model_cls)
+    object.__setattr__(model, "__dict__", values)
+    object.__setattr__(model, "__pydantic_fields_set__", set(values))
+    object.__setattr__(model, "__pydantic_extra__", None)
+    object.__setattr__(model, "__pydantic_private__", None)
+
+    return model
+
 
 class CouponCondition(BaseModel):
     model_config = ConfigDict(extra="forbid")
@@ -54,10 +72,47 @@ class Coupon(CouponBase):
                 data["is_percent"] = True
                 data["discount"] = int(data["discount"][:-1])
 
-            # TODO: add a check to cap percent discount below 100%
+            # Percent discounts above 100% are accepted, they bring prices to 0
 
         return data
 
+    @classmethod
+    def from_trusted(
+        cls,
+        name: str,
+        discount: int,
+        is_percent: bool,
+        condition: dict[str, Any] | None = None,
+        validity: CouponValidity | None = None,
+    ) -> "Coupon":
+        """Build a coupon from fields validated before being stored, without
+        running any validator.
+
+        Only for data read back from a storage which wrote it from a valid coupon,
+        anything else must go through model_validate.
+        """
+        coupon_condition = None
+        if condition is not None:
+            category = condition.get("category")
+            coupon_condition = construct_trusted(
+                CouponCondition,
+                {
+                    "category": None if category is None else CATEGORIES[category],
+                    "price_above": condition.get("price_above"),
+                },
+            )
+
+        return construct_trusted(
+            cls,
+            {
+                "name": name,
+                "discount": discount,
+                "is_percent": is_percent,
+                "condition": coupon_condition,
+                "validity": validity,
+            },
+        )
+
     @property
     def discount_raw(self: "Coupon") -> str:
         return f"{self.discount}%" if self.is_percent else str(self.discount)
@@ -72,4 +127,32 @@ class CouponCreate(CouponDTO):
 
 
 class CouponUpdate(CouponDTO):
+    # Left unchanged when omitted, a coupon cannot lose its discount
     discount: NonNegativeInt | str | None = None
+
+    @model_validator(mode="after")
+    def check_discount_not_null(self) -> "CouponUpdate":
+        if "discount" in self.model_fields_set and self.discount is None:
+            msg = "Discount cannot be null, omit it to keep the current one"
+            raise ValueError(msg)
+
+        return self
+
+
+class CouponFilter(BaseModel):
+    """Criteria to list coupons, every one set must match."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    # Coupons restricted to this category
+    category: ProductCategory | None = None
+    # Coupons valid at this moment, including the ones without validity period
+    valid_at: datetime | None = None
+    # Coupons whose price condition is at most this price, including unconditioned ones
+    max_price_above: NonNegativeInt | None = None
+    is_percent: bool | None = None
+    name_prefix: str | None = None
+
+    @property
+    def is_empty(self) -> bool:
+        return all(value is None for value in self.model_dump().values())
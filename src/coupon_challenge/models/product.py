@@ -15,3 +15,11 @@ class Product(BaseModel):
     name: str
     price: NonNegativeInt
     category: ProductCategory
+
+
+class ProductCouponApplication(BaseModel):
+    """A coupon applicable to a product and the price it brings it to."""
+
+    coupon: str
+    price: NonNegativeInt
+    discount: NonNegativeInt
@@ -1,9 +1,38 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Any, AsyncIterator
 
-from coupon_challenge.dependencies import get_coupon_service, get_coupon_storage
-from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
-from coupon_challenge.models.product import Product
+from fastapi import APIRouter, Depends, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+
+from coupon_challenge.dependencies import (
+    dep_coupon_search_engine,
+    get_clock,
+    get_coupon_response_cache,
+    get_coupon_search_engine,
+    get_coupon_service,
+    get_coupon_storage,
+)
+from coupon_challenge.models.cart import Cart, CartApplication
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+)
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.clock import Clock
 from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.metrics import (
+    APPLICABLE_CHECKS,
+    NOT_APPLICABLE_CHECKS,
+)
+from coupon_challenge.services.responses import (
+    CachedResponse,
+    CouponResponseCache,
+    etag_matches,
+)
+from coupon_challenge.services.search import CouponSearchEngine
 from coupon_challenge.services.storage import (
     CouponStorage,
     CouponStorageProductNotApplicableError,
@@ -17,43 +46,164 @@ router = APIRouter(
 )
 
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+COUPON_LIST_ADAPTER = TypeAdapter(list[Coupon])
+
+
+def conditional_response(
+    cached_response: CachedResponse,
+    if_none_match: str | None,
+    accept_encoding: str | None,
+) -> Response:
+    """The cached body, gzipped when accepted, or a 304 when the client has it."""
+    body, etag = cached_response.body, cached_response.etag
+    headers = {**cached_response.headers, "Vary": "Accept-Encoding"}
+    if (
+        cached_response.gzip_body is not None
+        and cached_response.gzip_etag is not None
+        and accept_encoding is not None
+        and "gzip" in accept_encoding
+    ):
+        body, etag = cached_response.gzip_body, cached_response.gzip_etag
+        headers["Content-Encoding"] = "gzip"
+    headers["ETag"] = etag
+
+    if etag_matches(if_none_match, etag):
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def coupon_filter_query(
+    category: ProductCategory | None = None,
+    valid_at: datetime | None = None,
+    max_price_above: int | None = Query(None, ge=0),
+    is_percent: bool | None = None,
+    prefix: str | None = Query(None, min_length=1, description="Name prefix"),
+) -> CouponFilter:
+    return CouponFilter(
+        category=category,
+        valid_at=valid_at,
+        max_price_above=max_price_above,
+        is_percent=is_percent,
+        name_prefix=prefix,
+    )
+
+
 @router.get("/", response_model=list[Coupon])
 async def read_coupons(
+    limit: int | None = Query(None, ge=1, le=1000),
+    after: str | None = Query(None, description="Name of the last coupon received"),
+    coupon_filter: CouponFilter = Depends(coupon_filter_query),
+    accept: str | None = Header(None),
+    if_none_match: str | None = Header(None),
+    accept_encoding: str | None = Header(None),
     coupon_storage: CouponStorage = Depends(get_coupon_storage),
-) -> list[Coupon]:
-    """Retrieve all coupons."""
-    coupons = await coupon_storage.get_all()
+    response_cache: CouponResponseCache = Depends(get_coupon_response_cache),
+) -> Any:
+    """Retrieve coupons, all of them unless filtered or paginated with `limit`
+    and `after`.
+
+    Pages are sorted by name, the next page starting after the name given in the
+    X-Next-Cursor header. With `Accept: application/x-ndjson` coupons are streamed
+    one per line as they are read from the database, otherwise the response
+    carries an ETag and If-None-Match gives a 304 when the listing did not change.
+    """
+    if accept is not None and NDJSON_MEDIA_TYPE in accept:
+
+        async def stream_coupons() -> AsyncIterator[str]:
+            if coupon_filter.is_empty:
+                async for coupon in coupon_storage.iter_all(limit=limit, after=after):
+                    yield coupon.model_dump_json() + "\n"
+                return
 
-    return coupons
+            # Filtered listings are meant to be small, they are fetched at once
+            for coupon in await coupon_storage.find(
+                coupon_filter, limit=limit, after=after
+            ):
+                yield coupon.model_dump_json() + "\n"
+
+        return StreamingResponse(stream_coupons(), media_type=NDJSON_MEDIA_TYPE)
+
+    key = ("list", limit, after, coupon_filter.model_dump_json())
+    cached_response = response_cache.get(key)
+    if cached_response is None:
+        version = response_cache.version
+        if coupon_filter.is_empty:
+            coupons = await coupon_storage.get_all(limit=limit, after=after)
+        else:
+            coupons = await coupon_storage.find(coupon_filter, limit=limit, after=after)
+        headers = {}
+        if limit is not None and len(coupons) == limit:
+            headers[NEXT_CURSOR_HEADER] = coupons[-1].name
+        cached_response = response_cache.put(
+            key, version, COUPON_LIST_ADAPTER.dump_json(coupons), headers
+        )
+
+    return conditional_response(cached_response, if_none_match, accept_encoding)
 
 
 @router.get("/{name}", response_model=Coupon)
 async def read_coupon(
     name: str,
+    if_none_match: str | None = Header(None),
+    accept_encoding: str | None = Header(None),
     coupon_storage: CouponStorage = Depends(get_coupon_storage),
-) -> Coupon:
+    response_cache: CouponResponseCache = Depends(get_coupon_response_cache),
+) -> Any:
     """Retrieve a coupon by its name."""
-    coupon = await coupon_storage.get(name)
+    key = ("get", name)
+    cached_response = response_cache.get(key)
+    if cached_response is None:
+        version = response_cache.version
+        coupon = await coupon_storage.get(name)
+        cached_response = response_cache.put(
+            key, version, coupon.model_dump_json().encode()
+        )
 
-    return coupon
+    return conditional_response(cached_response, if_none_match, accept_encoding)
 
 
 @router.post("/", response_model=Coupon, status_code=201)
 async def create_coupon(
     coupon_create: CouponCreate,
     coupon_storage: CouponStorage = Depends(get_coupon_storage),
+    coupon_search_engine: CouponSearchEngine = Depends(dep_coupon_search_engine),
+    response_cache: CouponResponseCache = Depends(get_coupon_response_cache),
 ) -> Coupon:
     new_coupon = await coupon_storage.create(coupon_create)
+    coupon_search_engine.upsert(new_coupon)
+    response_cache.bump()
 
     return new_coupon
 
 
+@router.post("/best", status_code=200)
+async def best_coupons(
+    products: Product | Cart,
+    limit: int = Query(5, ge=1, le=100),
+    coupon_search_engine: CouponSearchEngine = Depends(get_coupon_search_engine),
+    clock: Clock = Depends(get_clock),
+) -> list[CartApplication]:
+    """Find the coupons giving the lowest price for a product or a cart, best first."""
+    cart = Cart([products]) if isinstance(products, Product) else products
+
+    return coupon_search_engine.best(cart, limit, clock)
+
+
 @router.put("/", response_model=Coupon, status_code=202)
 async def update_coupon(
     coupon_update: CouponUpdate,
     coupon_storage: CouponStorage = Depends(get_coupon_storage),
+    coupon_search_engine: CouponSearchEngine = Depends(dep_coupon_search_engine),
+    response_cache: CouponResponseCache = Depends(get_coupon_response_cache),
 ) -> Coupon:
     updated_coupon = await coupon_storage.update(coupon_update)
+    coupon_search_engine.upsert(updated_coupon)
+    response_cache.bump()
 
     return updated_coupon
 
@@ -62,8 +212,12 @@ async def update_coupon(
 async def delete_coupon(
     name: str,
     coupon_storage: CouponStorage = Depends(get_coupon_storage),
+    coupon_search_engine: CouponSearchEngine = Depends(dep_coupon_search_engine),
+    response_cache: CouponResponseCache = Depends(get_coupon_response_cache),
 ) -> None:
     await coupon_storage.delete(name)
+    coupon_search_engine.remove(name)
+    response_cache.bump()
 
 
 @router.post("/{name}/apply_product", status_code=200)
@@ -76,8 +230,28 @@ async def apply_product(
     coupon = await coupon_storage.get(name)
 
     if not coupon_service.coupon_is_applicable(coupon, product):
+        NOT_APPLICABLE_CHECKS.inc()
         raise CouponStorageProductNotApplicableError()
+    APPLICABLE_CHECKS.inc()
 
     discounted_product = coupon_service.apply_discount(coupon, product)
 
     return discounted_product
+
+
+@router.post("/{name}/apply_products", status_code=200)
+async def apply_products(
+    name: str,
+    cart: Cart,
+    coupon_storage: CouponStorage = Depends(get_coupon_storage),
+    coupon_service: CouponApplicabilityService = Depends(get_coupon_service),
+) -> CartApplication:
+    """Apply a coupon to every product of a cart, reporting non applicable lines."""
+    coupon = await coupon_storage.get(name)
+
+    cart_application = coupon_service.apply_discount_to_cart(coupon, cart)
+    applicable = sum(line.applicable for line in cart_application.lines)
+    APPLICABLE_CHECKS.inc(applicable)
+    NOT_APPLICABLE_CHECKS.inc(len(cart_application.lines) - applicable)
+
+    return cart_application
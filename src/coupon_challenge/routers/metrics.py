@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from coupon_challenge.dependencies import dep_storage_registry
+from coupon_challenge.services.metrics import (
+    CACHE_HIT_RATIO,
+    CACHE_LOOKUPS,
+    PROMETHEUS_CONTENT_TYPE,
+    REGISTRY,
+)
+from coupon_challenge.services.storage.cache import CachedCouponStorage
+from coupon_challenge.services.storage.registry import CouponStorageRegistry
+
+METRICS_ROUTE = "/metrics"
+
+router = APIRouter(tags=["metrics"])
+
+
+def collect_cache_metrics(registry: CouponStorageRegistry) -> None:
+    # Caches keep their own stats, copied when scraped rather than on each lookup
+    for backend, coupon_storage in registry.opened().items():
+        if not isinstance(coupon_storage, CachedCouponStorage):
+            continue
+
+        stats = coupon_storage.stats
+        CACHE_LOOKUPS.labels(backend.value, "hit").set_total(stats.hits)
+        CACHE_LOOKUPS.labels(backend.value, "miss").set_total(stats.misses)
+        CACHE_HIT_RATIO.labels(backend.value).set(stats.hit_ratio)
+
+
+@router.get(METRICS_ROUTE, response_class=PlainTextResponse)
+async def metrics(
+    registry: CouponStorageRegistry = Depends(dep_storage_registry),
+) -> PlainTextResponse:
+    """Metrics of this worker in the Prometheus text format."""
+    collect_cache_metrics(registry)
+
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends, Query
+
+from coupon_challenge.dependencies import get_coupon_service, get_coupon_storage
+from coupon_challenge.models.product import Product, ProductCouponApplication
+from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.storage import CouponStorage
+
+PRODUCTS_ROUTE_PREFIX = "/products"
+
+router = APIRouter(
+    prefix=PRODUCTS_ROUTE_PREFIX,
+    tags=["products"],
+)
+
+
+@router.post("/applicable-coupons", status_code=200)
+async def applicable_coupons(
+    product: Product,
+    limit: int | None = Query(None, ge=1, le=1000),
+    coupon_storage: CouponStorage = Depends(get_coupon_storage),
+    coupon_service: CouponApplicabilityService = Depends(get_coupon_service),
+) -> list[ProductCouponApplication]:
+    """List the coupons applicable to a product, the largest discount first.
+
+    Eligibility is evaluated by the database, only matching coupons are fetched.
+    """
+    coupons = await coupon_storage.applicable_coupons(
+        product, coupon_service.clock.now(), limit=limit
+    )
+
+    applications = []
+    for coupon in coupons:
+        price = coupon_service.discounted_price(coupon, product.price)
+        applications.append(
+            ProductCouponApplication(
+                coupon=coupon.name, price=price, discount=product.price - price
+            )
+        )
+
+    return applications
@@ -0,0 +1,168 @@
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Sequence, TextIO
+
+from pydantic import ValidationError
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.models.product import Product
+from coupon_challenge.services.coupons import CompiledCoupon
+from coupon_challenge.services.reports import ProgressReport, format_error
+
+# (line number, raw line) of the products file
+ProductLine = tuple[int, str]
+
+
+@dataclass
+class PricedChunk:
+    # One JSON line per valid product, in the order of the input
+    results: list[str]
+    # (line number, reason) of the lines that are not a valid product
+    errors: list[tuple[int, str]]
+
+
+@dataclass
+class BatchApplyReport(ProgressReport):
+    priced: int = 0
+
+
+def price_chunk(
+    lines: Sequence[ProductLine], coupons: Sequence[CompiledCoupon], now: int
+) -> PricedChunk:
+    """Price every product of a chunk against every coupon at the epoch moment `now`.
+
+    Each result lists the applicable coupons with the price they give, the largest
+    discount first like the applicable-coupons route.
+    """
+    chunk = PricedChunk([], [])
+    for line_number, line in lines:
+        try:
+            product = Product.model_validate_json(line)
+        except ValidationError as error:
+            chunk.errors.append((line_number, format_error(error, "product")))
+            continue
+
+        applications = []
+        for coupon in coupons:
+            price = coupon.price_for(product.price, product.category, now)
+            if price is not None:
+                applications.append(
+                    {
+                        "coupon": coupon.name,
+                        "price": price,
+                        "discount": product.price - price,
+                    }
+                )
+        applications.sort(key=lambda application: -application["discount"])
+
+        chunk.results.append(
+            json.dumps(
+                {
+                    "line": line_number,
+                    "product": product.model_dump(mode="json"),
+                    "coupons": applications,
+                }
+            )
+        )
+
+    return chunk
+
+
+# Coupons and moment of a worker process, sent once instead of with every chunk
+_worker_coupons: Sequence[CompiledCoupon] = ()
+_worker_now = 0
+
+
+def _init_worker(coupons: Sequence[CompiledCoupon], now: int) -> None:
+    global _worker_coupons, _worker_now
+    _worker_coupons, _worker_now = coupons, now
+
+
+def _price_chunk_in_worker(lines: Sequence[ProductLine]) -> PricedChunk:
+    return price_chunk(lines, _worker_coupons, _worker_now)
+
+
+def _price_chunks_in_pool(
+    chunks: Iterable[list[ProductLine]],
+    coupons: Sequence[CompiledCoupon],
+    now: int,
+    workers: int,
+) -> Iterator[PricedChunk]:
+    """Price chunks in worker processes, yielding them in the input order.
+
+    At most two chunks per worker are in flight so memory stays bounded whatever
+    the size of the input.
+    """
+    # Spawned rather than forked, the storage client of the parent may own threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        workers, mp_context=context, initializer=_init_worker, initargs=(coupons, now)
+    ) as executor:
+        pending: deque[Future[PricedChunk]] = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_price_chunk_in_worker, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_product_lines(file: TextIO) -> Iterator[ProductLine]:
+    for line_number, line in enumerate(file, start=1):
+        if line.strip():
+            yield line_number, line
+
+
+def apply_coupons_to_products(
+    coupons: Iterable[Coupon],
+    products: TextIO,
+    output: TextIO,
+    now: int,
+    workers: int = 1,
+    chunk_size: int = 1000,
+    on_chunk: Callable[[BatchApplyReport], None] | None = None,
+    on_error: Callable[[int, str], None] | None = None,
+) -> BatchApplyReport:
+    """Stream JSONL products through the coupons, writing one JSONL result per
+    product as soon as its chunk is priced.
+
+    Every product is evaluated at the epoch moment `now`. Inputs larger than a
+    chunk are spread over `workers` processes, smaller ones are priced in process
+    as starting workers would take longer. Invalid lines are handed to `on_error`
+    with their line number.
+    """
+    compiled_coupons = [CompiledCoupon.from_coupon(coupon) for coupon in coupons]
+    report = BatchApplyReport()
+
+    lines = read_product_lines(products)
+    chunks: Iterator[list[ProductLine]] = iter(
+        lambda: list(islice(lines, chunk_size)), []
+    )
+    head = list(islice(chunks, 2))
+    chunks = chain(head, chunks)
+
+    if workers > 1 and len(head) > 1:
+        priced_chunks = _price_chunks_in_pool(chunks, compiled_coupons, now, workers)
+    else:
+        priced_chunks = (price_chunk(chunk, compiled_coupons, now) for chunk in chunks)
+
+    for priced_chunk in priced_chunks:
+        report.read += len(priced_chunk.results) + len(priced_chunk.errors)
+        report.priced += len(priced_chunk.results)
+        report.rejected += len(priced_chunk.errors)
+        for result in priced_chunk.results:
+            output.write(result + "\n")
+        output.flush()
+
+        if on_error is not None:
+            for line_number, reason in priced_chunk.errors:
+                on_error(line_number, reason)
+        if on_chunk is not None:
+            on_chunk(report)
+
+    return report
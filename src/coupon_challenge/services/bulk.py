@@ -0,0 +1,221 @@
+import csv
+import json
+from dataclasses import dataclass
+from enum import StrEnum
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Iterator, TextIO
+
+from pydantic import ValidationError
+
+from coupon_challenge.models.coupon import Coupon, CouponCreate
+from coupon_challenge.services.reports import ResumableReport, format_error
+from coupon_challenge.services.storage import CouponStorage
+
+CSV_FIELDS = [
+    "name",
+    "discount",
+    "category",
+    "price_above",
+    "validity_start",
+    "validity_end",
+]
+
+
+class CouponFileFormat(StrEnum):
+    jsonl = "jsonl"
+    csv = "csv"
+
+    @classmethod
+    def from_path(cls, path: Path) -> "CouponFileFormat":
+        return cls.csv if path.suffix.lower() == ".csv" else cls.jsonl
+
+
+@dataclass
+class BulkImportReport(ResumableReport):
+    imported: int = 0
+
+
+def coupon_to_record(coupon: Coupon) -> dict[str, Any]:
+    """Dump a coupon in the CouponCreate format so an export can be imported back."""
+    record: dict[str, Any] = {"name": coupon.name, "discount": coupon.discount_raw}
+    if coupon.condition:
+        record["condition"] = coupon.condition.model_dump(exclude_none=True)
+    if coupon.validity:
+        record["validity"] = {
+            "start": coupon.validity.start.isoformat(),
+            "end": coupon.validity.end.isoformat(),
+        }
+
+    return record
+
+
+def _csv_row_to_record(row: dict[str, str]) -> dict[str, Any]:
+    record: dict[str, Any] = {"name": row["name"], "discount": row["discount"]}
+    condition = {key: row[key] for key in ("category", "price_above") if row.get(key)}
+    if condition:
+        record["condition"] = condition
+    if row.get("validity_start") or row.get("validity_end"):
+        record["validity"] = {
+            "start": row.get("validity_start"),
+            "end": row.get("validity_end"),
+        }
+
+    return record
+
+
+def _record_to_csv_row(record: dict[str, Any]) -> dict[str, Any]:
+    condition = record.get("condition", {})
+    validity = record.get("validity", {})
+    return {
+        "name": record["name"],
+        "discount": record["discount"],
+        "category": condition.get("category", ""),
+        "price_above": condition.get("price_above", ""),
+        "validity_start": validity.get("start", ""),
+        "validity_end": validity.get("end", ""),
+    }
+
+
+def read_records(
+    file: TextIO, file_format: CouponFileFormat, skip_to: int = 0
+) -> Iterator[tuple[int, dict[str, Any] | str]]:
+    """Yield (line number, record) lazily after line `skip_to`, the record being an
+    error message when the line cannot be parsed."""
+    if file_format == CouponFileFormat.csv:
+        reader = csv.DictReader(file)
+        for row in reader:
+            # Line of the row in the file, the header being line 1
+            if reader.line_num > skip_to:
+                yield reader.line_num, _csv_row_to_record(row)
+        return
+
+    for line_number, line in enumerate(file, start=1):
+        if line_number <= skip_to or not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as error:
+            yield line_number, format_error(error, "coupon")
+
+
+class RecordWriter:
+    def __init__(self, file: TextIO, file_format: CouponFileFormat):
+        self.file = file
+        self.file_format = file_format
+        self._csv_writer = None
+        if file_format == CouponFileFormat.csv:
+            self._csv_writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+            self._csv_writer.writeheader()
+
+    def write(self, coupon: Coupon) -> None:
+        record = coupon_to_record(coupon)
+        if self._csv_writer is not None:
+            self._csv_writer.writerow(_record_to_csv_row(record))
+        else:
+            self.file.write(json.dumps(record) + "\n")
+
+
+class ImportCheckpoint:
+    """Last line of an input file durably imported, to resume an interrupted run."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def load(self) -> int:
+        if not self.path.exists():
+            return 0
+
+        return json.loads(self.path.read_text())["line"]
+
+    def save(self, line_number: int) -> None:
+        # Write then rename so a crash never leaves a truncated checkpoint
+        temporary_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        temporary_path.write_text(json.dumps({"line": line_number}))
+        temporary_path.replace(self.path)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def _to_coupon_create(record: dict[str, Any]) -> CouponCreate:
+    coupon_create = CouponCreate.model_validate(record)
+    # Discounts are only parsed by Coupon, a bad one would fail the whole bulk
+    # write of the storage
+    Coupon.model_validate(coupon_create.model_dump())
+
+    return coupon_create
+
+
+async def import_coupons(
+    coupon_storage: CouponStorage,
+    file: TextIO,
+    file_format: CouponFileFormat,
+    checkpoint: ImportCheckpoint | None = None,
+    chunk_size: int = 1000,
+    on_chunk: Callable[[BulkImportReport], None] | None = None,
+    on_error: Callable[[int, str], None] | None = None,
+) -> BulkImportReport:
+    """Stream coupons from a file into the storage, one bulk write per chunk.
+
+    Memory stays bounded by `chunk_size`: rejected lines are handed to `on_error`
+    with their line number instead of being kept. After every chunk the checkpoint
+    records the last line handled, so a new run with the same checkpoint skips it.
+    """
+    report = BulkImportReport()
+    if checkpoint is not None:
+        report.resumed_from = checkpoint.load()
+
+    def reject(line_number: int, reason: str) -> None:
+        report.rejected += 1
+        if on_error is not None:
+            on_error(line_number, reason)
+
+    records = read_records(file, file_format, skip_to=report.resumed_from)
+
+    while chunk := list(islice(records, chunk_size)):
+        report.read += len(chunk)
+
+        coupon_creates, line_numbers = [], []
+        for line_number, record in chunk:
+            if isinstance(record, str):
+                reject(line_number, record)
+                continue
+            try:
+                coupon_creates.append(_to_coupon_create(record))
+            except ValidationError as error:
+                reject(line_number, format_error(error, "coupon"))
+                continue
+            line_numbers.append(line_number)
+
+        if coupon_creates:
+            result = await coupon_storage.create_many(coupon_creates)
+            report.imported += result.inserted
+            for position, reason in sorted(result.errors.items()):
+                reject(line_numbers[position], reason)
+
+        if checkpoint is not None:
+            checkpoint.save(chunk[-1][0])
+        if on_chunk is not None:
+            on_chunk(report)
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    return report
+
+
+async def export_coupons(
+    coupon_storage: CouponStorage,
+    file: TextIO,
+    file_format: CouponFileFormat,
+    batch_size: int = 1000,
+) -> int:
+    """Stream every coupon of the storage to a file, returning how many were written."""
+    writer = RecordWriter(file, file_format)
+    count = 0
+    async for coupon in coupon_storage.iter_all(batch_size):
+        writer.write(coupon)
+        count += 1
+
+    return count
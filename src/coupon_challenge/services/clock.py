@@ -0,0 +1,51 @@
+"""Sources of the current time used to check coupon validity.
+
+A request or a batch reads its clock once and evaluates every coupon against that
+instant: lines of a cart cannot see a coupon expire halfway, and no syscall is
+made per coupon. Instants are timezone-aware, and compared to validity windows as
+epoch microseconds (see to_epoch).
+"""
+
+import time
+from datetime import datetime
+
+from coupon_challenge.services.index import to_epoch
+
+
+class Clock:
+    def now(self) -> datetime:
+        """The current instant, timezone-aware."""
+        raise NotImplementedError()
+
+    def epoch(self) -> int:
+        """The current instant in microseconds since epoch."""
+        return to_epoch(self.now())
+
+    def freeze(self) -> "FrozenClock":
+        """A clock stopped at the current instant of this one."""
+        return FrozenClock(self.now())
+
+
+class SystemClock(Clock):
+    def now(self) -> datetime:
+        return datetime.now().astimezone()
+
+    def epoch(self) -> int:
+        return time.time_ns() // 1000
+
+
+class FrozenClock(Clock):
+    """A clock always giving the same instant, naive ones being local time."""
+
+    def __init__(self, moment: datetime):
+        self.moment = moment if moment.tzinfo else moment.astimezone()
+        self._epoch = to_epoch(self.moment)
+
+    def now(self) -> datetime:
+        return self.moment
+
+    def epoch(self) -> int:
+        return self._epoch
+
+    def freeze(self) -> "FrozenClock":
+        return self
@@ -1,8 +1,75 @@
 import math
-from datetime import datetime
+from dataclasses import dataclass
 
+from coupon_challenge.models.cart import Cart, CartApplication, CartLine
 from coupon_challenge.models.coupon import Coupon
-from coupon_challenge.models.product import Product
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.clock import Clock, SystemClock
+from coupon_challenge.services.index import IndexedCoupon, epoch_window
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledCoupon:
+    """A coupon flattened for evaluation against many products.
+
+    Conditions and validity are plain fields compared to the product price,
+    category and an epoch moment (see to_epoch), so pricing a product touches no
+    pydantic model nor datetime and builds nothing but the resulting price.
+    Rules and rounding are the ones of CouponApplicabilityService.
+    """
+
+    name: str
+    # None when the coupon applies to any category
+    category: ProductCategory | None
+    # Prices must be above it, NO_PRICE_THRESHOLD when there is no price condition
+    price_threshold: int
+    # Inclusive validity bounds in epoch microseconds, None when always valid
+    valid_from: int | None
+    valid_to: int | None
+    # Multiplier of the price for percent discounts, kept as the float computed by
+    # _apply_percent_discount so that prices are rounded exactly the same way (an
+    # integer (100 - discount) * price // 100 differs on a few prices)
+    factor: float | None
+    # Amount taken off the price for fixed discounts
+    amount: int
+
+    @classmethod
+    def from_coupon(cls, coupon: Coupon) -> "CompiledCoupon":
+        entry = IndexedCoupon.from_coupon(coupon)
+        valid_from, valid_to = entry.window or (None, None)
+
+        return cls(
+            name=coupon.name,
+            category=entry.category,
+            price_threshold=entry.price_threshold,
+            valid_from=valid_from,
+            valid_to=valid_to,
+            factor=1 - coupon.discount / 100 if coupon.is_percent else None,
+            amount=0 if coupon.is_percent else coupon.discount,
+        )
+
+    def is_applicable(self, price: int, category: ProductCategory, now: int) -> bool:
+        if self.valid_from is not None and now < self.valid_from:
+            return False
+
+        if self.valid_to is not None and now > self.valid_to:
+            return False
+
+        if self.category is not None and category != self.category:
+            return False
+
+        return price > self.price_threshold
+
+    def price_for(self, price: int, category: ProductCategory, now: int) -> int | None:
+        """Price of a product after this coupon at the epoch moment `now`, None
+        when the coupon is not applicable."""
+        if not self.is_applicable(price, category, now):
+            return None
+
+        if self.factor is not None:
+            return max(math.floor(self.factor * price), 0)
+
+        return max(price - self.amount, 0)
 
 
 class CouponApplicabilityService:
@@ -14,36 +81,79 @@ class CouponApplicabilityService:
       conditions like category, price thresholds, and validity periods.
     - Calculating the final price of a product after applying a coupon,
       whether the discount is percentage-based or fixed.
+
+    Validity is checked against `clock`, give it a frozen clock to evaluate a
+    whole request or batch at the same instant.
     """
 
+    def __init__(self, clock: Clock | None = None):
+        self.clock = clock or SystemClock()
+
     def _apply_percent_discount(self, discount: int, price: int) -> int:
         # I choose arbitrarly to round down the result as i don't want to handle float for now.
         # Even if it would work
-        return math.floor((1 - discount / 100) * price)
+        # Discounts above 100% bring the price to 0, like fixed ones
+        return max(math.floor((1 - discount / 100) * price), 0)
 
     def _apply_fixed_discount(self, discount: int, price: int) -> int:
         # We handle the case where the fixed discount is greater than the price by
         return max(price - discount, 0)
 
-    def apply_discount(self, coupon: Coupon, product: Product) -> Product:
+    def price_after_discount(self, discount: int, is_percent: bool, price: int) -> int:
         apply_method = (
-            self._apply_percent_discount
-            if coupon.is_percent
-            else self._apply_fixed_discount
+            self._apply_percent_discount if is_percent else self._apply_fixed_discount
         )
+
+        return apply_method(discount, price)
+
+    def discounted_price(self, coupon: Coupon, price: int) -> int:
+        return self.price_after_discount(coupon.discount, coupon.is_percent, price)
+
+    def apply_discount(self, coupon: Coupon, product: Product) -> Product:
         discounted_product = product.model_copy(
-            update={"price": apply_method(coupon.discount, product.price)}
+            update={"price": self.discounted_price(coupon, product.price)}
         )
 
         return discounted_product
 
+    def apply_discount_to_cart(self, coupon: Coupon, cart: Cart) -> CartApplication:
+        """Price every line of a cart against a single coupon.
+
+        Lines the coupon is not applicable to keep their original price instead of
+        failing the whole cart.
+        """
+        compiled_coupon = CompiledCoupon.from_coupon(coupon)
+        now = self.clock.epoch()
+
+        lines = []
+        for product in cart.root:
+            price = compiled_coupon.price_for(product.price, product.category, now)
+            lines.append(
+                CartLine(
+                    product=product,
+                    applicable=price is not None,
+                    price=product.price if price is None else price,
+                )
+            )
+
+        total_price = sum(line.product.price for line in lines)
+        total_discounted_price = sum(line.price for line in lines)
+
+        return CartApplication(
+            coupon=coupon.name,
+            lines=lines,
+            total_price=total_price,
+            total_discounted_price=total_discounted_price,
+            total_discount=total_price - total_discounted_price,
+        )
+
     def coupon_is_valid(self, coupon: Coupon) -> bool:
         # If coupon has no validity period, it means it is always valid
         if not coupon.validity:
             return True
 
-        # I do not handle TZ
-        return coupon.validity.start <= datetime.now() <= coupon.validity.end
+        valid_from, valid_to = epoch_window(coupon.validity)
+        return valid_from <= self.clock.epoch() <= valid_to
 
     def coupon_is_applicable(self, coupon: Coupon, product: Product) -> bool:
         if not self.coupon_is_valid(coupon):
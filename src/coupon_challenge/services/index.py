@@ -0,0 +1,379 @@
+import bisect
+import math
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Iterable, Iterator, NamedTuple
+
+from coupon_challenge.models.coupon import Coupon, CouponValidity
+from coupon_challenge.models.product import ProductCategory
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Threshold of coupons without price condition, below any product price
+NO_PRICE_THRESHOLD = -1
+
+
+def to_epoch(moment: datetime) -> int:
+    """Microseconds since epoch, naive datetimes being local time like datetime.now()."""
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+@lru_cache(maxsize=4096)
+def epoch_window(validity: CouponValidity) -> tuple[int, int]:
+    """Inclusive validity window in epoch microseconds, computed once per period."""
+    return to_epoch(validity.start), to_epoch(validity.end)
+
+
+class IndexedCoupon(NamedTuple):
+    coupon: Coupon
+    category: ProductCategory | None
+    price_threshold: int
+    # Inclusive validity window in epoch microseconds, None when always valid
+    window: tuple[int, int] | None
+
+    @classmethod
+    def from_coupon(cls, coupon: Coupon) -> "IndexedCoupon":
+        category = None
+        price_threshold = NO_PRICE_THRESHOLD
+        if coupon.condition:
+            category = coupon.condition.category
+            # A price_above of 0 is no condition at all, like in coupon_is_applicable
+            price_threshold = coupon.condition.price_above or NO_PRICE_THRESHOLD
+
+        window = None
+        if coupon.validity:
+            window = epoch_window(coupon.validity)
+
+        return cls(coupon, category, price_threshold, window)
+
+
+class _IntervalNode:
+    __slots__ = ("key", "end", "priority", "max_end", "left", "right")
+
+    def __init__(self, key: tuple[int, str], end: int):
+        # (start, name), names keeping equal starts apart
+        self.key = key
+        self.end = end
+        self.priority = random.random()
+        # Largest end of the subtree, to skip the subtrees ended before a moment
+        self.max_end = end
+        self.left: _IntervalNode | None = None
+        self.right: _IntervalNode | None = None
+
+    def update(self) -> "_IntervalNode":
+        self.max_end = max(
+            self.end,
+            self.left.max_end if self.left else self.end,
+            self.right.max_end if self.right else self.end,
+        )
+        return self
+
+
+def _split(
+    node: _IntervalNode | None, key: tuple[int, str]
+) -> tuple[_IntervalNode | None, _IntervalNode | None]:
+    """Nodes before `key`, and nodes from it."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        return node.update(), right
+
+    left, node.left = _split(node.left, key)
+    return left, node.update()
+
+
+def _merge(
+    left: _IntervalNode | None, right: _IntervalNode | None
+) -> _IntervalNode | None:
+    """Nodes of both trees, every key of `left` being before those of `right`."""
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return left.update()
+
+    right.left = _merge(left, right.left)
+    return right.update()
+
+
+class IntervalTree:
+    """Named inclusive intervals, finding those containing a moment in
+    O(log n + m log n) for m matches instead of checking them all.
+
+    A treap ordered by start, where every node knows the largest end of its
+    subtree: subtrees starting after the moment, or all ended before it, are
+    skipped. Insertions and removals are O(log n) expected.
+    """
+
+    def __init__(self) -> None:
+        self._root: _IntervalNode | None = None
+        self._starts: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    @classmethod
+    def from_windows(cls, windows: dict[str, tuple[int, int]]) -> "IntervalTree":
+        """Tree of these intervals, built balanced at once rather than by as many
+        insertions."""
+        tree = cls()
+        tree._starts = {name: start for name, (start, _) in windows.items()}
+        nodes = sorted(
+            (
+                _IntervalNode((start, name), end)
+                for name, (start, end) in windows.items()
+            ),
+            key=lambda node: node.key,
+        )
+
+        def link(low: int, high: int) -> _IntervalNode | None:
+            if low >= high:
+                return None
+            middle = (low + high) // 2
+            node = nodes[middle]
+            node.left, node.right = link(low, middle), link(middle + 1, high)
+            return node.update()
+
+        tree._root = link(0, len(nodes))
+
+        # Random priorities handed out level by level, the largest first, so every
+        # node has a priority above those of its children like after insertions
+        priorities = iter(sorted((random.random() for _ in nodes), reverse=True))
+        level = [tree._root] if tree._root else []
+        while level:
+            for node in level:
+                node.priority = next(priorities)
+            level = [
+                child for node in level for child in (node.left, node.right) if child
+            ]
+
+        return tree
+
+    def add(self, name: str, window: tuple[int, int]) -> None:
+        self.remove(name)
+
+        start, end = window
+        self._starts[name] = start
+        left, right = _split(self._root, (start, name))
+        self._root = _merge(_merge(left, _IntervalNode((start, name), end)), right)
+
+    def remove(self, name: str) -> None:
+        start = self._starts.pop(name, None)
+        if start is None:
+            return
+
+        left, right = _split(self._root, (start, name))
+        # The node of the name is the first of `right`, the only one before the
+        # key following it
+        _, right = _split(right, (start, name + "\0"))
+        self._root = _merge(left, right)
+
+    def containing(self, at: int) -> Iterator[str]:
+        """Names of the intervals containing `at`."""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max_end < at:
+                continue
+            stack.append(node.left)
+            if node.key[0] <= at:
+                if at <= node.end:
+                    yield node.key[1]
+                stack.append(node.right)
+
+
+class CouponIndex:
+    """Answer "which coupons apply to this product at time T" without a full scan.
+
+    Coupons are bucketed by category condition (None being "any category"), and
+    each bucket is sorted by price threshold so the coupons a price satisfies are a
+    prefix found by bisection. Coupons with a validity window are kept apart in an
+    IntervalTree, and their boundaries sorted on a timeline: between two
+    consecutive boundaries the coupons in their window do not change, so they are
+    found once per segment, bucketed and sorted the same way, and reused by every
+    query falling in it. A lookup is O(log n + k), finding the coupons of a new
+    segment O(log n + m log n) for the m coupons in their window.
+
+    Rules are the ones of CouponApplicabilityService.coupon_is_applicable.
+    """
+
+    def __init__(self, coupons: Iterable[Coupon] = ()):
+        self._entries: dict[str, IndexedCoupon] = {}
+        # Coupons always valid, sorted by (price_threshold, name)
+        self._thresholds: dict[ProductCategory | None, list[tuple[int, str]]] = (
+            defaultdict(list)
+        )
+        self._windows = IntervalTree()
+        # Moments where a coupon becomes valid (start) or invalid (end + 1)
+        self._boundaries: list[int] = []
+        # Timeline segment [start, end) where `_valid` is accurate, and the moment
+        # it was computed for
+        self._segment: tuple[float, float] | None = None
+        self._segment_at = 0
+        # Coupons with a validity window containing the segment, bucketed and
+        # sorted like `_thresholds`
+        self._valid: set[str] = set()
+        self._valid_thresholds: dict[ProductCategory | None, list[tuple[int, str]]] = (
+            defaultdict(list)
+        )
+
+        self.rebuild(coupons)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __iter__(self) -> Iterator[Coupon]:
+        return (entry.coupon for entry in self._entries.values())
+
+    def get(self, name: str) -> Coupon:
+        return self._entries[name].coupon
+
+    def rebuild(self, coupons: Iterable[Coupon]) -> None:
+        self._entries = {
+            coupon.name: IndexedCoupon.from_coupon(coupon) for coupon in coupons
+        }
+        self._thresholds = defaultdict(list)
+        windows: dict[str, tuple[int, int]] = {}
+        self._boundaries = []
+        for name, entry in self._entries.items():
+            if entry.window:
+                windows[name] = entry.window
+                self._boundaries.extend((entry.window[0], entry.window[1] + 1))
+            else:
+                self._thresholds[entry.category].append((entry.price_threshold, name))
+
+        for thresholds in self._thresholds.values():
+            thresholds.sort()
+        self._windows = IntervalTree.from_windows(windows)
+        self._boundaries.sort()
+        self._segment = None
+
+    def upsert(self, coupon: Coupon) -> None:
+        self.remove(coupon.name)
+
+        entry = IndexedCoupon.from_coupon(coupon)
+        self._entries[coupon.name] = entry
+
+        if entry.window:
+            start, end = entry.window
+            self._windows.add(coupon.name, entry.window)
+            bisect.insort(self._boundaries, start)
+            bisect.insort(self._boundaries, end + 1)
+            self._track_window(entry)
+        else:
+            bisect.insort(
+                self._thresholds[entry.category], (entry.price_threshold, coupon.name)
+            )
+
+    def remove(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+
+        if entry.window:
+            start, end = entry.window
+            self._windows.remove(name)
+            del self._boundaries[bisect.bisect_left(self._boundaries, start)]
+            del self._boundaries[bisect.bisect_left(self._boundaries, end + 1)]
+            # Removing boundaries only merges segments, the cached one stays accurate
+            if name in self._valid:
+                self._valid.discard(name)
+                self._remove_threshold(self._valid_thresholds, entry)
+        else:
+            self._remove_threshold(self._thresholds, entry)
+
+    @staticmethod
+    def _remove_threshold(
+        thresholds: dict[ProductCategory | None, list[tuple[int, str]]],
+        entry: IndexedCoupon,
+    ) -> None:
+        bucket = thresholds[entry.category]
+        key = (entry.price_threshold, entry.coupon.name)
+        del bucket[bisect.bisect_left(bucket, key)]
+
+    def _track_window(self, entry: IndexedCoupon) -> None:
+        """Keep the cached segment accurate after a new validity window."""
+        if self._segment is None or entry.window is None:
+            return
+
+        start, end = entry.window
+        segment_start, segment_end = self._segment
+        for boundary in (start, end + 1):
+            if boundary <= self._segment_at:
+                segment_start = max(segment_start, boundary)
+            else:
+                segment_end = min(segment_end, boundary)
+        self._segment = (segment_start, segment_end)
+
+        if start <= self._segment_at <= end:
+            self._valid.add(entry.coupon.name)
+            bisect.insort(
+                self._valid_thresholds[entry.category],
+                (entry.price_threshold, entry.coupon.name),
+            )
+
+    def in_window(self, at: int) -> set[str]:
+        """Coupons with a validity window containing `at`, the same set object as
+        long as `at` stays in the cached segment."""
+        if self._segment is not None and self._segment[0] <= at < self._segment[1]:
+            return self._valid
+
+        position = bisect.bisect_right(self._boundaries, at)
+        self._segment = (
+            self._boundaries[position - 1] if position > 0 else -math.inf,
+            self._boundaries[position]
+            if position < len(self._boundaries)
+            else math.inf,
+        )
+        self._segment_at = at
+        self._valid = set(self._windows.containing(at))
+        self._valid_thresholds = defaultdict(list)
+        for name in self._valid:
+            entry = self._entries[name]
+            self._valid_thresholds[entry.category].append((entry.price_threshold, name))
+        for thresholds in self._valid_thresholds.values():
+            thresholds.sort()
+
+        return self._valid
+
+    def is_applicable(
+        self, name: str, price: int, category: ProductCategory, at: int
+    ) -> bool:
+        entry = self._entries[name]
+        if entry.category is not None and entry.category != category:
+            return False
+        if price <= entry.price_threshold:
+            return False
+
+        return entry.window is None or name in self.in_window(at)
+
+    def applicable(
+        self, price: int, category: ProductCategory, at: datetime | None = None
+    ) -> list[Coupon]:
+        """Coupons applicable to a product of this price and category at `at`."""
+        self.in_window(to_epoch(at or datetime.now()))
+
+        coupons = []
+        for bucket in (None, category):
+            for thresholds in (
+                self._thresholds.get(bucket),
+                self._valid_thresholds.get(bucket),
+            ):
+                if not thresholds:
+                    continue
+                # Every coupon whose threshold is strictly below the price
+                end = bisect.bisect_left(thresholds, (price, ""))
+                coupons.extend(
+                    self._entries[name].coupon for _, name in thresholds[:end]
+                )
+
+        return coupons
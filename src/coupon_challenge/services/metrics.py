@@ -0,0 +1,265 @@
+"""Metrics of the application in the Prometheus text exposition format.
+
+A minimal in-process implementation of counters, gauges and histograms, enough to
+be scraped by Prometheus without any client library. Observations only touch a few
+integers of a child picked by its label values, everything else happens when the
+metrics are rendered. Values are not shared between worker processes, each worker
+exposes its own.
+"""
+
+from bisect import bisect_left
+from typing import Any, Iterator
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached lookup to a full listing of a large collection
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+
+    pairs = ",".join(
+        f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric[Child]:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], Child] = {}
+
+    def _new_child(self) -> Child:
+        raise NotImplementedError()
+
+    def labels(self, *values: str) -> Child:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                msg = f"{self.name} expects labels {self.labelnames}, got {values}"
+                raise ValueError(msg)
+            child = self._children.setdefault(values, self._new_child())
+
+        return child
+
+    @property
+    def family(self) -> str:
+        """Name the HELP and TYPE lines describe, that of the samples or their
+        prefix."""
+        return self.name
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.family} {self.help}"
+        yield f"# TYPE {self.family} {self.type}"
+        yield from self.samples()
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def set_total(self, total: int) -> None:
+        """Copy a total counted elsewhere, which only grows as well."""
+        self.value = total
+
+
+class Counter(Metric[CounterChild]):
+    type = "counter"
+
+    @property
+    def family(self) -> str:
+        # Samples are suffixed with _total, and the text format 0.0.4 only ties
+        # the HELP and TYPE lines to samples of the same name
+        return f"{self.name}_total"
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def samples(self) -> Iterator[str]:
+        for values, child in self._children.items():
+            labels = format_labels(self.labelnames, values)
+            yield f"{self.family}{labels} {format_value(child.value)}"
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(Metric[GaugeChild]):
+    type = "gauge"
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+    def samples(self) -> Iterator[str]:
+        for values, child in self._children.items():
+            labels = format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {format_value(child.value)}"
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # One more for the observations above the last bound, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric[HistogramChild]):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def samples(self) -> Iterator[str]:
+        labelnames = (*self.labelnames, "le")
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), child.counts):
+                cumulative += count
+                labels = format_labels(labelnames, (*values, format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+
+            labels = format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric[Any]] = {}
+
+    def register[M: Metric[Any]](self, metric: M) -> M:
+        if metric.name in self._metrics:
+            msg = f"Metric {metric.name} is already registered"
+            raise ValueError(msg)
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(
+            f"{line}\n" for metric in self._metrics.values() for line in metric.render()
+        )
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Latency of the HTTP requests by route template.",
+        ("method", "route", "status"),
+    )
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(
+    Gauge("http_requests_in_flight", "HTTP requests being served.")
+)
+STORAGE_ERRORS = REGISTRY.register(
+    Counter(
+        "coupon_storage_errors",
+        "Storage errors turned into HTTP errors, by CouponStorageError subclass.",
+        ("error",),
+    )
+)
+STORAGE_OPERATION_DURATION = REGISTRY.register(
+    Histogram(
+        "coupon_storage_operation_duration_seconds",
+        "Latency of the calls to the storage backend, by method.",
+        ("backend", "operation", "outcome"),
+    )
+)
+CACHE_LOOKUPS = REGISTRY.register(
+    Counter(
+        "coupon_cache_lookups",
+        "Lookups of the coupon cache, by result.",
+        ("backend", "result"),
+    )
+)
+CACHE_HIT_RATIO = REGISTRY.register(
+    Gauge(
+        "coupon_cache_hit_ratio",
+        "Share of the coupon cache lookups served without the backend.",
+        ("backend",),
+    )
+)
+APPLICABILITY_CHECKS = REGISTRY.register(
+    Counter(
+        "coupon_applicability_checks",
+        "Coupons checked against a product, by outcome.",
+        ("outcome",),
+    )
+)
+
+# Children updated on the hot path, looked up once
+HTTP_REQUESTS_IN_FLIGHT_CHILD = HTTP_REQUESTS_IN_FLIGHT.labels()
+APPLICABLE_CHECKS = APPLICABILITY_CHECKS.labels("applicable")
+NOT_APPLICABLE_CHECKS = APPLICABILITY_CHECKS.labels("not_applicable")
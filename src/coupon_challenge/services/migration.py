@@ -0,0 +1,122 @@
+import json
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from pydantic import ValidationError
+
+from coupon_challenge.models.coupon import Coupon, CouponCreate
+from coupon_challenge.services.bulk import ImportCheckpoint, coupon_to_record
+from coupon_challenge.services.reports import ResumableReport, format_error
+from coupon_challenge.services.storage import CouponStorage
+
+# Table written by legacy.py, name being its primary key
+LEGACY_TABLE = "coupon"
+
+
+@dataclass
+class MigrationReport(ResumableReport):
+    migrated: int = 0
+
+
+def open_legacy_database(path: str | Path) -> sqlite3.Connection:
+    """Open the legacy database read-only, it is never written by a migration."""
+    # as_uri escapes the characters meaning something in a URI, like ? and #
+    connection = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+    connection.row_factory = sqlite3.Row
+
+    return connection
+
+
+def legacy_row_to_record(row: sqlite3.Row) -> dict[str, Any]:
+    """Rebuild the data legacy.get_coupon validates from a row of its table.
+
+    Discounts are stored raw ("10%" or "10"), condition and validity as JSON, an
+    empty string meaning none.
+    """
+    record: dict[str, Any] = {"name": row["name"], "discount": row["discount"]}
+    if row["condition"]:
+        record["condition"] = json.loads(row["condition"])
+    if row["validity"]:
+        record["validity"] = json.loads(row["validity"])
+
+    return record
+
+
+def read_legacy_rows(
+    connection: sqlite3.Connection, after: int = 0, chunk_size: int = 1000
+) -> Iterator[list[sqlite3.Row]]:
+    """Yield the rows of the legacy table after rowid `after`, `chunk_size` at a
+    time, in rowid order so a checkpointed rowid is enough to resume."""
+    while True:
+        rows = connection.execute(
+            f"SELECT rowid, name, discount, condition, validity FROM {LEGACY_TABLE} "
+            "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (after, chunk_size),
+        ).fetchall()
+        if not rows:
+            return
+
+        yield rows
+        after = rows[-1]["rowid"]
+
+
+def _to_coupon_create(row: sqlite3.Row) -> CouponCreate:
+    # Validated like legacy.py reads it, then written like any API creation
+    coupon = Coupon.model_validate(legacy_row_to_record(row))
+    return CouponCreate.model_validate(coupon_to_record(coupon))
+
+
+async def migrate_legacy_coupons(
+    connection: sqlite3.Connection,
+    coupon_storage: CouponStorage,
+    checkpoint: ImportCheckpoint | None = None,
+    chunk_size: int = 1000,
+    on_chunk: Callable[[MigrationReport], None] | None = None,
+    on_error: Callable[[int, str], None] | None = None,
+) -> MigrationReport:
+    """Copy the coupons of the legacy table into the storage, one bulk write per
+    chunk.
+
+    Rows that are not valid coupons, or that the storage refuses (a name already
+    taken), are handed to `on_error` with their rowid. After every chunk the
+    checkpoint records the last rowid handled, so a new run with the same
+    checkpoint resumes after it.
+    """
+    report = MigrationReport()
+    if checkpoint is not None:
+        report.resumed_from = checkpoint.load()
+
+    def reject(rowid: int, reason: str) -> None:
+        report.rejected += 1
+        if on_error is not None:
+            on_error(rowid, reason)
+
+    for rows in read_legacy_rows(connection, report.resumed_from, chunk_size):
+        report.read += len(rows)
+
+        coupon_creates, rowids = [], []
+        for row in rows:
+            try:
+                coupon_creates.append(_to_coupon_create(row))
+            except (ValidationError, json.JSONDecodeError) as error:
+                reject(row["rowid"], f"{row['name']}: {format_error(error, 'coupon')}")
+                continue
+            rowids.append(row["rowid"])
+
+        if coupon_creates:
+            result = await coupon_storage.create_many(coupon_creates)
+            report.migrated += result.inserted
+            for position, reason in sorted(result.errors.items()):
+                reject(rowids[position], f"{coupon_creates[position].name}: {reason}")
+
+        if checkpoint is not None:
+            checkpoint.save(rows[-1]["rowid"])
+        if on_chunk is not None:
+            on_chunk(report)
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    return report
@@ -0,0 +1,229 @@
+"""Bulk pricing of product arrays, vectorized with NumPy when it is installed.
+
+Results are identical to CouponApplicabilityService: percent discounts use the
+same float64 `floor((1 - discount / 100) * price)` expression and every price is
+floored at 0. Without NumPy (`pip install coupon_challenge[fast]`) the same API
+runs plain Python loops and returns lists instead of arrays.
+"""
+
+import math
+from itertools import repeat
+from typing import Any, Iterable, NamedTuple, Sequence
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.models.product import ProductCategory
+from coupon_challenge.services.clock import Clock, SystemClock
+from coupon_challenge.services.index import IndexedCoupon
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - depends on the environment
+    numpy = None
+
+HAS_NUMPY = numpy is not None
+
+CATEGORY_CODES: dict[str, int] = {
+    category: code for code, category in enumerate(ProductCategory)
+}
+# Category code of coupons without category condition
+ANY_CATEGORY = -1
+
+# Bounds of coupons without validity period, in epoch microseconds
+ALWAYS_VALID_FROM = -(2**62)
+ALWAYS_VALID_TO = 2**62
+
+
+def _numpy(use_numpy: bool | None) -> Any:
+    """NumPy module to compute with, None to run the pure Python fallback.
+
+    `use_numpy` forces one implementation, None picks NumPy when installed.
+    """
+    if use_numpy is False:
+        return None
+    if use_numpy and numpy is None:
+        raise RuntimeError("NumPy is not installed")
+
+    return numpy
+
+
+def _broadcast(value: Any, size: int) -> Sequence:
+    """Repeat scalars and single values so they zip with per product columns."""
+    if isinstance(value, (int, bool)):
+        return list(repeat(value, size))
+    if len(value) == 1:
+        return list(repeat(value[0], size))
+
+    return value
+
+
+class CouponColumns(NamedTuple):
+    """Coupon parameters as one column per field, one row per coupon."""
+
+    discount: Any
+    is_percent: Any
+    category: Any
+    price_threshold: Any
+    valid_from: Any
+    valid_to: Any
+
+    @classmethod
+    def from_coupons(
+        cls, coupons: Iterable[Coupon], use_numpy: bool | None = None
+    ) -> "CouponColumns":
+        rows = []
+        for coupon in coupons:
+            entry = IndexedCoupon.from_coupon(coupon)
+            valid_from, valid_to = entry.window or (ALWAYS_VALID_FROM, ALWAYS_VALID_TO)
+            category = (
+                ANY_CATEGORY
+                if entry.category is None
+                else CATEGORY_CODES[entry.category]
+            )
+            rows.append(
+                (
+                    coupon.discount,
+                    coupon.is_percent,
+                    category,
+                    entry.price_threshold,
+                    valid_from,
+                    valid_to,
+                )
+            )
+
+        columns: list[Any] = [list(column) for column in zip(*rows)] or [
+            [] for _ in cls._fields
+        ]
+
+        np = _numpy(use_numpy)
+        if np is not None:
+            dtypes = (np.int64, np.bool_, np.int8, np.int64, np.int64, np.int64)
+            columns = [
+                np.asarray(column, dtype=dtype)
+                for column, dtype in zip(columns, dtypes)
+            ]
+
+        return cls(*columns)
+
+
+class PricingResult(NamedTuple):
+    applicable: Any
+    # Discounted price, the original price where the coupon is not applicable
+    prices: Any
+
+
+def encode_categories(
+    categories: Iterable[ProductCategory | str], use_numpy: bool | None = None
+) -> Any:
+    codes = [CATEGORY_CODES[category] for category in categories]
+
+    np = _numpy(use_numpy)
+    if np is not None:
+        return np.asarray(codes, dtype=np.int8)
+
+    return codes
+
+
+def discount_prices(
+    prices: Sequence[int],
+    discount: Any,
+    is_percent: Any,
+    use_numpy: bool | None = None,
+) -> Any:
+    """Discounted prices, coupon parameters being scalars or one per price."""
+    np = _numpy(use_numpy)
+    if np is not None:
+        price_array = np.asarray(prices, dtype=np.int64)
+        discount_array = np.asarray(discount, dtype=np.int64)
+        percent_prices = np.maximum(
+            np.floor((1 - discount_array / 100) * price_array), 0
+        )
+        fixed_prices = np.maximum(price_array - discount_array, 0)
+
+        return np.where(is_percent, percent_prices.astype(np.int64), fixed_prices)
+
+    size = len(prices)
+    return [
+        max(math.floor((1 - line_discount / 100) * price), 0)
+        if line_is_percent
+        else max(price - line_discount, 0)
+        for price, line_discount, line_is_percent in zip(
+            prices, _broadcast(discount, size), _broadcast(is_percent, size)
+        )
+    ]
+
+
+def eligibility_mask(
+    prices: Sequence[int],
+    categories: Sequence[int],
+    columns: CouponColumns,
+    clock: Clock | None = None,
+    use_numpy: bool | None = None,
+) -> Any:
+    """Applicability of the coupon(s) to each product at the current instant of
+    `clock`, categories being encoded.
+
+    `columns` holds either a single coupon, checked against every product, or one
+    coupon per product.
+    """
+    moment = (clock or SystemClock()).epoch()
+
+    np = _numpy(use_numpy)
+    if np is not None:
+        coupon_category = np.asarray(columns.category)
+        return (
+            ((coupon_category == ANY_CATEGORY) | (coupon_category == categories))
+            & (np.asarray(prices) > np.asarray(columns.price_threshold))
+            & (np.asarray(columns.valid_from) <= moment)
+            & (moment <= np.asarray(columns.valid_to))
+        )
+
+    size = len(prices)
+    lines = zip(
+        prices,
+        categories,
+        _broadcast(columns.category, size),
+        _broadcast(columns.price_threshold, size),
+        _broadcast(columns.valid_from, size),
+        _broadcast(columns.valid_to, size),
+    )
+    return [
+        (coupon_category == ANY_CATEGORY or coupon_category == category)
+        and price > price_threshold
+        and valid_from <= moment <= valid_to
+        for price, category, coupon_category, price_threshold, valid_from, valid_to in lines
+    ]
+
+
+def price_products(
+    prices: Sequence[int],
+    categories: Sequence[ProductCategory | str],
+    coupons: Coupon | Sequence[Coupon],
+    clock: Clock | None = None,
+    use_numpy: bool | None = None,
+) -> PricingResult:
+    """Price a catalogue against one coupon, or against one coupon per product."""
+    np = _numpy(use_numpy)
+    use_numpy = np is not None
+
+    columns = CouponColumns.from_coupons(
+        [coupons] if isinstance(coupons, Coupon) else coupons, use_numpy
+    )
+    applicable = eligibility_mask(
+        prices, encode_categories(categories, use_numpy), columns, clock, use_numpy
+    )
+    discounted = discount_prices(
+        prices, columns.discount, columns.is_percent, use_numpy
+    )
+
+    if np is not None:
+        return PricingResult(applicable, np.where(applicable, discounted, prices))
+
+    return PricingResult(
+        applicable,
+        [
+            discounted_price if line_applicable else price
+            for price, discounted_price, line_applicable in zip(
+                prices, discounted, applicable
+            )
+        ],
+    )
@@ -0,0 +1,49 @@
+"""Profile a request or a command with cProfile.
+
+Profiles are written as `<profile id>.prof` files in the pstats format, to be
+browsed as a call tree with `python -m pstats` or snakeviz, or turned into a
+flamegraph with flameprof or gprof2dot.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+def new_profile_id() -> str:
+    return uuid.uuid4().hex
+
+
+def profile_path(directory: str | Path, profile_id: str) -> Path:
+    return Path(directory) / f"{profile_id}.prof"
+
+
+@contextmanager
+def profiled(directory: str | Path, profile_id: str | None = None) -> Iterator[str]:
+    """Profile the block, yielding the ID of the profile written when it exits.
+
+    Only one profiler can run at a time in a process, profiling while another
+    one runs raises a ValueError.
+    """
+    profile_id = profile_id or new_profile_id()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profile_id
+    finally:
+        profiler.disable()
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(profile_path(directory, profile_id))
+
+
+def sign_profile_request(secret: str, path: str) -> str:
+    """Signature asking for the requests to `path` to be profiled."""
+    return hmac.new(secret.encode(), path.encode(), hashlib.sha256).hexdigest()
+
+
+def is_signed_profile_request(secret: str, path: str, signature: str) -> bool:
+    return hmac.compare_digest(sign_profile_request(secret, path), signature)
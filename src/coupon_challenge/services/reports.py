@@ -0,0 +1,42 @@
+import json
+import time
+from dataclasses import dataclass, field
+
+from pydantic import ValidationError
+
+
+@dataclass
+class ProgressReport:
+    """Counts of a streamed run (an import, a migration, a batch pricing), read
+    while it goes to print its progress."""
+
+    read: int = 0
+    rejected: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Lines (or rows) processed per second."""
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+@dataclass
+class ResumableReport(ProgressReport):
+    # Last line (or rowid) handled by a previous run, everything up to it is skipped
+    resumed_from: int = 0
+
+
+def format_error(error: ValidationError | json.JSONDecodeError, subject: str) -> str:
+    """One line reason of a rejected input, the errors of the input as a whole
+    being reported on `subject` ("coupon", "product")."""
+    if isinstance(error, json.JSONDecodeError):
+        return f"Invalid JSON: {error}"
+
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in detail['loc']) or subject}: {detail['msg']}"
+        for detail in error.errors()
+    )
@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+
+def strong_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header lists `etag`, weak validators included."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+    # Headers of the response besides the ETag, like a pagination cursor
+    headers: dict[str, str]
+    # Pre-compressed body, None when too small to be worth it
+    gzip_body: bytes | None
+    gzip_etag: str | None
+    expiration: float
+
+
+class CouponResponseCache:
+    """Serialized bodies of the coupon reads, for the current version of the
+    collection.
+
+    `version` is bumped by every write made through this worker, dropping every
+    body. A body read from storage is only kept if no write happened meanwhile,
+    and at most `ttl` seconds so writes made by other workers show up. ETags are
+    hashes of the bodies: every worker gives the same ETag to the same content.
+    Bodies of at least `gzip_min_size` bytes are also kept gzipped, none when
+    unset.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 5.0,
+        max_size: int = 256,
+        gzip_min_size: int | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.gzip_min_size = gzip_min_size
+        self.clock = clock
+        self.version = 0
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+
+    def bump(self) -> None:
+        self.version += 1
+        self._entries.clear()
+
+    def get(self, key: Hashable) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expiration <= self.clock():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(
+        self,
+        key: Hashable,
+        version: int,
+        body: bytes,
+        headers: dict[str, str] | None = None,
+    ) -> CachedResponse:
+        """Build the response of a body read at `version`, kept when still current."""
+        gzip_body = gzip_etag = None
+        if self.gzip_min_size is not None and len(body) >= self.gzip_min_size:
+            # mtime=0 so the same body always compresses to the same bytes
+            gzip_body = gzip.compress(body, mtime=0)
+            gzip_etag = strong_etag(gzip_body)
+
+        entry = CachedResponse(
+            body=body,
+            etag=strong_etag(body),
+            headers=headers or {},
+            gzip_body=gzip_body,
+            gzip_etag=gzip_etag,
+            expiration=self.clock() + self.ttl,
+        )
+        if self.ttl <= 0 or version != self.version:
+            return entry
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+        return entry
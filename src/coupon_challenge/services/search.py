@@ -0,0 +1,218 @@
+import asyncio
+import bisect
+import heapq
+import time
+from collections import defaultdict
+from typing import Iterable
+
+from coupon_challenge.models.cart import Cart, CartApplication
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.clock import Clock
+from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.index import CouponIndex
+from coupon_challenge.services.storage import CouponStorage
+
+# (category condition, is_percent), a None category applies to every product
+RankingKey = tuple[ProductCategory | None, bool]
+# Sorted by (-discount, name) so the best discount comes first
+Rankings = dict[RankingKey, list[tuple[int, str]]]
+
+
+class CouponSearchEngine:
+    """In-memory engine finding the coupons giving the lowest price for a cart.
+
+    Coupons are ranked by discount in one list per (category condition, discount
+    kind). A search walks the lists relevant to the cart from the biggest discount
+    down, and stops as soon as the best possible saving of the remaining coupons
+    cannot beat the current top-k. Applicability is checked against a CouponIndex
+    and prices come from CouponApplicabilityService.
+
+    Coupons with a validity window are only ranked while in it: their lists are
+    built from the coupons the index finds in their window, once per segment of
+    its timeline, so expired and future coupons are never walked. Price
+    conditions are not partitioned: in the worst case, a search walks every
+    coupon in its window whose discount beats the top-k but whose price_above
+    excludes the whole cart.
+    """
+
+    def __init__(self, coupon_service: CouponApplicabilityService | None = None):
+        self.coupon_service = coupon_service or CouponApplicabilityService()
+        self.index = CouponIndex()
+        # Coupons always valid
+        self._rankings: Rankings = defaultdict(list)
+        # Rankings of the coupons in their validity window, and the set of the
+        # index they were built from
+        self._window_rankings: tuple[set[str], Rankings] | None = None
+        self._lock = asyncio.Lock()
+        self.loaded_at: float | None = None
+        # Bumped by every upsert and remove, a reload that raced with one of them
+        # may have read the storage before the write
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    @staticmethod
+    def _ranking_key(coupon: Coupon) -> RankingKey:
+        category = coupon.condition.category if coupon.condition else None
+        return category, coupon.is_percent
+
+    def upsert(self, coupon: Coupon) -> None:
+        self.remove(coupon.name)
+
+        self.index.upsert(coupon)
+        if coupon.validity is None:
+            bisect.insort(
+                self._rankings[self._ranking_key(coupon)],
+                (-coupon.discount, coupon.name),
+            )
+
+    def remove(self, name: str) -> None:
+        self.version += 1
+        self._window_rankings = None
+        if name not in self.index:
+            return
+
+        coupon = self.index.get(name)
+        self.index.remove(name)
+        if coupon.validity is not None:
+            return
+        ranking = self._rankings[self._ranking_key(coupon)]
+        index = bisect.bisect_left(ranking, (-coupon.discount, coupon.name))
+        del ranking[index]
+
+    def rebuild(self, coupons: Iterable[Coupon]) -> None:
+        self.index.rebuild(coupons)
+        self._rankings = self._rank(
+            coupon for coupon in self.index if coupon.validity is None
+        )
+        self._window_rankings = None
+
+        self.loaded_at = time.monotonic()
+
+    def _rank(self, coupons: Iterable[Coupon]) -> Rankings:
+        rankings: Rankings = defaultdict(list)
+        for coupon in coupons:
+            rankings[self._ranking_key(coupon)].append((-coupon.discount, coupon.name))
+        for ranking in rankings.values():
+            ranking.sort()
+
+        return rankings
+
+    def _rankings_in_window(self, at: int) -> Rankings:
+        """Rankings of the coupons in their validity window at `at`, rebuilt when
+        the index moves to another segment."""
+        in_window = self.index.in_window(at)
+        if self._window_rankings is None or self._window_rankings[0] is not in_window:
+            self._window_rankings = (
+                in_window,
+                self._rank(map(self.index.get, in_window)),
+            )
+
+        return self._window_rankings[1]
+
+    def mark_stale(self) -> None:
+        """Have the next refresh_if_stale reload the coupons."""
+        self.loaded_at = None
+
+    async def _reload(self, coupon_storage: CouponStorage) -> None:
+        version = self.version
+        self.rebuild(await coupon_storage.get_all())
+        # A write made while reading may be missing, catch up on the next search
+        if self.version != version:
+            self.mark_stale()
+
+    async def load(self, coupon_storage: CouponStorage) -> None:
+        async with self._lock:
+            await self._reload(coupon_storage)
+
+    async def refresh_if_stale(
+        self, coupon_storage: CouponStorage, max_age: float
+    ) -> None:
+        """Reload coupons written by other processes once the index is too old."""
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < max_age:
+            return
+
+        loaded_at = self.loaded_at
+        async with self._lock:
+            # Another request may have reloaded while we were waiting
+            if self.loaded_at != loaded_at:
+                return
+            await self._reload(coupon_storage)
+
+    def _max_saving(
+        self, discount: int, is_percent: bool, products: list[Product]
+    ) -> int:
+        """Best saving any coupon of this kind and discount could give to the cart."""
+        return sum(
+            product.price
+            - self.coupon_service.price_after_discount(
+                discount, is_percent, product.price
+            )
+            for product in products
+        )
+
+    def _saving(self, name: str, products: list[Product], at: int) -> int | None:
+        """Saving of the coupon over the cart, None if it applies to no line."""
+        coupon = self.index.get(name)
+        saving = None
+        for product in products:
+            if self.index.is_applicable(name, product.price, product.category, at):
+                price = self.coupon_service.discounted_price(coupon, product.price)
+                saving = (saving or 0) + product.price - price
+
+        return saving
+
+    def best(
+        self, cart: Cart, limit: int = 5, clock: Clock | None = None
+    ) -> list[CartApplication]:
+        """Return the `limit` coupons giving the lowest cart price, applicability
+        being checked at a single instant of `clock` (the service one by default)."""
+        products = cart.root
+        if not products or limit <= 0:
+            return []
+
+        coupon_service = CouponApplicabilityService(
+            (clock or self.coupon_service.clock).freeze()
+        )
+        at_epoch = coupon_service.clock.epoch()
+        categories: set[ProductCategory | None] = {None}
+        categories.update(product.category for product in products)
+
+        # Min-heap of (saving, -rank, name): the weakest candidate is on top and
+        # on equal saving the coupon walked first wins
+        top: list[tuple[int, int, str]] = []
+        rank = 0
+
+        rankings_in_window = self._rankings_in_window(at_epoch)
+        for is_percent in (False, True):
+            rankings = [
+                ranking.get((category, is_percent), [])
+                for ranking in (self._rankings, rankings_in_window)
+                for category in categories
+            ]
+            for negative_discount, name in heapq.merge(*rankings):
+                if len(top) == limit and (
+                    self._max_saving(-negative_discount, is_percent, products)
+                    <= top[0][0]
+                ):
+                    break
+
+                saving = self._saving(name, products, at_epoch)
+                if saving is None:
+                    continue
+
+                rank += 1
+                if len(top) < limit:
+                    heapq.heappush(top, (saving, -rank, name))
+                else:
+                    heapq.heappushpop(top, (saving, -rank, name))
+
+        return [
+            coupon_service.apply_discount_to_cart(self.index.get(name), cart)
+            for _, _, name in sorted(top, reverse=True)
+        ]
@@ -1,4 +1,17 @@
-from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator
+
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCondition,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+)
+from coupon_challenge.models.product import Product
+from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.index import to_epoch
 
 
 class CouponStorageError(Exception):
@@ -29,16 +42,158 @@ class CouponStorageAlreadyExistsError(CouponStorageError):
     pass
 
 
+@dataclass
+class CouponBulkWriteResult:
+    inserted: int = 0
+    # Position of the rejected coupon in the batch -> reason
+    errors: dict[int, str] = field(default_factory=dict)
+
+
+def coupon_matches(coupon: Coupon, coupon_filter: CouponFilter) -> bool:
+    condition = coupon.condition or CouponCondition()
+    if coupon_filter.category and condition.category != coupon_filter.category:
+        return False
+    if (
+        coupon_filter.max_price_above is not None
+        and (condition.price_above or 0) > coupon_filter.max_price_above
+    ):
+        return False
+    if (
+        coupon_filter.is_percent is not None
+        and coupon.is_percent != coupon_filter.is_percent
+    ):
+        return False
+    if coupon_filter.name_prefix and not coupon.name.startswith(
+        coupon_filter.name_prefix
+    ):
+        return False
+    if coupon_filter.valid_at and coupon.validity:
+        moment = to_epoch(coupon_filter.valid_at)
+        start, end = map(to_epoch, coupon.validity)
+        return start <= moment <= end
+
+    return True
+
+
+def coupon_applies(coupon: Coupon, product: Product, moment: int) -> bool:
+    """Rules of CouponApplicabilityService.coupon_is_applicable at an epoch moment."""
+    if coupon.validity:
+        start, end = map(to_epoch, coupon.validity)
+        if not start <= moment <= end:
+            return False
+
+    condition = coupon.condition or CouponCondition()
+    if condition.category and condition.category != product.category:
+        return False
+
+    return not condition.price_above or product.price > condition.price_above
+
+
+def coupon_saving(coupon: Coupon, product: Product) -> int:
+    return product.price - CouponApplicabilityService().discounted_price(
+        coupon, product.price
+    )
+
+
 class CouponStorage:
-    async def get_all(self) -> list[Coupon]:
+    async def initialize(self) -> None:
+        """Warm up the backend (connections, metadata) before serving requests."""
+        return
+
+    async def missing_indexes(self) -> list[str]:
+        """Names of the indexes the backend relies on but cannot find."""
+        return []
+
+    async def get_all(
+        self, limit: int | None = None, after: str | None = None
+    ) -> list[Coupon]:
+        """Retrieve coupons, every one of them by default.
+
+        When paginating, coupons are sorted by name: `limit` bounds the page size
+        and `after` is the name of the last coupon of the previous page.
+        """
         raise NotImplementedError()
 
     async def get(self, name: str) -> Coupon:
         raise NotImplementedError()
 
+    async def find(
+        self,
+        coupon_filter: CouponFilter,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> list[Coupon]:
+        """Retrieve the coupons matching a filter, paginated like `get_all`.
+
+        Backends should override it with a native query, this default filters
+        every coupon in Python.
+        """
+        coupons = sorted(
+            (
+                coupon
+                for coupon in await self.get_all()
+                if (after is None or coupon.name > after)
+                and coupon_matches(coupon, coupon_filter)
+            ),
+            key=lambda coupon: coupon.name,
+        )
+
+        return coupons[:limit]
+
+    async def applicable_coupons(
+        self, product: Product, at: datetime, limit: int | None = None
+    ) -> list[Coupon]:
+        """Retrieve the coupons applicable to a product at a moment, the largest
+        saving on its price first (then by name).
+
+        Backends should override it with a native query, this default evaluates
+        every coupon in Python.
+        """
+        moment = to_epoch(at)
+        coupons = [
+            coupon
+            for coupon in await self.get_all()
+            if coupon_applies(coupon, product, moment)
+        ]
+        coupons.sort(key=lambda coupon: (-coupon_saving(coupon, product), coupon.name))
+
+        return coupons[:limit]
+
     async def create(self, coupon_create: CouponCreate) -> Coupon:
         raise NotImplementedError()
 
+    async def create_many(
+        self, coupon_creates: list[CouponCreate]
+    ) -> CouponBulkWriteResult:
+        """Create a batch of coupons, reporting the ones that could not be created.
+
+        Backends should override it with a single bulk write.
+        """
+        result = CouponBulkWriteResult()
+        for position, coupon_create in enumerate(coupon_creates):
+            try:
+                await self.create(coupon_create)
+            except CouponStorageAlreadyExistsError:
+                result.errors[position] = "Coupon with this name already exists"
+            else:
+                result.inserted += 1
+
+        return result
+
+    async def iter_all(
+        self,
+        batch_size: int = 1000,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> AsyncIterator[Coupon]:
+        """Iterate over coupons without loading them all in memory, `limit` and
+        `after` paginating like in `get_all`.
+
+        Backends should override it to stream from a database cursor.
+        """
+        for coupon in await self.get_all(limit=limit, after=after):
+            yield coupon
+
     async def update(self, coupon_update: CouponUpdate) -> Coupon:
         raise NotImplementedError()
 
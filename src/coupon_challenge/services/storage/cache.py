@@ -0,0 +1,208 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Callable
+
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+)
+from coupon_challenge.models.product import Product
+from coupon_challenge.services.storage import (
+    CouponBulkWriteResult,
+    CouponStorage,
+    CouponStorageNotFoundError,
+)
+
+
+@dataclass
+class CouponCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class CachedCouponStorage(CouponStorage):
+    """Read-through cache in front of any CouponStorage.
+
+    `get` and `get_all` are served from an in-process LRU bounded by `max_size`,
+    each entry living `ttl` seconds. Missing coupons are remembered for
+    `negative_ttl` seconds so repeated lookups of an unknown name do not reach
+    the backend. Every write goes to the backend and invalidates what it touched.
+
+    `version` is bumped when a write starts and when it ends, a value read from
+    the backend is only kept if no write happened meanwhile: it may predate the
+    write.
+
+    The cache is local to the process: writes made by other workers are only seen
+    once the entries expire.
+    """
+
+    def __init__(
+        self,
+        coupon_storage: CouponStorage,
+        ttl: float = 60.0,
+        negative_ttl: float = 5.0,
+        max_size: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.coupon_storage = coupon_storage
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.stats = CouponCacheStats()
+        # name -> (expiration, coupon), a None coupon is a cached "not found"
+        self._entries: OrderedDict[str, tuple[float, Coupon | None]] = OrderedDict()
+        self._all: tuple[float, list[Coupon]] | None = None
+        self.version = 0
+
+    def _store(self, name: str, coupon: Coupon | None, version: int) -> None:
+        """Cache what was read at `version`, unless a write happened since."""
+        ttl = self.ttl if coupon is not None else self.negative_ttl
+        if ttl <= 0 or version != self.version:
+            return
+
+        self._entries[name] = (self.clock() + ttl, coupon)
+        self._entries.move_to_end(name)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _invalidate(self, name: str) -> int:
+        self.version += 1
+        self._entries.pop(name, None)
+        self._all = None
+
+        return self.version
+
+    def clear(self) -> None:
+        self.version += 1
+        self._entries.clear()
+        self._all = None
+
+    async def initialize(self) -> None:
+        await self.coupon_storage.initialize()
+
+    async def missing_indexes(self) -> list[str]:
+        return await self.coupon_storage.missing_indexes()
+
+    async def get_all(
+        self, limit: int | None = None, after: str | None = None
+    ) -> list[Coupon]:
+        if limit is not None or after is not None:
+            # Only the full listing is cached, pages go to the backend
+            return await self.coupon_storage.get_all(limit=limit, after=after)
+
+        if self._all is not None and self._all[0] > self.clock():
+            self.stats.hits += 1
+            return list(self._all[1])
+
+        self.stats.misses += 1
+        version = self.version
+        coupons = await self.coupon_storage.get_all()
+        if version == self.version:
+            self._all = (self.clock() + self.ttl, coupons)
+
+        return list(coupons)
+
+    async def get(self, name: str) -> Coupon:
+        entry = self._entries.get(name)
+        if entry is not None:
+            expiration, coupon = entry
+            if expiration > self.clock():
+                self.stats.hits += 1
+                self._entries.move_to_end(name)
+                if coupon is None:
+                    raise CouponStorageNotFoundError()
+                return coupon
+
+            del self._entries[name]
+
+        self.stats.misses += 1
+        version = self.version
+        try:
+            coupon = await self.coupon_storage.get(name)
+        except CouponStorageNotFoundError:
+            self._store(name, None, version)
+            raise
+
+        self._store(name, coupon, version)
+
+        return coupon
+
+    async def find(
+        self,
+        coupon_filter: CouponFilter,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> list[Coupon]:
+        # Filtered listings are too varied to be worth caching
+        return await self.coupon_storage.find(coupon_filter, limit=limit, after=after)
+
+    async def applicable_coupons(
+        self, product: Product, at: datetime, limit: int | None = None
+    ) -> list[Coupon]:
+        return await self.coupon_storage.applicable_coupons(product, at, limit=limit)
+
+    async def create(self, coupon_create: CouponCreate) -> Coupon:
+        version = self._invalidate(coupon_create.name)
+        try:
+            coupon = await self.coupon_storage.create(coupon_create)
+        finally:
+            # Reads made during the write may have seen the coupon or not
+            self._invalidate(coupon_create.name)
+        # Current unless another write ran meanwhile
+        self._store(coupon.name, coupon, version + 1)
+
+        return coupon
+
+    async def create_many(
+        self, coupon_creates: list[CouponCreate]
+    ) -> CouponBulkWriteResult:
+        # Bulk writes are rare and may touch many entries, start over
+        self.clear()
+        try:
+            return await self.coupon_storage.create_many(coupon_creates)
+        finally:
+            self.clear()
+
+    async def iter_all(
+        self,
+        batch_size: int = 1000,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> AsyncIterator[Coupon]:
+        # Streaming is meant for large exports, not worth caching
+        async for coupon in self.coupon_storage.iter_all(batch_size, limit, after):
+            yield coupon
+
+    async def update(self, coupon_update: CouponUpdate) -> Coupon:
+        version = self._invalidate(coupon_update.name)
+        try:
+            coupon = await self.coupon_storage.update(coupon_update)
+        finally:
+            self._invalidate(coupon_update.name)
+        self._store(coupon.name, coupon, version + 1)
+
+        return coupon
+
+    async def delete(self, name: str) -> None:
+        self._invalidate(name)
+        try:
+            await self.coupon_storage.delete(name)
+        finally:
+            self._invalidate(name)
+
+    def close(self) -> None:
+        self.clear()
+        self.coupon_storage.close()
@@ -0,0 +1,121 @@
+import time
+from datetime import datetime
+from typing import AsyncIterator, Awaitable
+
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+)
+from coupon_challenge.models.product import Product
+from coupon_challenge.services.metrics import STORAGE_OPERATION_DURATION
+from coupon_challenge.services.storage import CouponBulkWriteResult, CouponStorage
+
+
+class InstrumentedCouponStorage(CouponStorage):
+    """Time every call to a CouponStorage in the storage operation histogram.
+
+    Calls are labelled with the backend, the method and whether they raised, a
+    coupon not found being an error like any other.
+    """
+
+    def __init__(self, coupon_storage: CouponStorage, backend: str):
+        self.coupon_storage = coupon_storage
+        self.backend = backend
+
+    def _observe(self, operation: str, outcome: str, seconds: float) -> None:
+        STORAGE_OPERATION_DURATION.labels(self.backend, operation, outcome).observe(
+            seconds
+        )
+
+    async def _timed[T](self, operation: str, call: Awaitable[T]) -> T:
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await call
+            outcome = "ok"
+            return result
+        finally:
+            self._observe(operation, outcome, time.perf_counter() - started)
+
+    async def initialize(self) -> None:
+        await self._timed("initialize", self.coupon_storage.initialize())
+
+    async def missing_indexes(self) -> list[str]:
+        return await self._timed(
+            "missing_indexes", self.coupon_storage.missing_indexes()
+        )
+
+    async def get_all(
+        self, limit: int | None = None, after: str | None = None
+    ) -> list[Coupon]:
+        return await self._timed(
+            "get_all", self.coupon_storage.get_all(limit=limit, after=after)
+        )
+
+    async def get(self, name: str) -> Coupon:
+        return await self._timed("get", self.coupon_storage.get(name))
+
+    async def find(
+        self,
+        coupon_filter: CouponFilter,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> list[Coupon]:
+        return await self._timed(
+            "find", self.coupon_storage.find(coupon_filter, limit=limit, after=after)
+        )
+
+    async def applicable_coupons(
+        self, product: Product, at: datetime, limit: int | None = None
+    ) -> list[Coupon]:
+        return await self._timed(
+            "applicable_coupons",
+            self.coupon_storage.applicable_coupons(product, at, limit=limit),
+        )
+
+    async def create(self, coupon_create: CouponCreate) -> Coupon:
+        return await self._timed("create", self.coupon_storage.create(coupon_create))
+
+    async def create_many(
+        self, coupon_creates: list[CouponCreate]
+    ) -> CouponBulkWriteResult:
+        return await self._timed(
+            "create_many", self.coupon_storage.create_many(coupon_creates)
+        )
+
+    async def iter_all(
+        self,
+        batch_size: int = 1000,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> AsyncIterator[Coupon]:
+        # Only the time spent waiting for the backend, not the one of the consumer
+        coupons = aiter(self.coupon_storage.iter_all(batch_size, limit, after))
+        elapsed = 0.0
+        while True:
+            started = time.perf_counter()
+            try:
+                coupon = await anext(coupons)
+            except StopAsyncIteration:
+                break
+            except BaseException:
+                self._observe(
+                    "iter_all", "error", elapsed + time.perf_counter() - started
+                )
+                raise
+            elapsed += time.perf_counter() - started
+
+            yield coupon
+
+        self._observe("iter_all", "ok", elapsed + time.perf_counter() - started)
+
+    async def update(self, coupon_update: CouponUpdate) -> Coupon:
+        return await self._timed("update", self.coupon_storage.update(coupon_update))
+
+    async def delete(self, name: str) -> None:
+        await self._timed("delete", self.coupon_storage.delete(name))
+
+    def close(self) -> None:
+        self.coupon_storage.close()
@@ -0,0 +1,65 @@
+from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
+from coupon_challenge.services.storage import (
+    CouponStorage,
+    CouponStorageAlreadyExistsError,
+    CouponStorageNotFoundError,
+)
+
+
+class InMemoryCouponStorage(CouponStorage):
+    """Coupons kept in a dict of the worker process, lost when it stops.
+
+    Meant for tests and benchmarks, every other query relies on the Python
+    defaults of CouponStorage.
+    """
+
+    def __init__(self, data: list[Coupon] | None = None):
+        super().__init__()
+        self.data: dict[str, Coupon] = {c.name: c for c in data} if data else {}
+
+    async def get_all(
+        self, limit: int | None = None, after: str | None = None
+    ) -> list[Coupon]:
+        if limit is None and after is None:
+            return list(self.data.values())
+
+        names = sorted(name for name in self.data if after is None or name > after)
+        return [self.data[name] for name in names[:limit]]
+
+    async def get(self, name: str) -> Coupon:
+        if name not in self.data:
+            raise CouponStorageNotFoundError()
+
+        return self.data[name]
+
+    async def create(self, coupon_create: CouponCreate) -> Coupon:
+        if coupon_create.name in self.data:
+            raise CouponStorageAlreadyExistsError()
+
+        self.data[coupon_create.name] = Coupon.model_validate(
+            coupon_create.model_dump()
+        )
+
+        return self.data[coupon_create.name]
+
+    async def update(self, coupon_update: CouponUpdate) -> Coupon:
+        if coupon_update.name not in self.data:
+            raise CouponStorageNotFoundError()
+
+        coupon = self.data[coupon_update.name]
+        coupon_data = coupon.model_dump(exclude={"discount", "is_percent"})
+        coupon_data["discount"] = coupon.discount_raw
+        self.data[coupon_update.name] = Coupon.model_validate(
+            {**coupon_data, **coupon_update.model_dump(exclude_unset=True)}
+        )
+
+        return self.data[coupon_update.name]
+
+    async def delete(self, name: str) -> None:
+        if name not in self.data:
+            raise CouponStorageNotFoundError()
+
+        del self.data[name]
+
+    def close(self) -> None:
+        return
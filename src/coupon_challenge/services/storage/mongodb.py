@@ -1,18 +1,47 @@
-from typing import ClassVar
+import logging
+import re
+from datetime import datetime
+from typing import Any, AsyncIterator, ClassVar
 
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import MongoDsn
+from pydantic import MongoDsn, ValidationError
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from pymongo.server_api import ServerApi
 
-from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+    CouponValidity,
+)
+from coupon_challenge.models.product import Product
 from coupon_challenge.services.storage import (
+    CouponBulkWriteResult,
     CouponStorage,
     CouponStorageAlreadyExistsError,
     CouponStorageCreateError,
-    CouponStorageDeleteError,
     CouponStorageNotFoundError,
 )
 
+DUPLICATE_KEY_ERROR_CODE = 11000
+# Version of the layout of the documents written by to_versioned_document, only
+# documents of this version are read without validation
+DOCUMENT_SCHEMA_VERSION = 1
+
+REQUIRED_INDEXES = [
+    # Names are unique at the database level so writes need no prior lookup
+    IndexModel([("name", ASCENDING)], unique=True),
+    # Filtered listings and applicable coupons lookups
+    IndexModel(
+        [("condition.category", ASCENDING), ("condition.price_above", ASCENDING)]
+    ),
+    IndexModel([("validity.start", ASCENDING), ("validity.end", ASCENDING)]),
+]
+
+logger = logging.getLogger(__name__)
+
 
 def catch_mongodb_error_and_rollback():
     """This function should be a decorator and applied to every methods that connect and perform operation on database.
@@ -21,74 +50,456 @@ def catch_mongodb_error_and_rollback():
     raise NotImplementedError()
 
 
+def to_document(coupon_data: dict[str, Any]) -> dict[str, Any]:
+    """Coupon fields as stored: discount split into an integer and is_percent,
+    validity as a {start, end} subdocument, so both can be queried.
+
+    Partial data (for an update) is converted as well.
+    """
+    document = dict(coupon_data)
+    if isinstance(document.get("discount"), str):
+        coupon = Coupon.model_validate({"name": "", "discount": document["discount"]})
+        document["discount"] = coupon.discount
+        document["is_percent"] = coupon.is_percent
+    elif "discount" in document:
+        document["is_percent"] = False
+    if document.get("validity"):
+        document["validity"] = CouponValidity(*document["validity"])._asdict()
+
+    return document
+
+
+def to_versioned_document(coupon_data: dict[str, Any]) -> dict[str, Any]:
+    """A whole coupon as stored, tagged with the version of its layout."""
+    return {**to_document(coupon_data), "schema_version": DOCUMENT_SCHEMA_VERSION}
+
+
+def upgrade_document(document: dict[str, Any]) -> dict[str, Any]:
+    """A document written before the current layout (e.g. a "20%" discount and a
+    [start, end] validity), rewritten in the current one."""
+    coupon = Coupon.model_validate(document)
+    coupon_data = coupon.model_dump(exclude={"is_percent"})
+    coupon_data["discount"] = coupon.discount_raw
+
+    return to_versioned_document(coupon_data)
+
+
+def from_document(document: dict[str, Any], strict: bool = False) -> Coupon:
+    """Coupon of a stored document, trusted unless `strict` when it was written by
+    this version of the storage."""
+    if strict or document.get("schema_version") != DOCUMENT_SCHEMA_VERSION:
+        return Coupon.model_validate(document)
+
+    validity = document.get("validity")
+    return Coupon.from_trusted(
+        document["name"],
+        document["discount"],
+        document["is_percent"],
+        document.get("condition"),
+        CouponValidity(validity["start"], validity["end"]) if validity else None,
+    )
+
+
+def naive_local(moment: datetime) -> datetime:
+    """A moment comparable to the validity bounds, stored as naive local times
+    like datetime.now()."""
+    if moment.tzinfo is None:
+        return moment
+
+    return moment.astimezone().replace(tzinfo=None)
+
+
+def to_query(coupon_filter: CouponFilter) -> dict[str, Any]:
+    clauses: list[dict[str, Any]] = []
+    if coupon_filter.category:
+        clauses.append({"condition.category": coupon_filter.category})
+    if coupon_filter.max_price_above is not None:
+        # A null (or missing) price_above matches any price
+        clauses.append(
+            {
+                "$or": [
+                    {"condition.price_above": None},
+                    {"condition.price_above": {"$lte": coupon_filter.max_price_above}},
+                ]
+            }
+        )
+    if coupon_filter.is_percent is not None:
+        clauses.append({"is_percent": coupon_filter.is_percent})
+    if coupon_filter.valid_at:
+        valid_at = naive_local(coupon_filter.valid_at)
+        clauses.append(
+            {
+                "$or": [
+                    {"validity": None},
+                    {
+                        "validity.start": {"$lte": valid_at},
+                        "validity.end": {"$gte": valid_at},
+                    },
+                ]
+            }
+        )
+
+    query: dict[str, Any] = {"$and": clauses} if clauses else {}
+    if coupon_filter.name_prefix:
+        # An anchored, case sensitive regex is served by the name index
+        query["name"] = {"$regex": f"^{re.escape(coupon_filter.name_prefix)}"}
+
+    return query
+
+
+def page_query(after: str | None, coupon_filter: CouponFilter | None) -> dict[str, Any]:
+    query = to_query(coupon_filter) if coupon_filter else {}
+    if after is not None:
+        query.setdefault("name", {})["$gt"] = after
+
+    return query
+
+
+def query_shape(value: Any) -> Any:
+    """A query with its values blanked, queries differing only by values share it."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(item) for item in value]
+
+    return None
+
+
+def plan_stages(explained: Any) -> set[str]:
+    """Stages of the winning plan(s) of an explain output, wherever they are nested
+    (aggregations wrap the query plan in their first stage)."""
+    if isinstance(explained, list):
+        return set().union(*map(plan_stages, explained))
+    if not isinstance(explained, dict):
+        return set()
+
+    stages = {explained["stage"]} if isinstance(explained.get("stage"), str) else set()
+    for key, value in explained.items():
+        if key != "rejectedPlans":
+            stages |= plan_stages(value)
+
+    return stages
+
+
+def applicable_pipeline(product: Product, at: datetime) -> list[dict[str, Any]]:
+    """Aggregation selecting the coupons applicable to a product, like
+    coupon_is_applicable, sorted by the saving they give on its price."""
+    at = naive_local(at)
+    price = product.price
+    eligibility = {
+        "$and": [
+            # The saving is computed on the current layout only (a "20%" discount
+            # string would be ranked as a fixed discount of the whole price), older
+            # documents are rewritten in it by upgrade_documents
+            {"schema_version": DOCUMENT_SCHEMA_VERSION},
+            {
+                "$or": [
+                    {"condition.category": None},
+                    {"condition.category": product.category},
+                ]
+            },
+            # A price_above of 0 is no condition at all
+            {
+                "$or": [
+                    {"condition.price_above": None},
+                    {"condition.price_above": 0},
+                    {"condition.price_above": {"$lt": price}},
+                ]
+            },
+            {
+                "$or": [
+                    {"validity": None},
+                    {"validity.start": {"$lte": at}, "validity.end": {"$gte": at}},
+                ]
+            },
+        ]
+    }
+    # Same float expression as the service: floor((1 - discount / 100) * price),
+    # floored at 0 like the prices of the service so savings never exceed the price
+    percent_price = {
+        "$floor": {
+            "$multiply": [{"$subtract": [1, {"$divide": ["$discount", 100]}]}, price]
+        }
+    }
+    saving = {
+        "$cond": [
+            "$is_percent",
+            {"$min": [{"$subtract": [price, percent_price]}, price]},
+            {"$min": ["$discount", price]},
+        ]
+    }
+
+    return [
+        {"$match": eligibility},
+        {"$addFields": {"saving": saving}},
+        {"$sort": {"saving": DESCENDING, "name": ASCENDING}},
+    ]
+
+
 class MongoDBCouponStorage(CouponStorage):
     collection_name: ClassVar[str] = "coupons"
 
     # FIXME: use settings to get db_uri
-    def __init__(self, db_uri: str | MongoDsn):
+    def __init__(
+        self,
+        db_uri: str | MongoDsn,
+        expired_coupons_ttl: int | None = None,
+        check_query_plans: bool = False,
+        strict: bool = False,
+    ):
         self.client = AsyncIOMotorClient(str(db_uri), server_api=ServerApi("1"))
         self.collection = self.client["challenge"][self.collection_name]
+        self.expired_coupons_ttl = expired_coupons_ttl
+        self.check_query_plans = check_query_plans
+        # Validate every document read, whatever its schema version
+        self.strict = strict
+        # Shapes of the queries already explained, see _warn_on_collscan
+        self._explained: set[str] = set()
+
+    async def initialize(self) -> None:
+        # Force server discovery and open a first pooled connection
+        await self.client.admin.command("ping")
+        await self.ensure_indexes()
+        await self.upgrade_documents()
+
+    async def upgrade_documents(self) -> int:
+        """Rewrite the documents of an older layout in the current one, so the
+        queries on is_percent, validity and price_above match them as well.
+
+        Documents failing validation are left as they are (and still rejected
+        when read). Returns the number of documents rewritten.
+        """
+        outdated = await self.collection.find(
+            {"schema_version": {"$ne": DOCUMENT_SCHEMA_VERSION}}
+        ).to_list()
+
+        requests = []
+        for document in outdated:
+            try:
+                upgraded = upgrade_document(document)
+            except ValidationError:
+                logger.warning("Could not upgrade coupon document %s", document)
+                continue
+            upgraded.pop("_id", None)
+            requests.append(ReplaceOne({"_id": document["_id"]}, upgraded))
+
+        if not requests:
+            return 0
+
+        result = await self.collection.bulk_write(requests, ordered=False)
+        logger.info("Upgraded %d coupon documents", result.modified_count)
+        return result.modified_count
+
+    def indexes(self) -> list[IndexModel]:
+        """Indexes the queries of this storage rely on."""
+        indexes = list(REQUIRED_INDEXES)
+        if self.expired_coupons_ttl is not None:
+            indexes.append(
+                IndexModel(
+                    [("validity.end", ASCENDING)],
+                    expireAfterSeconds=self.expired_coupons_ttl,
+                )
+            )
+
+        return indexes
+
+    async def ensure_indexes(self) -> None:
+        # Creating an index that already exists with the same options is a no-op
+        await self.collection.create_indexes(self.indexes())
+
+    async def missing_indexes(self) -> list[str]:
+        existing = {
+            tuple(map(tuple, information["key"])): information
+            for information in (await self.collection.index_information()).values()
+        }
+
+        missing = []
+        for index in self.indexes():
+            document = index.document
+            information = existing.get(tuple(document["key"].items()))
+            if information is None or any(
+                information.get(option) != document[option]
+                for option in ("unique", "expireAfterSeconds")
+                if option in document
+            ):
+                missing.append(document["name"])
+
+        return missing
+
+    async def _warn_on_collscan(self, command: dict[str, Any]) -> None:
+        """Log the plan of a query scanning the whole collection.
+
+        Each query shape (its fields and operators, whatever the values) is only
+        explained the first time it is seen, to keep the overhead bounded.
+        """
+        if not self.check_query_plans:
+            return
+
+        shape = repr(query_shape(command))
+        if shape in self._explained:
+            return
+        self._explained.add(shape)
+
+        try:
+            plan = await self.collection.database.command(
+                {"explain": command, "verbosity": "queryPlanner"}
+            )
+        except PyMongoError:
+            logger.debug("Could not explain %s", command, exc_info=True)
+            return
+
+        if "COLLSCAN" in plan_stages(plan):
+            logger.warning(
+                "Query on %s falls back to a collection scan: %s\nPlan: %s",
+                self.collection_name,
+                command,
+                plan.get("queryPlanner", plan),
+            )
+
+    def _find_page(
+        self,
+        limit: int | None,
+        after: str | None,
+        batch_size: int = 0,
+        coupon_filter: CouponFilter | None = None,
+    ) -> Any:
+        """Cursor over a page of coupons, walking the unique name index."""
+        paginated = limit is not None or after is not None
+        return self.collection.find(
+            page_query(after, coupon_filter),
+            {"_id": False},
+            sort=[("name", ASCENDING)] if paginated else None,
+            limit=limit or 0,
+            batch_size=batch_size,
+        )
 
     # @catch_mongodb_error_and_rollback
-    async def get_all(self) -> list[Coupon]:
-        # We should handle limit properly by doing bulk operation, and maybe add pagination options
-        cursor = self.collection.find({})
-        coupons = await cursor.to_list()
-        return [Coupon.model_validate(coupon) for coupon in coupons]
+    async def get_all(
+        self, limit: int | None = None, after: str | None = None
+    ) -> list[Coupon]:
+        coupons = await self._find_page(limit, after).to_list()
+        return [from_document(coupon, self.strict) for coupon in coupons]
 
     # @catch_mongodb_error_and_rollback
     async def get(self, name: str) -> Coupon:
-        coupon_data = await self.collection.find_one({"name": name})
+        coupon_data = await self.collection.find_one({"name": name}, {"_id": False})
 
         if not coupon_data:
             raise CouponStorageNotFoundError()
 
-        # Remove id to build Coupon
-        if "_id" in coupon_data:
-            del coupon_data["_id"]
+        return from_document(coupon_data, self.strict)
 
-        return Coupon.model_validate(coupon_data)
+    # @catch_mongodb_error_and_rollback
+    async def find(
+        self,
+        coupon_filter: CouponFilter,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> list[Coupon]:
+        cursor = self._find_page(limit, after, coupon_filter=coupon_filter)
+        coupons = [
+            from_document(coupon, self.strict) for coupon in await cursor.to_list()
+        ]
+
+        await self._warn_on_collscan(
+            {"find": self.collection_name, "filter": page_query(after, coupon_filter)}
+        )
+
+        return coupons
+
+    # @catch_mongodb_error_and_rollback
+    async def applicable_coupons(
+        self, product: Product, at: datetime, limit: int | None = None
+    ) -> list[Coupon]:
+        pipeline = applicable_pipeline(product, at)
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": {"_id": False, "saving": False}})
+
+        cursor = self.collection.aggregate(pipeline)
+        coupons = [
+            from_document(coupon, self.strict) for coupon in await cursor.to_list()
+        ]
+
+        await self._warn_on_collscan(
+            {"aggregate": self.collection_name, "pipeline": pipeline, "cursor": {}}
+        )
+
+        return coupons
 
     # @catch_mongodb_error_and_rollback
     async def create(self, coupon_create: CouponCreate) -> Coupon:
+        document = to_versioned_document(coupon_create.model_dump())
         try:
-            # FIXME: We may not need to get first, see if somehow insert_one can return an error
-            #        if the name is already taken in database
-            await self.get(coupon_create.name)
-        except CouponStorageNotFoundError:
-            # FIXME: thinking about it, running nominal code in a except is quite unsual (Tech Debt)
-            result = await self.collection.insert_one(coupon_create.model_dump())
-
-            if not result.inserted_id:
-                raise CouponStorageCreateError()
-
-            # FIXME: we may use returned object from db instead of input data
-            return Coupon.model_validate(coupon_create.model_dump())
-        else:
+            result = await self.collection.insert_one(document)
+        except DuplicateKeyError:
             raise CouponStorageAlreadyExistsError()
 
+        if not result.inserted_id:
+            raise CouponStorageCreateError()
+
+        # insert_one adds the generated _id to the document it stored
+        document.pop("_id", None)
+        return from_document(document)
+
     # @catch_mongodb_error_and_rollback
-    async def update(self, coupon_update: CouponUpdate) -> Coupon:
-        coupon = await self.get(coupon_update.name)
-        update_data = coupon_update.model_dump(exclude_unset=True)
+    async def create_many(
+        self, coupon_creates: list[CouponCreate]
+    ) -> CouponBulkWriteResult:
+        result = CouponBulkWriteResult()
+        if not coupon_creates:
+            return result
 
-        await self.collection.update_one(
-            {"name": coupon_update.name}, {"$set": update_data}
-        )
+        documents = [
+            to_versioned_document(coupon_create.model_dump())
+            for coupon_create in coupon_creates
+        ]
+        try:
+            # Unordered so one failing document does not stop the rest of the batch
+            insert_result = await self.collection.insert_many(documents, ordered=False)
+            result.inserted = len(insert_result.inserted_ids)
+        except BulkWriteError as error:
+            result.inserted = error.details["nInserted"]
+            for write_error in error.details["writeErrors"]:
+                result.errors[write_error["index"]] = (
+                    "Coupon with this name already exists"
+                    if write_error["code"] == DUPLICATE_KEY_ERROR_CODE
+                    else write_error["errmsg"]
+                )
+
+        return result
+
+    async def iter_all(
+        self,
+        batch_size: int = 1000,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> AsyncIterator[Coupon]:
+        async for coupon_data in self._find_page(limit, after, batch_size):
+            yield from_document(coupon_data, self.strict)
 
-        # warning: we do not return the db object :/
-        return Coupon.model_validate(
-            {**coupon.model_dump(), **coupon_update.model_dump(exclude_unset=True)}
+    # @catch_mongodb_error_and_rollback
+    async def update(self, coupon_update: CouponUpdate) -> Coupon:
+        coupon_data = await self.collection.find_one_and_update(
+            {"name": coupon_update.name},
+            {"$set": to_document(coupon_update.model_dump(exclude_unset=True))},
+            projection={"_id": False},
+            return_document=ReturnDocument.AFTER,
         )
 
+        if not coupon_data:
+            raise CouponStorageNotFoundError()
+
+        return from_document(coupon_data, self.strict)
+
     # @catch_mongodb_error_and_rollback
     async def delete(self, name: str) -> None:
-        await self.get(name)
-
-        result = await self.collection.delete_one({"name": name})
+        coupon_data = await self.collection.find_one_and_delete(
+            {"name": name}, projection={"_id": False}
+        )
 
-        if result.deleted_count != 1:
-            raise CouponStorageDeleteError()
+        if not coupon_data:
+            raise CouponStorageNotFoundError()
 
     def close(self) -> None:
         self.client.close()
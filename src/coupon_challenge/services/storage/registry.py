@@ -0,0 +1,105 @@
+from coupon_challenge.exceptions import CouponChallengeSettingsError
+from coupon_challenge.services.storage import CouponStorage
+from coupon_challenge.services.storage.cache import CachedCouponStorage
+from coupon_challenge.services.storage.instrumented import InstrumentedCouponStorage
+from coupon_challenge.settings import (
+    AppChallengeSettings,
+    DBBackendEnum,
+    get_cache_settings,
+    get_mongodb_settings,
+    get_sqlite_settings,
+)
+
+
+def create_backend_storage(settings: AppChallengeSettings) -> CouponStorage:
+    """Build a new storage client for the configured backend.
+
+    Backend modules are only imported when selected, motor and pymongo alone take
+    longer to import than the rest of the CLI.
+    """
+    if settings.db_backend == DBBackendEnum.mongo:
+        from coupon_challenge.services.storage.mongodb import MongoDBCouponStorage
+
+        mongodb_settings = get_mongodb_settings()
+        return MongoDBCouponStorage(
+            mongodb_settings.db_uri,
+            expired_coupons_ttl=mongodb_settings.expired_coupons_ttl,
+            check_query_plans=mongodb_settings.check_query_plans,
+            strict=settings.strict_reads,
+        )
+    elif settings.db_backend == DBBackendEnum.sqlite:
+        from coupon_challenge.services.storage.sqlite import SQLiteCouponStorage
+
+        sqlite_settings = get_sqlite_settings()
+        return SQLiteCouponStorage(
+            sqlite_settings.db_path,
+            pool_size=sqlite_settings.pool_size,
+            strict=settings.strict_reads,
+        )
+    elif settings.db_backend == DBBackendEnum.memory:
+        from coupon_challenge.services.storage.memory import InMemoryCouponStorage
+
+        return InMemoryCouponStorage()
+
+    raise CouponChallengeSettingsError()
+
+
+def create_coupon_storage(settings: AppChallengeSettings) -> CouponStorage:
+    """Build the storage for the configured backend, cached if enabled."""
+    # Timed under the cache so only the calls reaching the backend are measured
+    coupon_storage: CouponStorage = InstrumentedCouponStorage(
+        create_backend_storage(settings), backend=settings.db_backend.value
+    )
+
+    if settings.cache_enabled:
+        cache_settings = get_cache_settings()
+        coupon_storage = CachedCouponStorage(
+            coupon_storage,
+            ttl=cache_settings.ttl,
+            negative_ttl=cache_settings.negative_ttl,
+            max_size=cache_settings.max_size,
+        )
+
+    return coupon_storage
+
+
+class CouponStorageRegistry:
+    """Keep a single warmed-up storage client per backend for the lifetime of a worker.
+
+    Clients (and so their connection pools) are created once at startup and shared
+    by every request, instead of being rebuilt and closed on each one.
+    """
+
+    def __init__(self) -> None:
+        self._storages: dict[DBBackendEnum, CouponStorage] = {}
+
+    async def open(self, settings: AppChallengeSettings) -> CouponStorage:
+        if settings.db_backend in self._storages:
+            return self._storages[settings.db_backend]
+
+        coupon_storage = create_coupon_storage(settings)
+        try:
+            await coupon_storage.initialize()
+        except Exception:
+            coupon_storage.close()
+            raise
+
+        self._storages[settings.db_backend] = coupon_storage
+
+        return coupon_storage
+
+    def opened(self) -> dict[DBBackendEnum, CouponStorage]:
+        return dict(self._storages)
+
+    def get(self, backend: DBBackendEnum) -> CouponStorage:
+        if backend not in self._storages:
+            # The application has not been started with this backend
+            raise CouponChallengeSettingsError()
+
+        return self._storages[backend]
+
+    def close(self) -> None:
+        for coupon_storage in self._storages.values():
+            coupon_storage.close()
+
+        self._storages.clear()
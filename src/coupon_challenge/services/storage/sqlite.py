@@ -1,47 +1,261 @@
+import asyncio
 import json
 import sqlite3
-from typing import ClassVar
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, ClassVar, TypeVar
 
-from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+    CouponValidity,
+)
+from coupon_challenge.models.product import Product
+from coupon_challenge.services.index import EPOCH, to_epoch
 from coupon_challenge.services.storage import (
+    CouponBulkWriteResult,
     CouponStorage,
     CouponStorageAlreadyExistsError,
+    CouponStorageError,
     CouponStorageNotFoundError,
 )
 
+T = TypeVar("T")
 
-def catch_sqlite_error_and_rollback():
-    """This function should be a decorator and applied to every methods that connect and perform operation on database.
-    If error occurs, it will rollback to the previous state
-    """
-    raise NotImplementedError()
+SCHEMA_VERSION = 2
+COLUMNS = (
+    "name",
+    "discount",
+    "is_percent",
+    "category",
+    "price_above",
+    "valid_from",
+    "valid_to",
+    "validity_offset",
+)
+# Index name suffix -> indexed columns
+INDEXES = {
+    "category_price": ("category", "price_above"),
+    "validity": ("valid_from", "valid_to"),
+}
+
+# Applied to every connection. WAL lets readers run while the writer commits,
+# NORMAL synchronous is durable in WAL mode except on power loss
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+)
+
+
+def from_epoch(value: int, offset: int | None) -> datetime:
+    """Inverse of to_epoch, back to a naive local datetime when `offset` is None."""
+    moment = EPOCH + timedelta(microseconds=value)
+    if offset is None:
+        return moment.astimezone().replace(tzinfo=None)
+
+    return moment.astimezone(timezone(timedelta(seconds=offset)))
+
+
+def prefix_upper_bound(prefix: str) -> str | None:
+    """Smallest string above every string starting with `prefix`, None when there
+    is none (a prefix made of U+10FFFF only)."""
+    # The last character cannot be incremented, the one before it decides
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+
+    following = ord(stripped[-1]) + 1
+    # Surrogates cannot be encoded in UTF-8, they are skipped like by the ordering
+    # of the UTF-8 bytes SQLite compares
+    if 0xD800 <= following <= 0xDFFF:
+        following = 0xE000
+
+    return stripped[:-1] + chr(following)
+
+
+def to_where_clauses(coupon_filter: CouponFilter) -> tuple[list[str], list[Any]]:
+    """SQL conditions (and their parameters) selecting the coupons of a filter."""
+    clauses: list[str] = []
+    parameters: list[Any] = []
+    if coupon_filter.category:
+        clauses.append("category = ?")
+        parameters.append(coupon_filter.category)
+    if coupon_filter.max_price_above is not None:
+        clauses.append("(price_above IS NULL OR price_above <= ?)")
+        parameters.append(coupon_filter.max_price_above)
+    if coupon_filter.is_percent is not None:
+        clauses.append("is_percent = ?")
+        parameters.append(coupon_filter.is_percent)
+    if coupon_filter.valid_at:
+        clauses.append("(valid_from IS NULL OR (valid_from <= ? AND ? <= valid_to))")
+        parameters.extend([to_epoch(coupon_filter.valid_at)] * 2)
+    if coupon_filter.name_prefix:
+        # A range on the primary key rather than LIKE, which ignores case and
+        # cannot use the index
+        prefix = coupon_filter.name_prefix
+        clauses.append("name >= ?")
+        parameters.append(prefix)
+        upper_bound = prefix_upper_bound(prefix)
+        if upper_bound is not None:
+            clauses.append("name < ?")
+            parameters.append(upper_bound)
+
+    return clauses, parameters
 
 
 # Note: I could use SQLModel (or SQLAlchemy) instead of managing sqlite engine directly
-# Disclaimer: This implementation has not been updated after the improvement made in CouponStorage
-#             for error handling (CouponStorageError). It should still works but it is not tested.
 class SQLiteCouponStorage(CouponStorage):
+    """SQLite backend keeping the blocking sqlite3 calls off the event loop.
+
+    Writes are serialized on a single writer thread, which is how SQLite handles
+    them anyway, while reads run on a pool of `pool_size` threads, each with its
+    own connection.
+    """
+
     table_name: ClassVar[str] = "coupons"
 
-    def __init__(self, db_path: str = "coupon.db"):
+    def __init__(
+        self, db_path: str = "coupon.db", pool_size: int = 4, strict: bool = False
+    ):
         # Warn Log something about this backend being deprecated
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+        self.db_path = db_path
+        # Validate rows as untrusted input rather than building coupons directly
+        self.strict = strict
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(
+            pool_size, thread_name_prefix="sqlite-reader"
+        )
+        self._reader_local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        # Only ever used from the writer thread once created
+        self.conn = self._connect()
         self._initialize_table()
 
-    def _initialize_table(self):
-        query = f"""
-        CREATE TABLE IF NOT EXISTS {self.table_name} (
-            name TEXT UNIQUE PRIMARY KEY,
-            discount TEXT NOT NULL,
-            validity TEXT,
-            condition TEXT
-        )
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+
+        with self._connections_lock:
+            self._connections.append(conn)
+
+        return conn
+
+    def _reader_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._reader_local, "conn", None)
+        if conn is None:
+            conn = self._reader_local.conn = self._connect()
+
+        return conn
+
+    async def _read(self, operation: Callable[[sqlite3.Connection], T]) -> T:
+        def run() -> T:
+            return operation(self._reader_connection())
+
+        return await self._run(self._readers, run)
+
+    async def _write(self, operation: Callable[[sqlite3.Connection], T]) -> T:
+        def run() -> T:
+            # A single transaction, rolled back if the operation fails
+            with self.conn:
+                return operation(self.conn)
+
+        return await self._run(self._writer, run)
+
+    async def _run(self, executor: ThreadPoolExecutor, run: Callable[[], T]) -> T:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, run)
+        except sqlite3.Error as error:
+            raise CouponStorageError() from error
+
+    def _create_table_query(self) -> str:
+        # Validity bounds are epoch microseconds as computed by to_epoch, naive
+        # datetimes being local time. validity_offset is the UTC offset in
+        # seconds of aware bounds, NULL for naive ones.
+        return f"""
+        CREATE TABLE {self.table_name} (
+            name TEXT PRIMARY KEY,
+            discount INTEGER NOT NULL,
+            is_percent INTEGER NOT NULL DEFAULT 0,
+            category TEXT,
+            price_above INTEGER,
+            valid_from INTEGER,
+            valid_to INTEGER,
+            validity_offset INTEGER
+        ) WITHOUT ROWID
         """
-        self.conn.execute(query)
-        self.conn.commit()
 
-    def _from_rowdict_to_coupon(self, row: dict) -> Coupon:
+    def _index_statements(self) -> list[str]:
+        return [
+            f"CREATE INDEX IF NOT EXISTS {self.table_name}_{suffix} "
+            f"ON {self.table_name} ({', '.join(columns)})"
+            for suffix, columns in INDEXES.items()
+        ]
+
+    async def missing_indexes(self) -> list[str]:
+        expected = [f"{self.table_name}_{suffix}" for suffix in INDEXES]
+
+        def select_indexes(conn: sqlite3.Connection) -> set[str]:
+            cursor = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?",
+                (self.table_name,),
+            )
+            return {row["name"] for row in cursor}
+
+        existing = await self._read(select_indexes)
+
+        return [name for name in expected if name not in existing]
+
+    def _initialize_table(self):
+        # BEGIN IMMEDIATE so workers starting together do not all migrate
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                columns = {
+                    row["name"]
+                    for row in self.conn.execute(
+                        f"PRAGMA table_info({self.table_name})"
+                    )
+                }
+                if "condition" in columns:
+                    self._migrate_from_blob_layout()
+                else:
+                    self.conn.execute(self._create_table_query())
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            # Always ensured, so a dropped index is created again on startup
+            for statement in self._index_statements():
+                self.conn.execute(statement)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _migrate_from_blob_layout(self):
+        """Move coupons stored with JSON condition and validity to typed columns."""
+        legacy_table = f"{self.table_name}_blob"
+        self.conn.execute(f"ALTER TABLE {self.table_name} RENAME TO {legacy_table}")
+        self.conn.execute(self._create_table_query())
+
+        cursor = self.conn.execute(f"SELECT * FROM {legacy_table}")
+        while rows := cursor.fetchmany(1000):
+            self.conn.executemany(
+                self._insert_query(),
+                [self._to_row(self._from_blob_row(dict(row))) for row in rows],
+            )
+        self.conn.execute(f"DROP TABLE {legacy_table}")
+
+    def _from_blob_row(self, row: dict) -> Coupon:
         coupon_raw = {
             "name": row["name"],
             "discount": row["discount"],
@@ -53,94 +267,255 @@ class SQLiteCouponStorage(CouponStorage):
 
         return Coupon.model_validate(coupon_raw)
 
-    # @catch_sqlite_error_and_rollback
-    async def get_all(self) -> list[Coupon]:
+    def _from_rowdict_to_coupon(self, row: sqlite3.Row | dict) -> Coupon:
+        condition = None
+        if row["category"] is not None or row["price_above"] is not None:
+            condition = {"category": row["category"], "price_above": row["price_above"]}
+        validity = None
+        if row["valid_from"] is not None:
+            offset = row["validity_offset"]
+            validity = CouponValidity(
+                from_epoch(row["valid_from"], offset),
+                from_epoch(row["valid_to"], offset),
+            )
+
+        if self.strict:
+            return Coupon.model_validate(
+                {
+                    "name": row["name"],
+                    "discount": row["discount"],
+                    "is_percent": bool(row["is_percent"]),
+                    "condition": condition,
+                    "validity": validity,
+                }
+            )
+
+        # Typed columns only ever hold what was written from a valid Coupon
+        return Coupon.from_trusted(
+            row["name"], row["discount"], bool(row["is_percent"]), condition, validity
+        )
+
+    def _insert_query(self) -> str:
+        return f"""
+        INSERT INTO {self.table_name} ({", ".join(COLUMNS)})
+        VALUES ({", ".join("?" * len(COLUMNS))})
+        """
+
+    def _to_row(self, coupon: Coupon) -> tuple:
+        condition = coupon.condition
+        validity = coupon.validity
+        offset = None
+        if validity and (utc_offset := validity.start.utcoffset()) is not None:
+            offset = utc_offset // timedelta(seconds=1)
+
+        return (
+            coupon.name,
+            coupon.discount,
+            coupon.is_percent,
+            condition.category if condition else None,
+            condition.price_above if condition else None,
+            to_epoch(validity.start) if validity else None,
+            to_epoch(validity.end) if validity else None,
+            offset,
+        )
+
+    def _select_page(
+        self,
+        conn: sqlite3.Connection,
+        limit: int | None,
+        after: str | None,
+        coupon_filter: CouponFilter | None = None,
+    ) -> list[Coupon]:
+        """Fetch a page of coupons, walking the primary key on name."""
+        clauses, parameters = to_where_clauses(coupon_filter or CouponFilter())
+        if after is not None:
+            clauses.append("name > ?")
+            parameters.append(after)
+
         query = f"SELECT * FROM {self.table_name}"
-        cursor = self.conn.execute(query)
-        return [self._from_rowdict_to_coupon(dict(row)) for row in cursor]
+        if clauses:
+            query += f" WHERE {' AND '.join(clauses)}"
+        if limit is not None or after is not None:
+            query += " ORDER BY name"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
 
-    # @catch_sqlite_error_and_rollback
-    async def get(self, name: str) -> Coupon:
-        cursor = self.conn.execute(
-            f"SELECT * FROM {self.table_name} WHERE name = '{name}';"
+        cursor = conn.execute(query, parameters)
+        return [self._from_rowdict_to_coupon(row) for row in cursor]
+
+    def _select_one(self, conn: sqlite3.Connection, name: str) -> Coupon:
+        cursor = conn.execute(
+            f"SELECT * FROM {self.table_name} WHERE name = ?", (name,)
         )
-        self.conn.commit()
-        response = cursor.fetchone()
+        row = cursor.fetchone()
 
-        if not response:
+        if not row:
             raise CouponStorageNotFoundError()
 
-        return self._from_rowdict_to_coupon(response)
+        return self._from_rowdict_to_coupon(row)
 
-    # @catch_sqlite_error_and_rollback
-    async def create(self, coupon_create: CouponCreate) -> Coupon:
-        existing_coupon = await self.get(coupon_create.name)
-        if existing_coupon:
-            raise CouponStorageAlreadyExistsError()
+    async def get_all(
+        self, limit: int | None = None, after: str | None = None
+    ) -> list[Coupon]:
+        return await self._read(lambda conn: self._select_page(conn, limit, after))
+
+    async def get(self, name: str) -> Coupon:
+        return await self._read(lambda conn: self._select_one(conn, name))
+
+    async def find(
+        self,
+        coupon_filter: CouponFilter,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> list[Coupon]:
+        return await self._read(
+            lambda conn: self._select_page(conn, limit, after, coupon_filter)
+        )
 
+    async def applicable_coupons(
+        self, product: Product, at: datetime, limit: int | None = None
+    ) -> list[Coupon]:
+        # percent_price is the float expression of the service,
+        # floor((1 - discount / 100) * price), CAST truncating toward zero. Prices
+        # are floored at 0, savings never exceed the price
         query = f"""
-        INSERT INTO {self.table_name} (name, discount, validity, condition)
-        VALUES (?, ?, ?, ?)
-        """
-        self.conn.execute(
-            query,
-            (
-                coupon_create.name,
-                coupon_create.discount,
-                coupon_create.validity.to_json_string()
-                if coupon_create.validity
-                else "",
-                coupon_create.condition.model_dump_json()
-                if coupon_create.condition
-                else "",
-            ),
+        SELECT *,
+            CASE WHEN is_percent
+                THEN MIN(:price - (
+                    CAST(percent_price AS INTEGER)
+                    - (percent_price < CAST(percent_price AS INTEGER))
+                ), :price)
+                ELSE MIN(discount, :price)
+            END AS saving
+        FROM (
+            SELECT *, (1 - discount / 100.0) * :price AS percent_price
+            FROM {self.table_name}
+            WHERE (category IS NULL OR category = :category)
+                AND (price_above IS NULL OR price_above = 0 OR price_above < :price)
+                AND (valid_from IS NULL OR (valid_from <= :at AND :at <= valid_to))
         )
-        self.conn.commit()
+        ORDER BY saving DESC, name
+        LIMIT :limit
+        """
+        parameters = {
+            "price": product.price,
+            "category": product.category,
+            "at": to_epoch(at),
+            # A negative LIMIT is no limit
+            "limit": -1 if limit is None else limit,
+        }
+
+        def select(conn: sqlite3.Connection) -> list[Coupon]:
+            cursor = conn.execute(query, parameters)
+            return [self._from_rowdict_to_coupon(row) for row in cursor]
+
+        return await self._read(select)
+
+    async def create(self, coupon_create: CouponCreate) -> Coupon:
+        coupon = Coupon.model_validate(coupon_create.model_dump())
+
+        def insert(conn: sqlite3.Connection) -> None:
+            try:
+                conn.execute(self._insert_query(), self._to_row(coupon))
+            except sqlite3.IntegrityError:
+                raise CouponStorageAlreadyExistsError()
+
+        await self._write(insert)
+
+        return coupon
+
+    async def create_many(
+        self, coupon_creates: list[CouponCreate]
+    ) -> CouponBulkWriteResult:
+        def insert_many(conn: sqlite3.Connection) -> CouponBulkWriteResult:
+            result = CouponBulkWriteResult()
+
+            # A single query to find every name of the batch already taken
+            names = [coupon_create.name for coupon_create in coupon_creates]
+            cursor = conn.execute(
+                f"SELECT name FROM {self.table_name} "
+                f"WHERE name IN ({', '.join('?' * len(names))})",
+                names,
+            )
+            taken = {row["name"] for row in cursor}
 
-        return Coupon.model_validate(coupon_create.model_dump())
+            rows = []
+            for position, coupon_create in enumerate(coupon_creates):
+                if coupon_create.name in taken:
+                    result.errors[position] = "Coupon with this name already exists"
+                    continue
+                taken.add(coupon_create.name)
+                rows.append(
+                    self._to_row(Coupon.model_validate(coupon_create.model_dump()))
+                )
+
+            conn.executemany(self._insert_query(), rows)
+            result.inserted = len(rows)
+
+            return result
+
+        # The whole batch is written in a single transaction
+        return await self._write(insert_many)
+
+    async def iter_all(
+        self,
+        batch_size: int = 1000,
+        limit: int | None = None,
+        after: str | None = None,
+    ) -> AsyncIterator[Coupon]:
+        # One keyset page per batch, so no cursor is shared between reader threads
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = batch_size if remaining is None else min(batch_size, remaining)
+            coupons = await self._read(
+                lambda conn: self._select_page(conn, page_size, after)
+            )
+            for coupon in coupons:
+                yield coupon
+
+            if len(coupons) < page_size:
+                return
+            after = coupons[-1].name
+            if remaining is not None:
+                remaining -= len(coupons)
 
-    # @catch_sqlite_error_and_rollback
     async def update(self, coupon_update: CouponUpdate) -> Coupon:
-        existing_coupon = await self.get(coupon_update.name)
-        if not existing_coupon:
-            # TODO: This exception should be specific to this app in order to properly handle error on API side and CLI side
-            raise IndexError
+        def update(conn: sqlite3.Connection) -> Coupon:
+            coupon = self._select_one(conn, coupon_update.name)
+            coupon_data = coupon.model_dump(exclude={"discount", "is_percent"})
+            coupon_data["discount"] = coupon.discount_raw
+            updated = Coupon.model_validate(
+                {**coupon_data, **coupon_update.model_dump(exclude_unset=True)}
+            )
 
-        query = f"""
-        UPDATE {self.table_name}
-        SET
-            discount = ?,
-            validity = ?,
-            condition = ?
-        WHERE name = ?;
-        """
-        self.conn.execute(
-            query,
-            (
-                coupon_update.discount,
-                coupon_update.validity.to_json_string()
-                if coupon_update.validity
-                else "",
-                coupon_update.condition.model_dump_json()
-                if coupon_update.condition
-                else "",
-                coupon_update.name,
-            ),
-        )
-        self.conn.commit()
+            conn.execute(
+                f"""
+                UPDATE {self.table_name}
+                SET {", ".join(f"{column} = ?" for column in COLUMNS[1:])}
+                WHERE name = ?;
+                """,
+                (*self._to_row(updated)[1:], updated.name),
+            )
 
-        return existing_coupon.model_copy(update=coupon_update.model_dump())
+            return updated
 
-    # @catch_sqlite_error_and_rollback
-    async def delete(self, name: str) -> None:
-        existing_coupon = await self.get(name)
+        return await self._write(update)
 
-        if not existing_coupon:
-            # TODO: This exception should be specific to this app in order to properly handle error on API side and CLI side
-            raise IndexError
+    async def delete(self, name: str) -> None:
+        def delete(conn: sqlite3.Connection) -> None:
+            cursor = conn.execute(
+                f"DELETE FROM {self.table_name} WHERE name = ?", (name,)
+            )
+            if cursor.rowcount == 0:
+                raise CouponStorageNotFoundError()
 
-        self.conn.execute(f"DELETE FROM {self.table_name} WHERE name = '{name}';")
-        self.conn.commit()
+        await self._write(delete)
 
     def close(self) -> None:
-        self.conn.close()
+        self._readers.shutdown()
+        self._writer.shutdown()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
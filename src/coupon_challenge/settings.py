@@ -1,13 +1,22 @@
 from enum import StrEnum
 from functools import lru_cache
 
-from pydantic import MongoDsn
+from pydantic import (
+    MongoDsn,
+    NonNegativeFloat,
+    NonNegativeInt,
+    PositiveFloat,
+    PositiveInt,
+    SecretStr,
+)
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class DBBackendEnum(StrEnum):
     mongo = "mongo"
     sqlite = "sqlite"
+    # Coupons kept in the worker process, for tests and benchmarks
+    memory = "memory"
 
 
 APP_CHALLENGE_SETTINGS_PREFIX = "coupon_challenge_"
@@ -17,6 +26,20 @@ class AppChallengeSettings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix=APP_CHALLENGE_SETTINGS_PREFIX)
 
     db_backend: DBBackendEnum = DBBackendEnum.mongo
+    # Serve coupon reads from an in-process cache, see CacheSettings
+    cache_enabled: bool = False
+    # Seconds before the best coupon search index reloads coupons from storage,
+    # to catch up with writes made by other workers
+    search_refresh_interval: PositiveFloat = 60.0
+    # Fully validate the coupons read from storage instead of trusting what was
+    # validated when written, when stored data is suspected to be corrupted
+    strict_reads: bool = False
+    # Allow requests to be profiled, see ProfilingSettings
+    profiling_enabled: bool = False
+    # Keep the serialized bodies of coupon reads, see ResponseCacheSettings, so a
+    # 304 needs no storage round-trip. ETags and If-None-Match are honoured either
+    # way, from a body read again when disabled
+    response_cache_enabled: bool = True
 
 
 MONGO_SETTINGS_PREFIX = f"{APP_CHALLENGE_SETTINGS_PREFIX}mongo_"
@@ -26,6 +49,64 @@ class MongoDBSettings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix=MONGO_SETTINGS_PREFIX)
 
     db_uri: MongoDsn
+    # Seconds after the end of their validity before expired coupons are deleted
+    # by a TTL index, kept forever when unset
+    expired_coupons_ttl: NonNegativeInt | None = None
+    # Explain each new query shape once and warn when it scans the whole collection
+    check_query_plans: bool = True
+
+
+SQLITE_SETTINGS_PREFIX = f"{APP_CHALLENGE_SETTINGS_PREFIX}sqlite_"
+
+
+class SQLiteSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix=SQLITE_SETTINGS_PREFIX)
+
+    db_path: str = "coupon.db"
+    # Threads (and connections) serving reads, writes always go through a single one
+    pool_size: PositiveInt = 4
+
+
+CACHE_SETTINGS_PREFIX = f"{APP_CHALLENGE_SETTINGS_PREFIX}cache_"
+
+
+class CacheSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix=CACHE_SETTINGS_PREFIX)
+
+    # Seconds before a cached coupon is fetched again from the backend
+    ttl: PositiveFloat = 60.0
+    # Seconds a missing coupon is remembered, kept short so creations show up quickly
+    negative_ttl: NonNegativeFloat = 5.0
+    max_size: PositiveInt = 1024
+
+
+RESPONSE_CACHE_SETTINGS_PREFIX = f"{APP_CHALLENGE_SETTINGS_PREFIX}response_cache_"
+
+
+class ResponseCacheSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix=RESPONSE_CACHE_SETTINGS_PREFIX)
+
+    # Seconds a body is served before being read again, bounding how long writes
+    # made by other workers go unnoticed
+    ttl: PositiveFloat = 5.0
+    max_size: PositiveInt = 256
+    # Bodies of at least this many bytes are also kept gzipped, none when unset
+    gzip_min_size: NonNegativeInt | None = None
+
+
+PROFILING_SETTINGS_PREFIX = f"{APP_CHALLENGE_SETTINGS_PREFIX}profiling_"
+
+
+class ProfilingSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix=PROFILING_SETTINGS_PREFIX)
+
+    # Where .prof files are written, one per profiled request or command
+    directory: str = "profiles"
+    # Key of the signatures a request must carry in its X-Profile header or its
+    # profile query parameter to be profiled, no request can ask for it when unset
+    secret: SecretStr | None = None
+    # Profile one request out of sample_every, none when 0
+    sample_every: NonNegativeInt = 0
 
 
 # Using lru_cache ensure that settings does not change after starting the application
@@ -39,3 +120,23 @@ def get_app_settings() -> AppChallengeSettings:
 def get_mongodb_settings() -> MongoDBSettings:
     # Ignore typing as we intend to pass every settings from environment variables
     return MongoDBSettings()  # type: ignore
+
+
+@lru_cache
+def get_sqlite_settings() -> SQLiteSettings:
+    return SQLiteSettings()
+
+
+@lru_cache
+def get_cache_settings() -> CacheSettings:
+    return CacheSettings()
+
+
+@lru_cache
+def get_response_cache_settings() -> ResponseCacheSettings:
+    return ResponseCacheSettings()
+
+
+@lru_cache
+def get_profiling_settings() -> ProfilingSettings:
+    return ProfilingSettings()
@@ -0,0 +1,69 @@
+import pytest
+
+from coupon_challenge.benchmarks.load import (
+    SCENARIOS,
+    BenchmarkTarget,
+    Scenario,
+    benchmark,
+    build_report,
+    compare_reports,
+    percentile,
+)
+from coupon_challenge.main import app
+from coupon_challenge.settings import DBBackendEnum
+
+
+@pytest.fixture(autouse=True)
+def reset_middleware_stack():
+    yield
+    # Serving requests builds the middleware stack of the shared application,
+    # later tests registering exception handlers need it to be built again
+    app.middleware_stack = None
+
+
+@pytest.mark.parametrize(
+    "rank, expected",
+    [
+        pytest.param(50, 5, id="Median"),
+        pytest.param(95, 10, id="p95"),
+        pytest.param(1, 1, id="Lowest rank"),
+    ],
+)
+def test_percentile(rank, expected) -> None:
+    assert percentile([float(value) for value in range(1, 11)], rank) == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scenario", SCENARIOS.values(), ids=SCENARIOS.keys())
+async def test_benchmark__in_process(scenario) -> None:
+    # Few seeded coupons so the test stays fast
+    small_scenario = Scenario(scenario.name, 20, scenario.requests)
+
+    result = await benchmark(
+        small_scenario,
+        DBBackendEnum.memory,
+        BenchmarkTarget.in_process,
+        requests=50,
+        concurrency=4,
+    )
+
+    assert result.errors == 0
+    assert sum(route.count for route in result.routes.values()) == 50
+    assert result.throughput_rps > 0
+
+
+@pytest.mark.asyncio
+async def test_compare_reports() -> None:
+    result = await benchmark(
+        Scenario("read_heavy", 10, SCENARIOS["read_heavy"].requests),
+        DBBackendEnum.memory,
+        BenchmarkTarget.in_process,
+        requests=20,
+        concurrency=2,
+    )
+    report = build_report([result])
+
+    rows = compare_reports(report, report)
+
+    assert {row["route"] for row in rows} == set(result.routes)
+    assert all(row["p95_ms"] == row["baseline_p95_ms"] for row in rows)
@@ -0,0 +1,68 @@
+from unittest.mock import patch
+
+import pytest
+
+from coupon_challenge.benchmarks.micro import (
+    KERNELS,
+    KernelResult,
+    ParityError,
+    Pools,
+    check_legacy_parity,
+    find_regressions,
+    run_kernels,
+)
+
+
+@pytest.mark.parametrize("operations", [1, 10, 100, 101])
+def test_pools_give_enough_distinct_pairs(operations) -> None:
+    pools = Pools.generate(operations)
+
+    pairs = list(pools.coupon_product_pairs(operations))
+
+    assert len(pairs) == operations
+    assert len({(id(coupon), id(product)) for coupon, product in pairs}) == operations
+
+
+def test_check_legacy_parity() -> None:
+    pools = Pools.generate(10_000, seed=3)
+
+    assert check_legacy_parity(pools, 10_000) == 10_000
+
+
+def test_check_legacy_parity__broken() -> None:
+    pools = Pools.generate(100)
+
+    with patch(
+        "coupon_challenge.services.coupons.CouponApplicabilityService._apply_fixed_discount",
+        return_value=-1,
+    ):
+        with pytest.raises(ParityError):
+            check_legacy_parity(pools, 100)
+
+
+def test_run_kernels() -> None:
+    results = run_kernels(KERNELS.values(), operations=200, repeat=1)
+
+    assert [result.name for result in results] == list(KERNELS)
+    assert all(result.ns_per_op > 0 for result in results)
+
+
+@pytest.mark.parametrize(
+    "ns_per_op, regressed",
+    [
+        pytest.param(110.0, False, id="Within threshold"),
+        pytest.param(130.0, True, id="Slower than threshold"),
+        pytest.param(50.0, False, id="Faster"),
+    ],
+)
+def test_find_regressions(ns_per_op, regressed) -> None:
+    results = [
+        KernelResult("kernel", 1000, ns_per_op, 0),
+        KernelResult("new_kernel", 1000, 1000.0, 0),
+    ]
+
+    regressions = find_regressions(results, {"kernel": 100.0}, threshold=0.25)
+
+    assert [regression.name for regression in regressions] == (
+        ["kernel"] if regressed else []
+    )
@@ -5,10 +5,15 @@ from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from fastapi.testclient import TestClient
 
-from coupon_challenge.dependencies import get_coupon_storage
+from coupon_challenge.dependencies import (
+    dep_coupon_search_engine,
+    get_coupon_response_cache,
+    get_coupon_storage,
+)
 from coupon_challenge.main import app
-from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
 from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.responses import CouponResponseCache
+from coupon_challenge.services.search import CouponSearchEngine
 from coupon_challenge.services.storage import (
     CouponStorage,
     CouponStorageAlreadyExistsError,
@@ -16,52 +21,13 @@ from coupon_challenge.services.storage import (
     CouponStorageNotFoundError,
     CouponStorageProductNotApplicableError,
 )
+from coupon_challenge.services.storage.memory import InMemoryCouponStorage
 
 T = TypeVar("T")
 
 YieldFixture = Generator[T, None, None]
 
 
-class InMemoryCouponStorage(CouponStorage):
-    def __init__(self, data: list[Coupon] = None):
-        super().__init__()
-        self.data: dict[str, Coupon] = {c.name: c for c in data} if data else {}
-
-    async def get_all(self) -> list[Coupon]:
-        return list(self.data.values())
-
-    async def get(self, name: str) -> Coupon:
-        if name not in self.data:
-            raise CouponStorageNotFoundError()
-
-        return self.data[name]
-
-    async def create(self, coupon_create: CouponCreate) -> Coupon:
-        if coupon_create.name in self.data:
-            raise CouponStorageAlreadyExistsError()
-
-        self.data[coupon_create.name] = Coupon.model_validate(coupon_create.model_dump())
-
-        return self.data[coupon_create.name]
-
-    async def update(self, coupon_update: CouponUpdate) -> Coupon:
-        if coupon_update.name not in self.data:
-            raise CouponStorageNotFoundError()
-
-        self.data[coupon_update.name] = Coupon.model_validate(coupon_update.model_dump())
-
-        return self.data[coupon_update.name]
-
-    async def delete(self, name: str) -> None:
-        if name not in self.data:
-            raise CouponStorageNotFoundError()
-
-        del self.data[name]
-
-    def close(self) -> None:
-        return
-
-
 def add_storage_exception_handlers(app: FastAPI):
     @app.exception_handler(CouponStorageAlreadyExistsError)
     async def handle_already_exists_error(request, exc):
@@ -98,8 +64,26 @@ def mock_storage(request) -> YieldFixture[CouponStorage]:
 
 
 @pytest.fixture
-def fake_api(mock_storage: CouponStorage) -> YieldFixture[TestClient]:
+def search_engine(mock_storage: InMemoryCouponStorage) -> CouponSearchEngine:
+    coupon_search_engine = CouponSearchEngine()
+    coupon_search_engine.rebuild(mock_storage.data.values())
+    return coupon_search_engine
+
+
+@pytest.fixture
+def response_cache() -> CouponResponseCache:
+    return CouponResponseCache(ttl=60.0, gzip_min_size=1024)
+
+
+@pytest.fixture
+def fake_api(
+    mock_storage: CouponStorage,
+    search_engine: CouponSearchEngine,
+    response_cache: CouponResponseCache,
+) -> YieldFixture[TestClient]:
     app.dependency_overrides[get_coupon_storage] = lambda: mock_storage
+    app.dependency_overrides[dep_coupon_search_engine] = lambda: search_engine
+    app.dependency_overrides[get_coupon_response_cache] = lambda: response_cache
     add_storage_exception_handlers(app)
     yield TestClient(app)
     app.dependency_overrides.clear()
@@ -1,9 +1,16 @@
+from datetime import datetime
+from unittest.mock import patch
+
 import pytest
 from fastapi.testclient import TestClient
 
+from coupon_challenge.dependencies import get_clock
+from coupon_challenge.main import app
 from coupon_challenge.models.coupon import Coupon
 from coupon_challenge.models.product import Product
 from coupon_challenge.routers.coupons import COUPONS_ROUTE_PREFIX
+from coupon_challenge.services.clock import FrozenClock
+from coupon_challenge.services.search import CouponSearchEngine
 from coupon_challenge.services.storage import CouponStorage
 
 
@@ -145,6 +152,21 @@ def test_update_coupon_should_return_422_with_invalid_input(
     assert response.status_code == 422
 
 
+@pytest.mark.parametrize(
+    "mock_storage",
+    [
+        pytest.param([Coupon(name="coupon_1", discount=1)]),
+    ],
+    indirect=True,
+)
+def test_update_coupon_should_return_422_with_null_discount(
+    fake_api: TestClient,
+) -> None:
+    data = {"name": "coupon_1", "discount": None}
+    response = fake_api.put(f"{COUPONS_ROUTE_PREFIX}/", json=data)
+    assert response.status_code == 422
+
+
 def test_update_coupon_should_return_404_with_missing_coupon(
     fake_api: TestClient,
 ) -> None:
@@ -282,3 +304,304 @@ def test_apply_product_should_return_422_with_invalid_product(
         f"{COUPONS_ROUTE_PREFIX}/coupon_1/apply_product", json=product
     )
     assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [[Coupon(name="coupon_1", discount=10, condition={"price_above": 80})]],
+    indirect=True,
+)
+def test_apply_products_should_price_every_line(fake_api: TestClient) -> None:
+    products = [
+        {"name": "cake", "price": 100, "category": "food"},
+        {"name": "bread", "price": 20, "category": "food"},
+    ]
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/coupon_1/apply_products", json=products
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [(line["applicable"], line["price"]) for line in data["lines"]] == [
+        (True, 90),
+        (False, 20),
+    ]
+    assert (data["total_price"], data["total_discounted_price"]) == (120, 110)
+    assert data["total_discount"] == 10
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [
+        [
+            Coupon(
+                name="coupon_1",
+                discount=10,
+                validity={"start": "2025-01-01", "end": "2025-12-31"},
+            )
+        ]
+    ],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    ("moment", "expected_price"),
+    [
+        pytest.param("2025-06-01", 90, id="Valid at the frozen instant"),
+        pytest.param("2026-06-01", 100, id="Expired at the frozen instant"),
+    ],
+)
+def test_apply_products_should_use_the_injected_clock(
+    fake_api: TestClient, moment: str, expected_price: int
+) -> None:
+    app.dependency_overrides[get_clock] = lambda: FrozenClock(
+        datetime.fromisoformat(moment)
+    )
+
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/coupon_1/apply_products",
+        json=[{"name": "cake", "price": 100, "category": "food"}],
+    )
+
+    assert response.status_code == 200
+    assert response.json()["lines"][0]["price"] == expected_price
+
+
+@pytest.mark.parametrize(
+    "mock_storage", [[Coupon(name="coupon_1", discount="150%")]], indirect=True
+)
+def test_apply_product_should_floor_price_at_zero(fake_api: TestClient) -> None:
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/coupon_1/apply_product",
+        json={"name": "cake", "price": 100, "category": "food"},
+    )
+    assert response.status_code == 200
+    assert response.json()["price"] == 0
+
+
+@pytest.mark.parametrize(
+    "mock_storage", [[Coupon(name="coupon_1", discount="150%")]], indirect=True
+)
+def test_apply_products_should_floor_prices_at_zero(fake_api: TestClient) -> None:
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/coupon_1/apply_products",
+        json=[
+            {"name": "cake", "price": 100, "category": "food"},
+            {"name": "bread", "price": 20, "category": "food"},
+        ],
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [line["price"] for line in data["lines"]] == [0, 0]
+    assert data["total_discount"] == 120
+
+
+def test_apply_products_should_return_404_with_missing_coupon(
+    fake_api: TestClient,
+) -> None:
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/coupon_1/apply_products",
+        json=[{"name": "cake", "price": 100, "category": "food"}],
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [
+        [
+            Coupon(name="coupon_1", discount=10),
+            Coupon(name="coupon_2", discount="50%"),
+            Coupon(name="coupon_3", discount=5, condition={"category": "furniture"}),
+        ]
+    ],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    ("products", "expected"),
+    [
+        pytest.param(
+            {"name": "cake", "price": 100, "category": "food"},
+            [("coupon_2", 50), ("coupon_1", 90)],
+            id="Best coupons for a product",
+        ),
+        pytest.param(
+            [
+                {"name": "cake", "price": 10, "category": "food"},
+                {"name": "chair", "price": 10, "category": "furniture"},
+            ],
+            [("coupon_1", 0), ("coupon_2", 10)],
+            id="Best coupons for a cart",
+        ),
+    ],
+)
+def test_best_coupons_should_rank_coupons_by_price(
+    fake_api: TestClient, products: dict | list, expected: list
+) -> None:
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/best", params={"limit": 2}, json=products
+    )
+    assert response.status_code == 200
+    assert [
+        (application["coupon"], application["total_discounted_price"])
+        for application in response.json()
+    ] == expected
+
+
+def test_best_coupons_should_see_created_coupons(fake_api: TestClient) -> None:
+    product = {"name": "cake", "price": 100, "category": "food"}
+    assert fake_api.post(f"{COUPONS_ROUTE_PREFIX}/best", json=product).json() == []
+
+    fake_api.post(f"{COUPONS_ROUTE_PREFIX}/", json={"name": "coupon_1", "discount": 1})
+
+    response = fake_api.post(f"{COUPONS_ROUTE_PREFIX}/best", json=product)
+    assert [application["coupon"] for application in response.json()] == ["coupon_1"]
+
+
+@pytest.mark.parametrize(
+    "mock_storage", [[Coupon(name="coupon_1", discount="150%")]], indirect=True
+)
+def test_best_coupons_should_floor_prices_at_zero(fake_api: TestClient) -> None:
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/best",
+        json={"name": "cake", "price": 100, "category": "food"},
+    )
+    assert response.status_code == 200
+    assert response.json()[0]["total_discounted_price"] == 0
+
+
+def test_write_should_not_reload_a_stale_search_engine(
+    fake_api: TestClient,
+    mock_storage: CouponStorage,
+    search_engine: CouponSearchEngine,
+) -> None:
+    search_engine.mark_stale()
+
+    with patch.object(mock_storage, "get_all", side_effect=AssertionError):
+        response = fake_api.post(
+            f"{COUPONS_ROUTE_PREFIX}/", json={"name": "coupon_1", "discount": 1}
+        )
+
+    assert response.status_code == 201
+    assert "coupon_1" in search_engine
+    assert search_engine.loaded_at is None
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [[Coupon(name=f"coupon_{i}", discount=i) for i in (3, 1, 4, 2, 5)]],
+    indirect=True,
+)
+def test_read_coupons_should_paginate_by_name(fake_api: TestClient) -> None:
+    names, after = [], None
+    for _ in range(3):
+        params = {"limit": 2} if after is None else {"limit": 2, "after": after}
+        response = fake_api.get(f"{COUPONS_ROUTE_PREFIX}/", params=params)
+        assert response.status_code == 200
+        names.append([coupon["name"] for coupon in response.json()])
+        after = response.headers.get("X-Next-Cursor")
+
+    assert names == [["coupon_1", "coupon_2"], ["coupon_3", "coupon_4"], ["coupon_5"]]
+    assert after is None
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [[Coupon(name="coupon_1", discount=1), Coupon(name="coupon_2", discount="5%")]],
+    indirect=True,
+)
+def test_read_coupons_should_stream_ndjson(fake_api: TestClient) -> None:
+    response = fake_api.get(
+        f"{COUPONS_ROUTE_PREFIX}/", headers={"Accept": "application/x-ndjson"}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [Coupon.model_validate_json(line) for line in response.iter_lines()] == [
+        Coupon(name="coupon_1", discount=1),
+        Coupon(name="coupon_2", discount="5%"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [
+        [
+            Coupon(name="summer_1", discount="10%", condition={"category": "food"}),
+            Coupon(name="summer_2", discount=10, condition={"category": "food"}),
+            Coupon(name="summer_3", discount="10%"),
+            Coupon(name="winter_1", discount="10%", condition={"category": "food"}),
+        ]
+    ],
+    indirect=True,
+)
+def test_read_coupons_should_filter(fake_api: TestClient) -> None:
+    response = fake_api.get(
+        f"{COUPONS_ROUTE_PREFIX}/",
+        params={"category": "food", "is_percent": True, "prefix": "summer"},
+    )
+
+    assert response.status_code == 200
+    assert [coupon["name"] for coupon in response.json()] == ["summer_1"]
+
+
+@pytest.mark.parametrize(
+    "route",
+    [
+        pytest.param(f"{COUPONS_ROUTE_PREFIX}/", id="Listing"),
+        pytest.param(f"{COUPONS_ROUTE_PREFIX}/coupon_1", id="Single coupon"),
+    ],
+)
+@pytest.mark.parametrize(
+    "mock_storage", [[Coupon(name="coupon_1", discount=10)]], indirect=True
+)
+def test_read_should_answer_304_without_storage(
+    fake_api: TestClient, mock_storage: CouponStorage, route: str
+) -> None:
+    response = fake_api.get(route)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    with patch.object(mock_storage, "get_all") as get_all:
+        with patch.object(mock_storage, "get") as get:
+            response = fake_api.get(route, headers={"If-None-Match": etag})
+            get_all.assert_not_called()
+            get.assert_not_called()
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+
+@pytest.mark.parametrize(
+    "mock_storage", [[Coupon(name="coupon_1", discount=10)]], indirect=True
+)
+def test_write_should_change_the_etag(fake_api: TestClient) -> None:
+    etag = fake_api.get(f"{COUPONS_ROUTE_PREFIX}/").headers["ETag"]
+
+    response = fake_api.post(
+        f"{COUPONS_ROUTE_PREFIX}/", json={"name": "coupon_2", "discount": 5}
+    )
+    assert response.status_code == 201
+
+    response = fake_api.get(f"{COUPONS_ROUTE_PREFIX}/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [coupon["name"] for coupon in response.json()] == ["coupon_1", "coupon_2"]
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [[Coupon(name=f"coupon_{i}", discount=10) for i in range(50)]],
+    indirect=True,
+)
+def test_read_coupons_should_serve_gzipped_bodies(fake_api: TestClient) -> None:
+    plain = fake_api.get(
+        f"{COUPONS_ROUTE_PREFIX}/", headers={"Accept-Encoding": "identity"}
+    )
+    compressed = fake_api.get(
+        f"{COUPONS_ROUTE_PREFIX}/", headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert "Content-Encoding" not in plain.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.json() == plain.json()
+    assert compressed.headers["ETag"] != plain.headers["ETag"]
@@ -0,0 +1,104 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from coupon_challenge.main import app
+from coupon_challenge.routers.coupons import COUPONS_ROUTE_PREFIX
+from coupon_challenge.routers.metrics import METRICS_ROUTE
+from coupon_challenge.settings import get_app_settings
+
+
+@pytest.fixture
+def memory_settings(monkeypatch):
+    monkeypatch.setenv("COUPON_CHALLENGE_DB_BACKEND", "memory")
+    monkeypatch.setenv("COUPON_CHALLENGE_CACHE_ENABLED", "true")
+    get_app_settings.cache_clear()
+    yield get_app_settings()
+    get_app_settings.cache_clear()
+
+
+def sample_value(metrics: str, sample: str) -> float:
+    for line in metrics.splitlines():
+        if line.startswith(f"{sample} "):
+            return float(line.rsplit(" ", 1)[1])
+
+    return 0.0
+
+
+@pytest.mark.usefixtures("memory_settings")
+def test_metrics() -> None:
+    with TestClient(app) as client:
+        before = client.get(METRICS_ROUTE).text
+
+        client.post(f"{COUPONS_ROUTE_PREFIX}/", json={"name": "c", "discount": 10})
+        client.get(f"{COUPONS_ROUTE_PREFIX}/c")
+        client.get(f"{COUPONS_ROUTE_PREFIX}/c")
+        client.get(f"{COUPONS_ROUTE_PREFIX}/none")
+        client.post(
+            f"{COUPONS_ROUTE_PREFIX}/c/apply_product",
+            json={"name": "p", "price": 100, "category": "food"},
+        )
+
+        response = client.get(METRICS_ROUTE)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    def delta(sample: str) -> float:
+        return sample_value(response.text, sample) - sample_value(before, sample)
+
+    assert (
+        delta(
+            'http_request_duration_seconds_count{method="GET",'
+            'route="/coupons/{name}",status="200"}'
+        )
+        == 2
+    )
+    assert delta('coupon_storage_errors_total{error="CouponStorageNotFoundError"}') == 1
+    assert (
+        delta(
+            'coupon_storage_operation_duration_seconds_count{backend="memory",'
+            'operation="create",outcome="ok"}'
+        )
+        == 1
+    )
+    assert delta('coupon_applicability_checks_total{outcome="applicable"}') == 1
+    assert sample_value(response.text, "http_requests_in_flight") == 1
+    # Created then read twice from the cache, the unknown coupon missed
+    assert sample_value(response.text, 'coupon_cache_hit_ratio{backend="memory"}') > 0
+
+
+def parse_families(metrics: str) -> dict[str, tuple[str, list[str]]]:
+    """(type, sample names) of each family, samples attached to the family
+    declared before them like a Prometheus text format parser does."""
+    families: dict[str, tuple[str, list[str]]] = {}
+    family = None
+    for line in metrics.splitlines():
+        if line.startswith("# TYPE "):
+            family, metric_type = line.removeprefix("# TYPE ").split(" ")
+            families[family] = (metric_type, [])
+        elif line and not line.startswith("#"):
+            assert family is not None
+            families[family][1].append(line.split("{")[0].split(" ")[0])
+
+    return families
+
+
+@pytest.mark.usefixtures("memory_settings")
+def test_metrics__samples_match_their_family() -> None:
+    with TestClient(app) as client:
+        client.get(f"{COUPONS_ROUTE_PREFIX}/none")
+        response = client.get(METRICS_ROUTE)
+
+    families = parse_families(response.text)
+
+    suffixes = {"histogram": ("_bucket", "_sum", "_count")}
+    for family, (metric_type, names) in families.items():
+        assert {name.removeprefix(family) for name in names} <= {
+            "",
+            *suffixes.get(metric_type, ()),
+        }, family
+    assert families["coupon_storage_errors_total"][0] == "counter"
+    assert families["coupon_cache_lookups_total"] == (
+        "counter",
+        ["coupon_cache_lookups_total"] * 2,
+    )
@@ -0,0 +1,76 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.routers.products import PRODUCTS_ROUTE_PREFIX
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [
+        [
+            Coupon(name="coupon_1", discount=5),
+            Coupon(name="coupon_2", discount="20%"),
+            Coupon(name="coupon_3", discount=30, condition={"category": "furniture"}),
+            Coupon(name="coupon_4", discount=20, condition={"price_above": 100}),
+            Coupon(name="coupon_5", discount=20, condition={"price_above": 99}),
+            Coupon(name="coupon_6", discount=50, validity=("2020-01-01", "2021-01-01")),
+        ]
+    ],
+    indirect=True,
+)
+def test_applicable_coupons_should_return_best_discount_first(
+    fake_api: TestClient,
+) -> None:
+    response = fake_api.post(
+        f"{PRODUCTS_ROUTE_PREFIX}/applicable-coupons",
+        json={"name": "cake", "price": 100, "category": "food"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"coupon": "coupon_2", "price": 80, "discount": 20},
+        {"coupon": "coupon_5", "price": 80, "discount": 20},
+        {"coupon": "coupon_1", "price": 95, "discount": 5},
+    ]
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [[Coupon(name=f"coupon_{i}", discount=i) for i in range(1, 6)]],
+    indirect=True,
+)
+def test_applicable_coupons_should_be_limited(fake_api: TestClient) -> None:
+    response = fake_api.post(
+        f"{PRODUCTS_ROUTE_PREFIX}/applicable-coupons",
+        params={"limit": 2},
+        json={"name": "cake", "price": 100, "category": "food"},
+    )
+
+    assert response.status_code == 200
+    assert [line["coupon"] for line in response.json()] == ["coupon_5", "coupon_4"]
+
+
+@pytest.mark.parametrize(
+    "mock_storage",
+    [
+        [
+            Coupon(name="coupon_1", discount="150%"),
+            Coupon(name="coupon_2", discount=200),
+            Coupon(name="coupon_3", discount="50%"),
+        ]
+    ],
+    indirect=True,
+)
+def test_applicable_coupons_should_floor_prices_at_zero(fake_api: TestClient) -> None:
+    response = fake_api.post(
+        f"{PRODUCTS_ROUTE_PREFIX}/applicable-coupons",
+        json={"name": "cake", "price": 100, "category": "food"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"coupon": "coupon_1", "price": 0, "discount": 100},
+        {"coupon": "coupon_2", "price": 0, "discount": 100},
+        {"coupon": "coupon_3", "price": 50, "discount": 50},
+    ]
@@ -0,0 +1,208 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
+from coupon_challenge.services.storage import (
+    CouponStorage,
+    CouponStorageNotFoundError,
+)
+from coupon_challenge.services.storage.cache import CachedCouponStorage
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def spied_storage(mock_storage: CouponStorage) -> CouponStorage:
+    mock_storage.get = AsyncMock(side_effect=mock_storage.get)
+    mock_storage.get_all = AsyncMock(side_effect=mock_storage.get_all)
+    return mock_storage
+
+
+@pytest.fixture
+def cached_storage(spied_storage: CouponStorage, clock: FakeClock):
+    return CachedCouponStorage(
+        spied_storage, ttl=10, negative_ttl=1, max_size=2, clock=clock
+    )
+
+
+COUPONS = [Coupon(name="coupon_1", discount=1), Coupon(name="coupon_2", discount=2)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_storage", [COUPONS], indirect=True)
+async def test_get_should_be_served_from_cache_until_ttl(
+    cached_storage, spied_storage, clock
+) -> None:
+    assert await cached_storage.get("coupon_1") == COUPONS[0]
+    assert await cached_storage.get("coupon_1") == COUPONS[0]
+    assert spied_storage.get.await_count == 1
+
+    clock.now = 11
+    await cached_storage.get("coupon_1")
+    assert spied_storage.get.await_count == 2
+
+    assert (cached_storage.stats.hits, cached_storage.stats.misses) == (1, 2)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_storage", [COUPONS], indirect=True)
+async def test_get_all_should_be_served_from_cache(
+    cached_storage, spied_storage
+) -> None:
+    assert await cached_storage.get_all() == COUPONS
+    assert await cached_storage.get_all() == COUPONS
+    assert spied_storage.get_all.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_should_cache_missing_coupon_briefly(
+    cached_storage, spied_storage, clock
+) -> None:
+    for _ in range(2):
+        with pytest.raises(CouponStorageNotFoundError):
+            await cached_storage.get("coupon_1")
+    assert spied_storage.get.await_count == 1
+
+    clock.now = 2
+    with pytest.raises(CouponStorageNotFoundError):
+        await cached_storage.get("coupon_1")
+    assert spied_storage.get.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_create_should_invalidate_missing_coupon(cached_storage) -> None:
+    with pytest.raises(CouponStorageNotFoundError):
+        await cached_storage.get("coupon_1")
+    await cached_storage.get_all()
+
+    coupon = await cached_storage.create(CouponCreate(name="coupon_1", discount=1))
+
+    assert await cached_storage.get("coupon_1") == coupon
+    assert await cached_storage.get_all() == [coupon]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_storage", [COUPONS], indirect=True)
+async def test_update_and_delete_should_invalidate_coupon(cached_storage) -> None:
+    await cached_storage.get("coupon_1")
+
+    await cached_storage.update(CouponUpdate(name="coupon_1", discount=50))
+    assert (await cached_storage.get("coupon_1")).discount == 50
+
+    await cached_storage.delete("coupon_1")
+    with pytest.raises(CouponStorageNotFoundError):
+        await cached_storage.get("coupon_1")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "mock_storage",
+    [[*COUPONS, Coupon(name="coupon_3", discount=3)]],
+    indirect=True,
+)
+async def test_cache_should_evict_least_recently_used(
+    cached_storage, spied_storage
+) -> None:
+    await cached_storage.get("coupon_1")
+    await cached_storage.get("coupon_2")
+    await cached_storage.get("coupon_1")
+    await cached_storage.get("coupon_3")
+
+    assert cached_storage.stats.evictions == 1
+
+    await cached_storage.get("coupon_1")
+    assert spied_storage.get.await_count == 3
+    await cached_storage.get("coupon_2")
+    assert spied_storage.get.await_count == 4
+
+
+def pause_after_read(storage: CouponStorage, method: str) -> asyncio.Event:
+    """Have `method` of the storage read, then wait for the returned event to be
+    set before answering, as a slow backend would."""
+    read = getattr(storage, method)
+    release = asyncio.Event()
+
+    async def read_then_wait(*args, **kwargs):
+        try:
+            return await read(*args, **kwargs)
+        finally:
+            await release.wait()
+
+    setattr(storage, method, read_then_wait)
+    return release
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_storage", [COUPONS], indirect=True)
+@pytest.mark.parametrize(
+    ("write", "expected_discount"),
+    [
+        pytest.param(
+            lambda storage: storage.update(CouponUpdate(name="coupon_1", discount=50)),
+            50,
+            id="Update",
+        ),
+        pytest.param(lambda storage: storage.delete("coupon_1"), None, id="Delete"),
+    ],
+)
+async def test_get_racing_with_a_write_should_not_cache_the_old_coupon(
+    cached_storage, spied_storage, write, expected_discount
+) -> None:
+    release = pause_after_read(spied_storage, "get")
+
+    task = asyncio.create_task(cached_storage.get("coupon_1"))
+    await asyncio.sleep(0)
+    await write(cached_storage)
+    release.set()
+    assert (await task).discount == 1
+
+    if expected_discount is None:
+        with pytest.raises(CouponStorageNotFoundError):
+            await cached_storage.get("coupon_1")
+    else:
+        assert (await cached_storage.get("coupon_1")).discount == expected_discount
+
+
+@pytest.mark.asyncio
+async def test_get_racing_with_create_should_not_cache_missing_coupon(
+    cached_storage, spied_storage
+) -> None:
+    release = pause_after_read(spied_storage, "get")
+
+    task = asyncio.create_task(cached_storage.get("coupon_1"))
+    await asyncio.sleep(0)
+    coupon = await cached_storage.create(CouponCreate(name="coupon_1", discount=1))
+    release.set()
+    with pytest.raises(CouponStorageNotFoundError):
+        await task
+
+    assert await cached_storage.get("coupon_1") == coupon
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mock_storage", [COUPONS], indirect=True)
+async def test_get_all_racing_with_a_write_should_not_cache_old_coupons(
+    cached_storage, spied_storage
+) -> None:
+    release = pause_after_read(spied_storage, "get_all")
+
+    task = asyncio.create_task(cached_storage.get_all())
+    await asyncio.sleep(0)
+    await cached_storage.delete("coupon_1")
+    release.set()
+    assert await task == COUPONS
+
+    assert await cached_storage.get_all() == COUPONS[1:]
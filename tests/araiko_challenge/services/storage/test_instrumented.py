@@ -0,0 +1,40 @@
+import pytest
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.services.metrics import STORAGE_OPERATION_DURATION
+from coupon_challenge.services.storage import (
+    CouponStorage,
+    CouponStorageNotFoundError,
+)
+from coupon_challenge.services.storage.instrumented import InstrumentedCouponStorage
+
+
+def observations(operation: str, outcome: str) -> int:
+    return sum(STORAGE_OPERATION_DURATION.labels("test", operation, outcome).counts)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "mock_storage",
+    [pytest.param([Coupon(name="coupon_1", discount=10)], id="One coupon")],
+    indirect=True,
+)
+async def test_calls_are_timed_by_operation_and_outcome(
+    mock_storage: CouponStorage,
+) -> None:
+    storage = InstrumentedCouponStorage(mock_storage, backend="test")
+    before = {
+        key: observations(*key)
+        for key in [("get", "ok"), ("get", "error"), ("iter_all", "ok")]
+    }
+
+    assert await storage.get("coupon_1") == Coupon(name="coupon_1", discount=10)
+    with pytest.raises(CouponStorageNotFoundError):
+        await storage.get("none")
+    assert [coupon.name async for coupon in storage.iter_all()] == ["coupon_1"]
+
+    assert {key: observations(*key) - count for key, count in before.items()} == {
+        ("get", "ok"): 1,
+        ("get", "error"): 1,
+        ("iter_all", "ok"): 1,
+    }
@@ -1,15 +1,32 @@
+import logging
+from datetime import datetime, timezone
 from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
 import pytest
-
-from coupon_challenge.models.coupon import Coupon, CouponCreate, CouponUpdate
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+)
+from coupon_challenge.models.product import Product
 from coupon_challenge.services.storage import (
     CouponStorageAlreadyExistsError,
     CouponStorageCreateError,
-    CouponStorageDeleteError,
     CouponStorageNotFoundError,
 )
-from coupon_challenge.services.storage.mongodb import MongoDBCouponStorage
+from coupon_challenge.services.storage.mongodb import (
+    DOCUMENT_SCHEMA_VERSION,
+    MongoDBCouponStorage,
+    applicable_pipeline,
+    from_document,
+    to_query,
+    to_versioned_document,
+    upgrade_document,
+)
 
 
 @pytest.fixture
@@ -30,7 +47,15 @@ def mock_mongo_collection(mock_mongo_client):
     mock_client_instance["challenge"]["coupons"].find_one = AsyncMock()
     mock_client_instance["challenge"]["coupons"].insert_one = AsyncMock()
     mock_client_instance["challenge"]["coupons"].update_one = AsyncMock()
-    mock_client_instance["challenge"]["coupons"].delete_one = AsyncMock()
+    mock_client_instance["challenge"]["coupons"].find_one_and_update = AsyncMock()
+    mock_client_instance["challenge"]["coupons"].find_one_and_delete = AsyncMock()
+    mock_client_instance["challenge"]["coupons"].insert_many = AsyncMock()
+    mock_client_instance["challenge"]["coupons"].bulk_write = AsyncMock()
+    mock_client_instance["challenge"]["coupons"].create_indexes = AsyncMock()
+    mock_client_instance["challenge"]["coupons"].index_information = AsyncMock()
+    mock_client_instance["challenge"]["coupons"].aggregate = Mock(
+        return_value=mock_get_all_cursor
+    )
     return mock_client_instance["challenge"]["coupons"]
 
 
@@ -90,6 +115,21 @@ async def test_get_all(
     assert len(coupons) == expected_count
 
 
+@pytest.mark.asyncio
+async def test_get_all__paginated(mock_mongo_collection, mongo_storage):
+    mock_mongo_collection.find.return_value.to_list.return_value = []
+
+    await mongo_storage.get_all(limit=10, after="coupon1")
+
+    mock_mongo_collection.find.assert_called_once_with(
+        {"name": {"$gt": "coupon1"}},
+        {"_id": False},
+        sort=[("name", 1)],
+        limit=10,
+        batch_size=0,
+    )
+
+
 @pytest.mark.asyncio
 @pytest.mark.usefixtures("mock_find_one_minimal_coupon")
 async def test_get(mock_mongo_collection, mongo_storage, minimal_coupon):
@@ -115,22 +155,49 @@ async def test_create(
 
     created_dump = minimal_coupon_create.model_dump()
 
-    mock_mongo_collection.insert_one.assert_called_once_with(created_dump)
+    mock_mongo_collection.insert_one.assert_called_once_with(
+        {**created_dump, "is_percent": False, "schema_version": DOCUMENT_SCHEMA_VERSION}
+    )
 
     assert coupon == Coupon.model_validate(created_dump)
 
 
 @pytest.mark.asyncio
-@pytest.mark.usefixtures("mock_find_one_minimal_coupon")
+async def test_create__normalized_document(
+    mongo_storage, mock_mongo_collection
+) -> None:
+    coupon = await mongo_storage.create(
+        CouponCreate(
+            name="coupon_test", discount="10%", validity=("2025-01-01", "2026-01-01")
+        )
+    )
+
+    mock_mongo_collection.insert_one.assert_called_once_with(
+        {
+            "name": "coupon_test",
+            "discount": 10,
+            "is_percent": True,
+            "condition": None,
+            "validity": {"start": datetime(2025, 1, 1), "end": datetime(2026, 1, 1)},
+            "schema_version": DOCUMENT_SCHEMA_VERSION,
+        }
+    )
+    assert coupon == Coupon(
+        name="coupon_test", discount="10%", validity=("2025-01-01", "2026-01-01")
+    )
+
+
+@pytest.mark.asyncio
 async def test_create__coupon_already_exists(
-    mongo_storage, minimal_coupon_create
+    mongo_storage, mock_mongo_collection, minimal_coupon_create
 ) -> None:
+    mock_mongo_collection.insert_one.side_effect = DuplicateKeyError("duplicate")
+
     with pytest.raises(CouponStorageAlreadyExistsError):
         await mongo_storage.create(minimal_coupon_create)
 
 
 @pytest.mark.asyncio
-@pytest.mark.usefixtures("mock_find_one_none")
 async def test_create__create_error(
     mongo_storage, mock_mongo_collection, minimal_coupon_create
 ) -> None:
@@ -143,49 +210,291 @@ async def test_create__create_error(
 
 
 @pytest.mark.asyncio
-@pytest.mark.usefixtures("mock_find_one_minimal_coupon")
-async def test_update(mongo_storage, minimal_coupon_update) -> None:
+async def test_create_many__duplicates(mongo_storage, mock_mongo_collection) -> None:
+    mock_mongo_collection.insert_many.side_effect = BulkWriteError(
+        {
+            "nInserted": 1,
+            "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000"}],
+        }
+    )
+
+    result = await mongo_storage.create_many(
+        [
+            CouponCreate(name="coupon_1", discount=1),
+            CouponCreate(name="coupon_1", discount=2),
+        ]
+    )
+
+    mock_mongo_collection.insert_many.assert_awaited_once()
+    assert result.inserted == 1
+    assert result.errors == {1: "Coupon with this name already exists"}
+
+
+@pytest.mark.asyncio
+async def test_update(
+    mongo_storage, mock_mongo_collection, minimal_coupon_update
+) -> None:
+    stored = {"name": "coupon_test", "discount": 90, "condition": {"price_above": 5}}
+    mock_mongo_collection.find_one_and_update.return_value = stored
+
     coupon = await mongo_storage.update(minimal_coupon_update)
 
-    assert coupon == Coupon.model_validate(minimal_coupon_update.model_dump())
+    mock_mongo_collection.find_one_and_update.assert_awaited_once_with(
+        {"name": "coupon_test"},
+        {"$set": {"name": "coupon_test", "discount": 90, "is_percent": False}},
+        projection={"_id": False},
+        return_document=ReturnDocument.AFTER,
+    )
+    assert coupon == Coupon.model_validate(stored)
 
 
 @pytest.mark.asyncio
-@pytest.mark.usefixtures("mock_find_one_none")
-async def test_update__not_found(mongo_storage, minimal_coupon_update) -> None:
+async def test_update__not_found(
+    mongo_storage, mock_mongo_collection, minimal_coupon_update
+) -> None:
+    mock_mongo_collection.find_one_and_update.return_value = None
+
     with pytest.raises(CouponStorageNotFoundError):
         await mongo_storage.update(minimal_coupon_update)
 
 
 @pytest.mark.asyncio
-@pytest.mark.usefixtures("mock_find_one_minimal_coupon")
 async def test_delete(mongo_storage, mock_mongo_collection, minimal_coupon) -> None:
-    succeed_deleted_result = Mock()
-    succeed_deleted_result.deleted_count = 1
-    mock_mongo_collection.delete_one.return_value = succeed_deleted_result
+    mock_mongo_collection.find_one_and_delete.return_value = minimal_coupon.model_dump()
 
     await mongo_storage.delete(minimal_coupon.name)
 
-    mock_mongo_collection.delete_one.assert_called_once_with(
-        {"name": minimal_coupon.name}
+    mock_mongo_collection.find_one_and_delete.assert_awaited_once_with(
+        {"name": minimal_coupon.name}, projection={"_id": False}
     )
 
 
 @pytest.mark.asyncio
-@pytest.mark.usefixtures("mock_find_one_none")
-async def test_delete__not_found(mongo_storage, minimal_coupon) -> None:
+async def test_delete__not_found(
+    mongo_storage, mock_mongo_collection, minimal_coupon
+) -> None:
+    mock_mongo_collection.find_one_and_delete.return_value = None
+
     with pytest.raises(CouponStorageNotFoundError):
         await mongo_storage.delete(minimal_coupon.name)
 
 
 @pytest.mark.asyncio
-@pytest.mark.usefixtures("mock_find_one_minimal_coupon")
-async def test_delete__with_error(
-    mongo_storage, mock_mongo_collection, minimal_coupon
-) -> None:
-    errored_deleted_result = Mock()
-    errored_deleted_result.deleted_count = 0
-    mock_mongo_collection.delete_one.return_value = errored_deleted_result
+async def test_find(mock_mongo_collection, mongo_storage):
+    mock_mongo_collection.find.return_value.to_list.return_value = []
+    valid_at = datetime(2025, 6, 1)
+
+    await mongo_storage.find(
+        CouponFilter(
+            category="food",
+            valid_at=valid_at,
+            max_price_above=100,
+            is_percent=True,
+            name_prefix="summer.",
+        ),
+        limit=10,
+        after="summer.a",
+    )
 
-    with pytest.raises(CouponStorageDeleteError):
-        await mongo_storage.delete(minimal_coupon.name)
+    mock_mongo_collection.find.assert_called_once_with(
+        {
+            "$and": [
+                {"condition.category": "food"},
+                {
+                    "$or": [
+                        {"condition.price_above": None},
+                        {"condition.price_above": {"$lte": 100}},
+                    ]
+                },
+                {"is_percent": True},
+                {
+                    "$or": [
+                        {"validity": None},
+                        {
+                            "validity.start": {"$lte": valid_at},
+                            "validity.end": {"$gte": valid_at},
+                        },
+                    ]
+                },
+            ],
+            "name": {"$regex": "^summer\\.", "$gt": "summer.a"},
+        },
+        {"_id": False},
+        sort=[("name", 1)],
+        limit=10,
+        batch_size=0,
+    )
+
+
+def test_to_query_should_compare_aware_valid_at_in_local_time() -> None:
+    valid_at = datetime(2025, 6, 1, 12, tzinfo=timezone.utc)
+
+    query = to_query(CouponFilter(valid_at=valid_at))
+
+    local_valid_at = valid_at.astimezone().replace(tzinfo=None)
+    assert query["$and"][0]["$or"][1] == {
+        "validity.start": {"$lte": local_valid_at},
+        "validity.end": {"$gte": local_valid_at},
+    }
+
+
+@pytest.mark.asyncio
+async def test_applicable_coupons(mock_mongo_collection, mongo_storage):
+    mock_mongo_collection.aggregate.return_value.to_list.return_value = [
+        Coupon(name="coupon1", discount=10).model_dump()
+    ]
+    at = datetime(2025, 6, 1)
+
+    coupons = await mongo_storage.applicable_coupons(
+        Product(name="cake", price=100, category="food"), at, limit=3
+    )
+
+    assert coupons == [Coupon(name="coupon1", discount=10)]
+    (pipeline,), _ = mock_mongo_collection.aggregate.call_args
+    assert pipeline[0]["$match"]["$and"][1] == {
+        "$or": [{"condition.category": None}, {"condition.category": "food"}]
+    }
+    assert pipeline[2:] == [
+        {"$sort": {"saving": -1, "name": 1}},
+        {"$limit": 3},
+        {"$project": {"_id": False, "saving": False}},
+    ]
+
+
+def test_applicable_pipeline__only_ranks_current_layout() -> None:
+    # Written before documents were normalized and versioned
+    document = {"name": "coupon_test", "discount": "20%"}
+    (version_clause, *_) = applicable_pipeline(
+        Product(name="cake", price=100, category="food"), datetime(2025, 6, 1)
+    )[0]["$match"]["$and"]
+
+    assert version_clause == {"schema_version": DOCUMENT_SCHEMA_VERSION}
+    assert "schema_version" not in document
+    assert upgrade_document(document) == {
+        "name": "coupon_test",
+        "discount": 20,
+        "is_percent": True,
+        "condition": None,
+        "validity": None,
+        "schema_version": DOCUMENT_SCHEMA_VERSION,
+    }
+
+
+@pytest.mark.asyncio
+async def test_initialize__ensures_indexes(mock_mongo_client, mock_mongo_collection):
+    mock_mongo_client.return_value.admin.command = AsyncMock()
+    mongo_storage = MongoDBCouponStorage(db_uri="fake_db_uri", expired_coupons_ttl=60)
+
+    await mongo_storage.initialize()
+
+    (indexes,), _ = mock_mongo_collection.create_indexes.call_args
+    assert [index.document["key"] for index in indexes] == [
+        {"name": 1},
+        {"condition.category": 1, "condition.price_above": 1},
+        {"validity.start": 1, "validity.end": 1},
+        {"validity.end": 1},
+    ]
+    assert indexes[-1].document["expireAfterSeconds"] == 60
+
+
+@pytest.mark.asyncio
+async def test_initialize__upgrades_old_documents(
+    mock_mongo_client, mock_mongo_collection
+):
+    mock_mongo_client.return_value.admin.command = AsyncMock()
+    mock_mongo_collection.find.return_value.to_list.return_value = [
+        # Written before documents were normalized and versioned
+        {
+            "_id": "old",
+            "name": "coupon_test",
+            "discount": "20%",
+            "validity": [datetime(2025, 1, 1), datetime(2026, 1, 1)],
+        },
+        {"_id": "invalid", "name": "coupon_invalid", "discount": "-20%"},
+    ]
+    mock_mongo_collection.bulk_write.return_value.modified_count = 1
+    mongo_storage = MongoDBCouponStorage(db_uri="fake_db_uri")
+
+    await mongo_storage.initialize()
+
+    (query,), _ = mock_mongo_collection.find.call_args
+    assert query == {"schema_version": {"$ne": DOCUMENT_SCHEMA_VERSION}}
+    (requests,), _ = mock_mongo_collection.bulk_write.call_args
+    assert len(requests) == 1
+    assert requests[0]._filter == {"_id": "old"}
+    assert requests[0]._doc == {
+        "name": "coupon_test",
+        "discount": 20,
+        "is_percent": True,
+        "condition": None,
+        "validity": {"start": datetime(2025, 1, 1), "end": datetime(2026, 1, 1)},
+        "schema_version": DOCUMENT_SCHEMA_VERSION,
+    }
+
+
+@pytest.mark.asyncio
+async def test_missing_indexes(mock_mongo_collection, mongo_storage):
+    mock_mongo_collection.index_information.return_value = {
+        "_id_": {"key": [("_id", 1)]},
+        # Not unique, so not the expected one
+        "name_1": {"key": [("name", 1)]},
+        "validity.start_1_validity.end_1": {
+            "key": [("validity.start", 1), ("validity.end", 1)]
+        },
+    }
+
+    assert await mongo_storage.missing_indexes() == [
+        "name_1",
+        "condition.category_1_condition.price_above_1",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_find__warns_once_on_collscan(mock_mongo_client, caplog):
+    mongo_storage = MongoDBCouponStorage(db_uri="fake_db_uri", check_query_plans=True)
+    collection = mock_mongo_client.return_value["challenge"]["coupons"]
+    collection.find.return_value.to_list = AsyncMock(return_value=[])
+    collection.database.command = AsyncMock(
+        return_value={
+            "queryPlanner": {
+                "winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}
+            }
+        }
+    )
+
+    with caplog.at_level(logging.WARNING):
+        await mongo_storage.find(CouponFilter(valid_at=datetime(2025, 1, 1)))
+        await mongo_storage.find(CouponFilter(valid_at=datetime(2026, 1, 1)))
+
+    collection.database.command.assert_awaited_once()
+    assert len(caplog.records) == 1
+    assert "collection scan" in caplog.records[0].getMessage()
+
+
+@pytest.mark.parametrize("strict", [False, True])
+@pytest.mark.parametrize(
+    "coupon_create",
+    [
+        CouponCreate(name="coupon_test", discount=10),
+        CouponCreate(name="coupon_test", discount="10%", condition={}),
+        CouponCreate(
+            name="coupon_test",
+            discount="10%",
+            condition={"category": "food", "price_above": 20},
+            validity=("2025-01-01", "2026-01-01"),
+        ),
+    ],
+)
+def test_from_document__versioned(coupon_create, strict) -> None:
+    document = to_versioned_document(coupon_create.model_dump())
+
+    assert from_document(document, strict) == Coupon.model_validate(
+        coupon_create.model_dump()
+    )
+
+
+def test_from_document__unversioned_documents_are_validated() -> None:
+    # Written before documents were normalized and versioned
+    document = {"name": "coupon_test", "discount": "10%"}
+
+    assert from_document(document) == Coupon(name="coupon_test", discount="10%")
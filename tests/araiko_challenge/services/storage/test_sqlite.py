@@ -1 +1,351 @@
-"""TODO: Test SQLite backend by mocking connection and operations."""
+import asyncio
+import random
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from coupon_challenge.models.coupon import (
+    Coupon,
+    CouponCreate,
+    CouponFilter,
+    CouponUpdate,
+)
+from coupon_challenge.models.product import Product
+from coupon_challenge.services.bulk import coupon_to_record
+from coupon_challenge.services.index import to_epoch
+from coupon_challenge.services.storage import (
+    CouponStorageAlreadyExistsError,
+    CouponStorageNotFoundError,
+    coupon_applies,
+    coupon_matches,
+    coupon_saving,
+)
+from coupon_challenge.services.storage.sqlite import (
+    SCHEMA_VERSION,
+    SQLiteCouponStorage,
+)
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteCouponStorage(str(tmp_path / "coupon.db"), pool_size=2)
+    try:
+        yield storage
+    finally:
+        storage.close()
+
+
+@pytest.fixture
+def minimal_coupon_create() -> CouponCreate:
+    return CouponCreate(
+        name="coupon_test",
+        discount="10%",
+        condition={"category": "food"},
+        validity=("2025-01-01", "2026-01-01"),
+    )
+
+
+@pytest.mark.asyncio
+async def test_create_and_get(sqlite_storage, minimal_coupon_create) -> None:
+    created = await sqlite_storage.create(minimal_coupon_create)
+
+    assert await sqlite_storage.get(minimal_coupon_create.name) == created
+    assert created == Coupon.model_validate(minimal_coupon_create.model_dump())
+
+
+@pytest.mark.asyncio
+async def test_strict_reads(tmp_path) -> None:
+    db_path = str(tmp_path / "coupon.db")
+    coupons = [
+        Coupon(name="coupon_1", discount=5),
+        Coupon(name="coupon_2", discount="20%", condition={"price_above": 10}),
+        Coupon(
+            name="coupon_3",
+            discount=20,
+            condition={"category": "food"},
+            validity=("2025-01-01T00:00:00+02:00", "2026-01-01T00:00:00+02:00"),
+        ),
+    ]
+    trusted_storage = SQLiteCouponStorage(db_path)
+    strict_storage = SQLiteCouponStorage(db_path, strict=True)
+    try:
+        await trusted_storage.create_many(
+            [CouponCreate.model_validate(coupon_to_record(c)) for c in coupons]
+        )
+
+        assert await trusted_storage.get_all() == coupons
+        assert await strict_storage.get_all() == coupons
+    finally:
+        trusted_storage.close()
+        strict_storage.close()
+
+
+@pytest.mark.asyncio
+async def test_create__coupon_already_exists(
+    sqlite_storage, minimal_coupon_create
+) -> None:
+    await sqlite_storage.create(minimal_coupon_create)
+
+    with pytest.raises(CouponStorageAlreadyExistsError):
+        await sqlite_storage.create(minimal_coupon_create)
+
+
+@pytest.mark.asyncio
+async def test_get__parameters_are_not_interpolated(
+    sqlite_storage, minimal_coupon_create
+) -> None:
+    await sqlite_storage.create(minimal_coupon_create)
+
+    with pytest.raises(CouponStorageNotFoundError):
+        await sqlite_storage.get("x' OR '1'='1")
+
+
+@pytest.mark.asyncio
+async def test_update(sqlite_storage, minimal_coupon_create) -> None:
+    await sqlite_storage.create(minimal_coupon_create)
+
+    coupon = await sqlite_storage.update(CouponUpdate(name="coupon_test", discount=90))
+
+    assert coupon == Coupon(
+        name="coupon_test",
+        discount=90,
+        condition={"category": "food"},
+        validity=("2025-01-01", "2026-01-01"),
+    )
+    assert await sqlite_storage.get("coupon_test") == coupon
+
+
+@pytest.mark.asyncio
+async def test_update__not_found(sqlite_storage) -> None:
+    with pytest.raises(CouponStorageNotFoundError):
+        await sqlite_storage.update(CouponUpdate(name="none", discount=1))
+
+
+@pytest.mark.asyncio
+async def test_delete(sqlite_storage, minimal_coupon_create) -> None:
+    await sqlite_storage.create(minimal_coupon_create)
+
+    await sqlite_storage.delete(minimal_coupon_create.name)
+
+    with pytest.raises(CouponStorageNotFoundError):
+        await sqlite_storage.delete(minimal_coupon_create.name)
+
+
+@pytest.mark.asyncio
+async def test_iter_all__paginated(sqlite_storage) -> None:
+    await sqlite_storage.create_many(
+        [CouponCreate(name=f"coupon_{i:02}", discount=i) for i in range(25)]
+    )
+
+    names = [
+        coupon.name
+        async for coupon in sqlite_storage.iter_all(
+            batch_size=4, limit=10, after="coupon_05"
+        )
+    ]
+
+    assert names == [f"coupon_{i:02}" for i in range(6, 16)]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reads_and_writes(sqlite_storage) -> None:
+    creates = [CouponCreate(name=f"coupon_{i}", discount=i) for i in range(50)]
+
+    await asyncio.gather(
+        *(sqlite_storage.create(coupon_create) for coupon_create in creates),
+        *(sqlite_storage.get_all() for _ in range(50)),
+    )
+
+    assert len(await sqlite_storage.get_all()) == len(creates)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "validity",
+    [
+        pytest.param(("2025-01-01", "2026-01-01T12:30:00"), id="Naive validity"),
+        pytest.param(
+            ("2025-01-01T00:00:00+02:00", "2026-01-01T00:00:00+02:00"),
+            id="Aware validity",
+        ),
+    ],
+)
+async def test_validity_round_trip(sqlite_storage, validity) -> None:
+    coupon = await sqlite_storage.create(
+        CouponCreate(name="coupon_test", discount=10, validity=validity)
+    )
+
+    stored = await sqlite_storage.get("coupon_test")
+
+    assert stored == coupon
+    assert stored.validity.start.utcoffset() == coupon.validity.start.utcoffset()
+
+
+@pytest.mark.asyncio
+async def test_blob_layout_is_migrated(tmp_path) -> None:
+    db_path = str(tmp_path / "coupon.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE coupons (name TEXT UNIQUE PRIMARY KEY, discount TEXT NOT NULL,"
+        " validity TEXT, condition TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO coupons VALUES (?, ?, ?, ?)",
+        [
+            ("coupon_1", "5", "", ""),
+            (
+                "coupon_2",
+                "20%",
+                '{"start": "2025-01-01T00:00:00", "end": "2026-01-01T00:00:00"}',
+                '{"category":"food","price_above":null}',
+            ),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteCouponStorage(db_path)
+    try:
+        coupons = await storage.get_all()
+        schema_version = storage.conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        storage.close()
+
+    assert schema_version == SCHEMA_VERSION
+    assert coupons == [
+        Coupon(name="coupon_1", discount=5),
+        Coupon(
+            name="coupon_2",
+            discount="20%",
+            condition={"category": "food"},
+            validity=("2025-01-01", "2026-01-01"),
+        ),
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "coupon_filter",
+    [
+        CouponFilter(category="food"),
+        CouponFilter(max_price_above=50),
+        CouponFilter(is_percent=True, name_prefix="coupon_1"),
+        CouponFilter(valid_at=datetime(2025, 6, 1)),
+        CouponFilter(category="food", valid_at=datetime(2022, 6, 1), is_percent=False),
+    ],
+)
+async def test_find_should_match_coupon_matches(sqlite_storage, coupon_filter) -> None:
+    rng = random.Random(11)
+    coupons = [
+        Coupon(
+            name=f"coupon_{i}",
+            discount=f"{i}%" if rng.random() < 0.5 else i,
+            condition=rng.choice(
+                [None, {"category": "food"}, {"price_above": rng.randint(0, 100)}]
+            ),
+            validity=rng.choice(
+                [None, ("2025-01-01", "2026-01-01"), ("2020-01-01", "2023-01-01")]
+            ),
+        )
+        for i in range(200)
+    ]
+    await sqlite_storage.create_many(
+        [CouponCreate.model_validate(coupon_to_record(coupon)) for coupon in coupons]
+    )
+
+    found = await sqlite_storage.find(coupon_filter)
+
+    assert {coupon.name for coupon in found} == {
+        coupon.name for coupon in coupons if coupon_matches(coupon, coupon_filter)
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "prefix", ["a\U0010ffff", "\U0010ffff", "\U0010ffff\U0010ffff", "a\ud7ff"]
+)
+async def test_find_by_prefix_should_handle_the_last_code_points(
+    sqlite_storage, prefix
+) -> None:
+    names = [
+        "a",
+        "a\U0010ffff",
+        "a\U0010ffffz",
+        "a\ud7ff",
+        "a\ud7ffz",
+        "a\ue000",
+        "b",
+        "\U0010ffff",
+        "\U0010ffff\U0010ffff",
+        "\U0010ffff\U0010ffffz",
+    ]
+    await sqlite_storage.create_many(
+        [CouponCreate(name=name, discount=10) for name in names]
+    )
+
+    found = await sqlite_storage.find(CouponFilter(name_prefix=prefix))
+
+    assert {coupon.name for coupon in found} == {
+        name for name in names if name.startswith(prefix)
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("price", [0, 1, 50, 99, 100, 101, 1000])
+@pytest.mark.parametrize("category", ["food", "furniture"])
+async def test_applicable_coupons_should_match_coupon_is_applicable(
+    sqlite_storage, price, category
+) -> None:
+    rng = random.Random(13)
+    coupons = [
+        Coupon(
+            name=f"coupon_{i}",
+            discount=f"{rng.randint(0, 150)}%"
+            if rng.random() < 0.5
+            else rng.randint(0, 200),
+            condition=rng.choice(
+                [
+                    None,
+                    {"category": "food"},
+                    {"price_above": rng.choice([0, 50, 100])},
+                    {"category": "furniture", "price_above": 10},
+                ]
+            ),
+            validity=rng.choice(
+                [None, ("2025-01-01", "2026-01-01"), ("2020-01-01", "2023-01-01")]
+            ),
+        )
+        for i in range(300)
+    ]
+    await sqlite_storage.create_many(
+        [CouponCreate.model_validate(coupon_to_record(coupon)) for coupon in coupons]
+    )
+    product = Product(name="product", price=price, category=category)
+    at = datetime(2025, 6, 1)
+
+    found = await sqlite_storage.applicable_coupons(product, at)
+
+    expected = sorted(
+        (coupon for coupon in coupons if coupon_applies(coupon, product, to_epoch(at))),
+        key=lambda coupon: (-coupon_saving(coupon, product), coupon.name),
+    )
+    assert [coupon.name for coupon in found] == [coupon.name for coupon in expected]
+
+
+@pytest.mark.asyncio
+async def test_missing_indexes_are_created_on_startup(tmp_path) -> None:
+    db_path = str(tmp_path / "coupon.db")
+    storage = SQLiteCouponStorage(db_path)
+    storage.conn.execute("DROP INDEX coupons_validity")
+    storage.conn.commit()
+    try:
+        assert await storage.missing_indexes() == ["coupons_validity"]
+    finally:
+        storage.close()
+
+    storage = SQLiteCouponStorage(db_path)
+    try:
+        assert await storage.missing_indexes() == []
+    finally:
+        storage.close()
@@ -0,0 +1,93 @@
+import io
+import json
+import random
+from datetime import datetime
+
+import pytest
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.batch import apply_coupons_to_products
+from coupon_challenge.services.clock import FrozenClock
+from coupon_challenge.services.coupons import CouponApplicabilityService
+
+MOMENT = datetime(2025, 6, 1)
+
+COUPONS = [
+    Coupon(name="ten", discount=10),
+    Coupon(name="half", discount="50%", condition={"category": "food"}),
+    Coupon(name="expensive", discount=30, condition={"price_above": 200}),
+    Coupon(
+        name="expired",
+        discount="90%",
+        validity={"start": "2020-01-01", "end": "2021-01-01"},
+    ),
+]
+
+
+def random_products(count: int) -> list[Product]:
+    rng = random.Random(5)
+    return [
+        Product(
+            name=f"product_{i}",
+            price=rng.randint(0, 500),
+            category=rng.choice(list(ProductCategory)),
+        )
+        for i in range(count)
+    ]
+
+
+def run_batch(lines: list[str], **kwargs) -> tuple[list[dict], list[tuple[int, str]]]:
+    output, errors = io.StringIO(), []
+    apply_coupons_to_products(
+        COUPONS,
+        io.StringIO("".join(f"{line}\n" for line in lines)),
+        output,
+        now=FrozenClock(MOMENT).epoch(),
+        on_error=lambda line_number, reason: errors.append((line_number, reason)),
+        **kwargs,
+    )
+
+    return [json.loads(line) for line in output.getvalue().splitlines()], errors
+
+
+@pytest.mark.parametrize(
+    "workers",
+    [pytest.param(1, id="In process"), pytest.param(2, id="Process pool")],
+)
+def test_apply_coupons_to_products_should_match_service(workers: int) -> None:
+    products = random_products(50)
+    service = CouponApplicabilityService(FrozenClock(MOMENT))
+
+    results, errors = run_batch(
+        [product.model_dump_json() for product in products],
+        workers=workers,
+        chunk_size=7,
+    )
+
+    assert errors == []
+    assert [result["line"] for result in results] == list(range(1, 51))
+    for product, result in zip(products, results):
+        expected = {
+            coupon.name: service.apply_discount(coupon, product).price
+            for coupon in COUPONS
+            if service.coupon_is_applicable(coupon, product)
+        }
+        prices = {coupon["coupon"]: coupon["price"] for coupon in result["coupons"]}
+        assert prices == expected
+        discounts = [coupon["discount"] for coupon in result["coupons"]]
+        assert discounts == sorted(discounts, reverse=True)
+
+
+def test_apply_coupons_to_products_should_report_invalid_lines() -> None:
+    results, errors = run_batch(
+        [
+            '{"name": "cake", "price": 100, "category": "food"}',
+            "not json",
+            "",
+            '{"name": "table", "price": -1, "category": "furniture"}',
+        ]
+    )
+
+    assert [result["product"]["name"] for result in results] == ["cake"]
+    assert [line_number for line_number, _ in errors] == [2, 4]
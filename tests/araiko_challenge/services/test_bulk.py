@@ -0,0 +1,135 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.services.bulk import (
+    CouponFileFormat,
+    ImportCheckpoint,
+    export_coupons,
+    import_coupons,
+)
+from coupon_challenge.services.storage import CouponStorage
+
+
+def jsonl(*records: dict | str) -> io.StringIO:
+    return io.StringIO(
+        "".join(
+            (record if isinstance(record, str) else json.dumps(record)) + "\n"
+            for record in records
+        )
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "mock_storage", [[Coupon(name="coupon_0", discount=5)]], indirect=True
+)
+async def test_import_coupons_should_report_rejected_lines(
+    mock_storage: CouponStorage,
+) -> None:
+    storage = mock_storage
+    errors = []
+
+    report = await import_coupons(
+        storage,
+        jsonl(
+            {"name": "coupon_1", "discount": "10%"},
+            "not json",
+            {"name": "coupon_0", "discount": 20},
+            {"name": "coupon_2"},
+            {"name": "coupon_3", "discount": 3, "condition": {"category": "food"}},
+        ),
+        CouponFileFormat.jsonl,
+        chunk_size=2,
+        on_error=lambda line, reason: errors.append(line),
+    )
+
+    assert (report.read, report.imported, report.rejected) == (5, 2, 3)
+    assert sorted(errors) == [2, 3, 4]
+    assert {coupon.name for coupon in await storage.get_all()} == {
+        "coupon_0",
+        "coupon_1",
+        "coupon_3",
+    }
+    assert (await storage.get("coupon_0")).discount == 5
+
+
+@pytest.mark.asyncio
+async def test_import_coupons_should_reject_invalid_discounts_one_by_one(
+    mock_storage: CouponStorage,
+) -> None:
+    errors = []
+
+    report = await import_coupons(
+        mock_storage,
+        jsonl(
+            {"name": "coupon_1", "discount": "abc"},
+            {"name": "coupon_2", "discount": "10%"},
+            {"name": "coupon_3", "discount": "-5%"},
+        ),
+        CouponFileFormat.jsonl,
+        on_error=lambda line, reason: errors.append(line),
+    )
+
+    assert (report.read, report.imported, report.rejected) == (3, 1, 2)
+    assert errors == [1, 3]
+    assert [coupon.name for coupon in await mock_storage.get_all()] == ["coupon_2"]
+
+
+@pytest.mark.asyncio
+async def test_import_coupons_should_resume_from_checkpoint(
+    mock_storage: CouponStorage, tmp_path: Path
+) -> None:
+    storage = mock_storage
+    checkpoint = ImportCheckpoint(tmp_path / "coupons.checkpoint")
+    checkpoint.save(2)
+
+    report = await import_coupons(
+        storage,
+        jsonl(*({"name": f"coupon_{i}", "discount": i} for i in range(1, 5))),
+        CouponFileFormat.jsonl,
+        checkpoint=checkpoint,
+    )
+
+    assert report.resumed_from == 2
+    assert {coupon.name for coupon in await storage.get_all()} == {
+        "coupon_3",
+        "coupon_4",
+    }
+    assert not checkpoint.path.exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "mock_storage",
+    [
+        [
+            Coupon(name="coupon_1", discount="10%"),
+            Coupon(
+                name="coupon_2",
+                discount=15,
+                condition={"category": "food", "price_above": 100},
+                validity=("2025-01-01", "2026-01-01"),
+            ),
+        ]
+    ],
+    indirect=True,
+)
+@pytest.mark.parametrize("file_format", list(CouponFileFormat))
+async def test_export_coupons_should_round_trip(
+    mock_storage: CouponStorage, file_format: CouponFileFormat
+) -> None:
+    coupons = await mock_storage.get_all()
+    file = io.StringIO()
+
+    count = await export_coupons(mock_storage, file, file_format)
+    for coupon in coupons:
+        await mock_storage.delete(coupon.name)
+    file.seek(0)
+    report = await import_coupons(mock_storage, file, file_format)
+
+    assert count == report.imported == 2
+    assert await mock_storage.get_all() == coupons
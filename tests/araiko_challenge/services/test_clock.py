@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta, timezone
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.services.clock import FrozenClock, SystemClock
+from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.index import to_epoch
+
+
+def test_system_clock_is_timezone_aware() -> None:
+    clock = SystemClock()
+
+    before = to_epoch(datetime.now())
+    now, epoch = clock.now(), clock.epoch()
+    after = to_epoch(datetime.now())
+
+    assert now.tzinfo is not None
+    assert before <= to_epoch(now) <= epoch <= after
+
+
+def test_frozen_clock_should_not_move() -> None:
+    clock = SystemClock().freeze()
+
+    assert clock.now() == clock.freeze().now()
+    assert clock.epoch() == to_epoch(clock.now())
+
+
+def test_frozen_clock_should_take_naive_moments_as_local_time() -> None:
+    moment = datetime(2025, 6, 1, 12)
+
+    clock = FrozenClock(moment)
+
+    assert clock.now() == moment.astimezone()
+    assert clock.epoch() == to_epoch(moment)
+
+
+def test_validity_should_compare_naive_and_aware_moments() -> None:
+    coupon = Coupon(
+        name="coupon",
+        discount=10,
+        validity={"start": "2025-01-01T00:00:00Z", "end": "2025-01-01T12:00:00Z"},
+    )
+    utc_moment = datetime(2025, 1, 1, 11, tzinfo=timezone.utc)
+
+    for moment in (utc_moment, utc_moment.astimezone(timezone(timedelta(hours=-5)))):
+        service = CouponApplicabilityService(FrozenClock(moment))
+        assert service.coupon_is_valid(coupon)
+
+    service = CouponApplicabilityService(FrozenClock(utc_moment + timedelta(hours=2)))
+    assert not service.coupon_is_valid(coupon)
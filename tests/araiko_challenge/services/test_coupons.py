@@ -1,11 +1,13 @@
 from datetime import datetime
-from unittest.mock import patch
 
 import pytest
 
+from coupon_challenge.models.cart import Cart
 from coupon_challenge.models.coupon import Coupon, CouponCondition, CouponValidity
 from coupon_challenge.models.product import Product
-from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.clock import FrozenClock
+from coupon_challenge.services.coupons import CompiledCoupon, CouponApplicabilityService
+from coupon_challenge.services.index import to_epoch
 
 
 @pytest.mark.parametrize(
@@ -29,6 +31,12 @@ from coupon_challenge.services.coupons import CouponApplicabilityService
             Product(name="product", price=0, category="food"),
             id="Apply greater fixed discount should returns 0",
         ),
+        pytest.param(
+            Coupon(name="coupon", discount="150%"),
+            Product(name="product", price=100, category="food"),
+            Product(name="product", price=0, category="food"),
+            id="Apply percent discount above 100% should returns 0",
+        ),
     ],
 )
 def test_apply_discount(
@@ -144,12 +152,110 @@ def test_coupon_is_valid(
     end: str,
     moment: str,
     expected_result: bool,
-    coupon_service: CouponApplicabilityService,
 ) -> None:
     coupon = Coupon(
         name="coupon", discount=10, validity=CouponValidity(start=start, end=end)
     )
+    coupon_service = CouponApplicabilityService(
+        FrozenClock(datetime.fromisoformat(moment))
+    )
+
+    assert coupon_service.coupon_is_valid(coupon) == expected_result
+
+
+def test_apply_discount_to_cart_should_report_non_applicable_lines(
+    coupon_service: CouponApplicabilityService,
+) -> None:
+    coupon = Coupon(name="coupon", discount="10%", condition={"category": "food"})
+    cart = Cart(
+        [
+            Product(name="cake", price=100, category="food"),
+            Product(name="table", price=50, category="furniture"),
+        ]
+    )
+
+    cart_application = coupon_service.apply_discount_to_cart(coupon, cart)
+
+    assert [(line.applicable, line.price) for line in cart_application.lines] == [
+        (True, 90),
+        (False, 50),
+    ]
+    assert cart_application.total_price == 150
+    assert cart_application.total_discounted_price == 140
+    assert cart_application.total_discount == 10
+
+
+@pytest.mark.parametrize(
+    ("coupon", "product", "expected_price"),
+    [
+        pytest.param(
+            Coupon(name="coupon", discount="7%"),
+            Product(name="product", price=500, category="food"),
+            464,
+            id="Percent discount rounds like the service",
+        ),
+        pytest.param(
+            Coupon(name="coupon", discount=80),
+            Product(name="product", price=50, category="food"),
+            0,
+            id="Fixed discount is capped at 0",
+        ),
+        pytest.param(
+            Coupon(name="coupon", discount="150%"),
+            Product(name="product", price=50, category="food"),
+            0,
+            id="Percent discount above 100% is capped at 0",
+        ),
+        pytest.param(
+            Coupon(name="coupon", discount=10, condition={"category": "furniture"}),
+            Product(name="product", price=50, category="food"),
+            None,
+            id="Other category is not applicable",
+        ),
+        pytest.param(
+            Coupon(name="coupon", discount=10, condition={"price_above": 50}),
+            Product(name="product", price=50, category="food"),
+            None,
+            id="Price threshold is exclusive",
+        ),
+        pytest.param(
+            Coupon(name="coupon", discount=10, condition={"price_above": 0}),
+            Product(name="product", price=0, category="food"),
+            0,
+            id="Price above 0 is no condition",
+        ),
+        pytest.param(
+            Coupon(
+                name="coupon",
+                discount=10,
+                validity={"start": "2000-01-01", "end": "2001-01-01"},
+            ),
+            Product(name="product", price=50, category="food"),
+            None,
+            id="Expired coupon is not applicable",
+        ),
+    ],
+)
+def test_compiled_coupon_price_for(
+    coupon: Coupon,
+    product: Product,
+    expected_price: int | None,
+    coupon_service: CouponApplicabilityService,
+) -> None:
+    compiled_coupon = CompiledCoupon.from_coupon(coupon)
+
+    price = compiled_coupon.price_for(
+        product.price, product.category, to_epoch(datetime.now())
+    )
+
+    assert price == expected_price
+    if coupon_service.coupon_is_applicable(coupon, product):
+        assert price == coupon_service.apply_discount(coupon, product).price
+
+
+def test_compiled_coupon_is_immutable() -> None:
+    compiled_coupon = CompiledCoupon.from_coupon(Coupon(name="coupon", discount=10))
 
-    with patch("coupon_challenge.services.coupons.datetime") as datetime_mock:
-        datetime_mock.now.return_value = datetime.fromisoformat(moment)
-        assert coupon_service.coupon_is_valid(coupon) == expected_result
+    assert not hasattr(compiled_coupon, "__dict__")
+    with pytest.raises(AttributeError):
+        compiled_coupon.amount = 20  # type: ignore[misc]
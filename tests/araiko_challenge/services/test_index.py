@@ -0,0 +1,141 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.clock import FrozenClock
+from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.index import CouponIndex, IntervalTree
+
+MOMENTS = [
+    "2024-06-01",
+    "2025-01-01",
+    "2025-06-15T12:00:00",
+    "2026-01-01",
+    "2030-01-01",
+]
+
+
+def random_coupon(rng: random.Random, name: str) -> Coupon:
+    condition = {}
+    if rng.random() < 0.5:
+        condition["category"] = rng.choice(list(ProductCategory))
+    if rng.random() < 0.5:
+        condition["price_above"] = rng.randint(0, 200)
+    validity = None
+    if rng.random() < 0.5:
+        validity = rng.choice(
+            [
+                ("2025-01-01", "2026-01-01"),
+                ("2025-06-01", "2025-07-01"),
+                ("2020-01-01", "2024-12-31"),
+                ("2025-06-15T12:00:00", "2025-06-15T12:00:00"),
+            ]
+        )
+    return Coupon(
+        name=name,
+        discount=rng.randint(0, 50),
+        condition=condition or None,
+        validity=validity,
+    )
+
+
+def expected_applicable(coupons, product: Product, moment: str) -> set[str]:
+    service = CouponApplicabilityService(FrozenClock(datetime.fromisoformat(moment)))
+    return {
+        coupon.name
+        for coupon in coupons
+        if service.coupon_is_applicable(coupon, product)
+    }
+
+
+@pytest.fixture
+def rng() -> random.Random:
+    return random.Random(7)
+
+
+@pytest.fixture
+def coupons(rng: random.Random) -> list[Coupon]:
+    return [random_coupon(rng, f"coupon_{i}") for i in range(300)]
+
+
+@pytest.mark.parametrize("moment", MOMENTS)
+@pytest.mark.parametrize(
+    "product",
+    [
+        Product(name="cake", price=0, category="food"),
+        Product(name="cake", price=100, category="food"),
+        Product(name="table", price=150, category="furniture"),
+        Product(name="phone", price=1000, category="electronics"),
+    ],
+)
+def test_applicable_should_match_coupon_is_applicable(
+    coupons: list[Coupon], product: Product, moment: str
+) -> None:
+    index = CouponIndex(coupons)
+
+    applicable = index.applicable(
+        product.price, product.category, datetime.fromisoformat(moment)
+    )
+
+    assert {coupon.name for coupon in applicable} == expected_applicable(
+        coupons, product, moment
+    )
+
+
+def test_applicable_should_follow_incremental_changes(
+    rng: random.Random, coupons: list[Coupon]
+) -> None:
+    index = CouponIndex(coupons[:100])
+    current = {coupon.name: coupon for coupon in coupons[:100]}
+    product = Product(name="cake", price=100, category="food")
+
+    for step, coupon in enumerate(coupons[100:]):
+        moment = rng.choice(MOMENTS)
+        # Warm the cached validity segment before changing the index
+        index.applicable(
+            product.price, product.category, datetime.fromisoformat(moment)
+        )
+
+        if step % 3 == 0:
+            removed = rng.choice(list(current))
+            index.remove(removed)
+            del current[removed]
+        updated = random_coupon(rng, rng.choice([coupon.name, *current]))
+        index.upsert(updated)
+        current[updated.name] = updated
+
+        applicable = index.applicable(
+            product.price, product.category, datetime.fromisoformat(moment)
+        )
+        assert {c.name for c in applicable} == expected_applicable(
+            current.values(), product, moment
+        )
+
+    assert len(index) == len(current)
+
+
+def test_interval_tree_should_find_the_intervals_containing_a_moment(
+    rng: random.Random,
+) -> None:
+    windows = {f"window_{i}": (i, i + rng.randrange(20)) for i in range(0, 100, 3)}
+    tree = IntervalTree.from_windows(windows)
+
+    for step in range(500):
+        name = f"window_{rng.randrange(200)}"
+        if step % 4 == 0:
+            tree.remove(name)
+            windows.pop(name, None)
+        else:
+            start = rng.randrange(100)
+            windows[name] = (start, start + rng.randrange(20))
+            tree.add(name, windows[name])
+
+        at = rng.randrange(-5, 125)
+        assert set(tree.containing(at)) == {
+            name for name, (start, end) in windows.items() if start <= at <= end
+        }
+
+    assert len(tree) == len(windows)
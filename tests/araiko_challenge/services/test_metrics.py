@@ -0,0 +1,65 @@
+import pytest
+
+from coupon_challenge.services.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+)
+
+
+def test_counter_render() -> None:
+    counter = Counter("requests", "Requests.", ("route",))
+    counter.labels("/coupons").inc()
+    counter.labels("/coupons").inc(2)
+    counter.labels('say "hi"\n').inc()
+
+    assert list(counter.render()) == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/coupons"} 3',
+        'requests_total{route="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_gauge_render() -> None:
+    gauge = Gauge("in_flight", "In flight.")
+    gauge.labels().inc()
+    gauge.labels().inc()
+    gauge.labels().dec()
+
+    assert list(gauge.samples()) == ["in_flight 1"]
+
+
+def test_histogram_render() -> None:
+    histogram = Histogram("latency", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.labels("/").observe(value)
+
+    assert list(histogram.samples()) == [
+        'latency_bucket{route="/",le="0.1"} 2',
+        'latency_bucket{route="/",le="1.0"} 3',
+        'latency_bucket{route="/",le="+Inf"} 4',
+        'latency_sum{route="/"} 2.65',
+        'latency_count{route="/"} 4',
+    ]
+
+
+def test_labels__wrong_number_of_values() -> None:
+    counter = Counter("requests", "Requests.", ("route",))
+
+    with pytest.raises(ValueError):
+        counter.labels("/", "GET")
+
+
+def test_registry__render_and_duplicates() -> None:
+    registry = MetricsRegistry()
+    registry.register(Counter("requests", "Requests.")).labels().inc()
+
+    with pytest.raises(ValueError):
+        registry.register(Gauge("requests", "Requests."))
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        "requests_total 1\n"
+    )
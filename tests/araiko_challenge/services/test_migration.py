@@ -0,0 +1,128 @@
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.services.bulk import ImportCheckpoint
+from coupon_challenge.services.migration import (
+    migrate_legacy_coupons,
+    open_legacy_database,
+)
+from coupon_challenge.services.storage.memory import InMemoryCouponStorage
+
+# Rows as legacy.py add_coupon writes them
+LEGACY_ROWS = [
+    ("fixed", "10", "", ""),
+    ("percent", "25%", '{"category":"food","price_above":null}', ""),
+    (
+        "dated",
+        "5",
+        '{"category":null,"price_above":100}',
+        '{"start": "2025-01-01T00:00:00", "end": "2025-12-31T00:00:00"}',
+    ),
+    ("negative", "-3", "", ""),
+    ("broken", "10", "{not json", ""),
+    (
+        "reversed",
+        "10",
+        "",
+        '{"start": "2026-01-01T00:00:00", "end": "2025-01-01T00:00:00"}',
+    ),
+    ("last", "50%", "", ""),
+]
+VALID_NAMES = {"fixed", "percent", "dated", "last"}
+
+
+@pytest.fixture
+def legacy_db(tmp_path: Path) -> Path:
+    path = tmp_path / "coupon.db"
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE coupon "
+        "(name TEXT UNIQUE PRIMARY KEY, discount TEXT, condition TEXT, validity TEXT)"
+    )
+    connection.executemany("INSERT INTO coupon VALUES (?, ?, ?, ?)", LEGACY_ROWS)
+    connection.commit()
+    connection.close()
+
+    return path
+
+
+def legacy_coupon(name: str) -> Coupon:
+    """The coupon legacy.get_coupon reads."""
+    _, discount, condition, validity = next(
+        row for row in LEGACY_ROWS if row[0] == name
+    )
+    data = {"name": name, "discount": discount}
+    if condition:
+        data["condition"] = json.loads(condition)
+    if validity:
+        data["validity"] = json.loads(validity)
+    return Coupon.model_validate(data)
+
+
+@pytest.mark.asyncio
+async def test_migrate_legacy_coupons(legacy_db: Path) -> None:
+    coupon_storage = InMemoryCouponStorage()
+    errors = []
+
+    with open_legacy_database(str(legacy_db)) as connection:
+        report = await migrate_legacy_coupons(
+            connection,
+            coupon_storage,
+            chunk_size=3,
+            on_error=lambda rowid, reason: errors.append(rowid),
+        )
+
+    assert (report.read, report.migrated, report.rejected) == (7, 4, 3)
+    assert errors == [4, 5, 6]
+    coupons = await coupon_storage.get_all()
+    assert {coupon.name for coupon in coupons} == VALID_NAMES
+    for coupon in coupons:
+        assert coupon == legacy_coupon(coupon.name)
+
+
+@pytest.mark.asyncio
+async def test_migrate_legacy_coupons_should_resume(legacy_db: Path) -> None:
+    coupon_storage = InMemoryCouponStorage()
+    checkpoint = ImportCheckpoint(legacy_db.with_name("coupon.db.checkpoint"))
+
+    def interrupt(report) -> None:
+        raise KeyboardInterrupt()
+
+    with open_legacy_database(str(legacy_db)) as connection:
+        with pytest.raises(KeyboardInterrupt):
+            await migrate_legacy_coupons(
+                connection,
+                coupon_storage,
+                checkpoint=checkpoint,
+                chunk_size=2,
+                on_chunk=interrupt,
+            )
+        assert checkpoint.load() == 2
+
+        report = await migrate_legacy_coupons(
+            connection, coupon_storage, checkpoint=checkpoint, chunk_size=2
+        )
+
+    assert report.resumed_from == 2
+    assert (report.read, report.migrated, report.rejected) == (5, 2, 3)
+    assert {coupon.name for coupon in await coupon_storage.get_all()} == VALID_NAMES
+    assert not checkpoint.path.exists()
+
+
+@pytest.mark.parametrize("name", ["coupon.db", "coupon?mode=rw.db", "coupons #1.db"])
+def test_open_legacy_database_should_be_read_only(
+    legacy_db: Path, tmp_path: Path, name: str
+) -> None:
+    path = legacy_db.rename(tmp_path / name)
+
+    connection = open_legacy_database(path)
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM coupon").fetchone()[0] == 7
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            connection.execute("DELETE FROM coupon")
+    finally:
+        connection.close()
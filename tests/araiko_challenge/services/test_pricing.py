@@ -0,0 +1,109 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.clock import FrozenClock
+from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.pricing import HAS_NUMPY, price_products
+
+MOMENT = datetime(2025, 6, 1)
+
+IMPLEMENTATIONS = [
+    pytest.param(False, id="Pure Python"),
+    pytest.param(
+        True,
+        id="NumPy",
+        marks=pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed"),
+    ),
+]
+
+
+def random_products(count: int, rng: random.Random) -> list[Product]:
+    return [
+        Product(
+            name=f"product_{i}",
+            price=rng.choice([0, 1, 3, 7, 99, 100, 101, rng.randint(0, 100_000)]),
+            category=rng.choice(list(ProductCategory)),
+        )
+        for i in range(count)
+    ]
+
+
+def random_coupons(count: int, rng: random.Random) -> list[Coupon]:
+    return [
+        Coupon(
+            name=f"coupon_{i}",
+            discount=f"{rng.randint(0, 150)}%"
+            if rng.random() < 0.5
+            else rng.randint(0, 500),
+            condition=rng.choice(
+                [None, {"category": "food"}, {"price_above": rng.randint(0, 200)}]
+            ),
+            validity=rng.choice(
+                [None, ("2025-01-01", "2026-01-01"), ("2020-01-01", "2021-01-01")]
+            ),
+        )
+        for i in range(count)
+    ]
+
+
+def expected_prices(
+    products: list[Product], coupons: list[Coupon]
+) -> tuple[list[bool], list[int]]:
+    service = CouponApplicabilityService(FrozenClock(MOMENT))
+    applicable, prices = [], []
+    for product, coupon in zip(products, coupons):
+        is_applicable = service.coupon_is_applicable(coupon, product)
+        applicable.append(is_applicable)
+        prices.append(
+            service.apply_discount(coupon, product).price
+            if is_applicable
+            else product.price
+        )
+
+    return applicable, prices
+
+
+@pytest.mark.parametrize("use_numpy", IMPLEMENTATIONS)
+def test_price_products_should_match_service_with_one_coupon_per_product(
+    use_numpy: bool,
+) -> None:
+    rng = random.Random(3)
+    products = random_products(2000, rng)
+    coupons = random_coupons(2000, rng)
+
+    result = price_products(
+        [product.price for product in products],
+        [product.category for product in products],
+        coupons,
+        clock=FrozenClock(MOMENT),
+        use_numpy=use_numpy,
+    )
+
+    applicable, prices = expected_prices(products, coupons)
+    assert list(result.applicable) == applicable
+    assert list(result.prices) == prices
+
+
+@pytest.mark.parametrize("use_numpy", IMPLEMENTATIONS)
+@pytest.mark.parametrize("discount", ["10%", "33%", "99%", "150%", 15])
+def test_price_products_should_match_service_with_a_single_coupon(
+    use_numpy: bool, discount: int | str
+) -> None:
+    products = random_products(500, random.Random(5))
+    coupon = Coupon(name="coupon", discount=discount, condition={"price_above": 50})
+
+    result = price_products(
+        [product.price for product in products],
+        [product.category for product in products],
+        coupon,
+        clock=FrozenClock(MOMENT),
+        use_numpy=use_numpy,
+    )
+
+    applicable, prices = expected_prices(products, [coupon] * len(products))
+    assert list(result.applicable) == applicable
+    assert list(result.prices) == prices
@@ -0,0 +1,37 @@
+import json
+import time
+
+import pytest
+from pydantic import ValidationError
+
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.models.product import Product
+from coupon_challenge.services.reports import ProgressReport, format_error
+
+
+def test_format_error_should_name_the_invalid_fields() -> None:
+    with pytest.raises(ValidationError) as error:
+        Product.model_validate({"name": "cake", "price": "free"})
+
+    assert format_error(error.value, "product").startswith("price: ")
+
+
+def test_format_error_should_report_whole_input_errors_on_the_subject() -> None:
+    with pytest.raises(ValidationError) as error:
+        Coupon.model_validate([])
+
+    assert format_error(error.value, "coupon").startswith("coupon: ")
+
+
+def test_format_error_should_report_invalid_json() -> None:
+    with pytest.raises(json.JSONDecodeError) as error:
+        json.loads("{")
+
+    assert format_error(error.value, "coupon").startswith("Invalid JSON: ")
+
+
+def test_progress_report_throughput() -> None:
+    report = ProgressReport(read=10, started_at=time.perf_counter() - 2)
+
+    assert report.elapsed >= 2
+    assert 0 < report.throughput <= 5
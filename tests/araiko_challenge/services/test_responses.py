@@ -0,0 +1,87 @@
+import gzip
+
+import pytest
+
+from coupon_challenge.services.responses import (
+    CouponResponseCache,
+    etag_matches,
+    strong_etag,
+)
+
+
+@pytest.mark.parametrize(
+    ("if_none_match", "expected_result"),
+    [
+        pytest.param(None, False, id="No header"),
+        pytest.param('"abc"', True, id="Same ETag"),
+        pytest.param('"other", "abc"', True, id="ETag in a list"),
+        pytest.param('W/"abc"', True, id="Weak ETag"),
+        pytest.param("*", True, id="Any ETag"),
+        pytest.param('"other"', False, id="Other ETag"),
+    ],
+)
+def test_etag_matches(if_none_match: str | None, expected_result: bool) -> None:
+    assert etag_matches(if_none_match, '"abc"') == expected_result
+
+
+def test_put_should_keep_the_body_until_it_expires() -> None:
+    now = 0.0
+    cache = CouponResponseCache(ttl=10.0, clock=lambda: now)
+
+    entry = cache.put("key", cache.version, b"[]", {"X-Next-Cursor": "coupon_1"})
+
+    assert entry.etag == strong_etag(b"[]")
+    assert cache.get("key") == entry
+    now = 10.0
+    assert cache.get("key") is None
+
+
+def test_bump_should_drop_every_body() -> None:
+    cache = CouponResponseCache()
+    cache.put("key", cache.version, b"[]")
+
+    cache.bump()
+
+    assert cache.version == 1
+    assert cache.get("key") is None
+
+
+def test_put_should_not_keep_a_body_read_before_a_write() -> None:
+    cache = CouponResponseCache()
+    version = cache.version
+    cache.bump()
+
+    entry = cache.put("key", version, b"[]")
+
+    assert entry.body == b"[]"
+    assert cache.get("key") is None
+
+
+def test_put_should_evict_the_least_recently_used_body() -> None:
+    cache = CouponResponseCache(max_size=2)
+    cache.put("key_1", cache.version, b"1")
+    cache.put("key_2", cache.version, b"2")
+    cache.get("key_1")
+
+    cache.put("key_3", cache.version, b"3")
+
+    assert cache.get("key_2") is None
+    assert cache.get("key_1") is not None
+
+
+@pytest.mark.parametrize(
+    ("body", "compressed"),
+    [
+        pytest.param(b"[]", False, id="Small body"),
+        pytest.param(b"[" + b"0," * 1000 + b"0]", True, id="Large body"),
+    ],
+)
+def test_put_should_compress_large_bodies(body: bytes, compressed: bool) -> None:
+    cache = CouponResponseCache(gzip_min_size=1024)
+
+    entry = cache.put("key", cache.version, body)
+
+    assert (entry.gzip_body is not None) == compressed
+    if entry.gzip_body is not None:
+        assert gzip.decompress(entry.gzip_body) == body
+        assert entry.gzip_etag != entry.etag
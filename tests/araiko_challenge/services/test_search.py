@@ -0,0 +1,209 @@
+import random
+
+import pytest
+
+from coupon_challenge.models.cart import Cart
+from coupon_challenge.models.coupon import Coupon, CouponCreate
+from coupon_challenge.models.product import Product, ProductCategory
+from coupon_challenge.services.coupons import CouponApplicabilityService
+from coupon_challenge.services.search import CouponSearchEngine
+from coupon_challenge.services.storage.memory import InMemoryCouponStorage
+
+
+def random_coupons(count: int, seed: int = 42) -> list[Coupon]:
+    rng = random.Random(seed)
+    coupons = []
+    for i in range(count):
+        condition = {}
+        if rng.random() < 0.5:
+            condition["category"] = rng.choice(list(ProductCategory))
+        if rng.random() < 0.5:
+            condition["price_above"] = rng.randint(0, 200)
+        validity = None
+        if rng.random() < 0.3:
+            validity = rng.choice(
+                [
+                    {"start": "2015-01-01", "end": "2016-01-01"},
+                    {"start": "2015-01-01", "end": "2099-01-01"},
+                ]
+            )
+        discount = (
+            f"{rng.randint(0, 150)}%" if rng.random() < 0.5 else rng.randint(0, 250)
+        )
+        coupons.append(
+            Coupon(
+                name=f"coupon_{i}",
+                discount=discount,
+                condition=condition or None,
+                validity=validity,
+            )
+        )
+
+    return coupons
+
+
+def brute_force_best(
+    coupons: list[Coupon], cart: Cart, limit: int
+) -> list[tuple[str, int]]:
+    service = CouponApplicabilityService()
+    results = []
+    for coupon in coupons:
+        application = service.apply_discount_to_cart(coupon, cart)
+        if any(line.applicable for line in application.lines):
+            results.append((coupon.name, application.total_discounted_price))
+
+    return sorted(results, key=lambda result: result[1])[:limit]
+
+
+CARTS = [
+    pytest.param(
+        Cart([Product(name="cake", price=100, category="food")]), id="Single product"
+    ),
+    pytest.param(
+        Cart(
+            [
+                Product(name="cake", price=100, category="food"),
+                Product(name="table", price=300, category="furniture"),
+                Product(name="bread", price=3, category="food"),
+            ]
+        ),
+        id="Cart with many categories",
+    ),
+]
+
+
+@pytest.mark.parametrize("cart", CARTS)
+@pytest.mark.parametrize("limit", [1, 5, 20])
+def test_best_should_match_brute_force_prices(cart: Cart, limit: int) -> None:
+    coupons = random_coupons(500)
+    engine = CouponSearchEngine()
+    engine.rebuild(coupons)
+
+    best = engine.best(cart, limit)
+
+    expected = brute_force_best(coupons, cart, limit)
+    assert [application.total_discounted_price for application in best] == [
+        price for _, price in expected
+    ]
+
+
+def test_best_should_ignore_non_applicable_coupons() -> None:
+    engine = CouponSearchEngine()
+    engine.rebuild(
+        [
+            Coupon(name="expired", discount=90, validity=("2015-01-01", "2016-01-01")),
+            Coupon(name="furniture", discount=80, condition={"category": "furniture"}),
+            Coupon(name="expensive", discount=70, condition={"price_above": 100}),
+            Coupon(name="small", discount=10),
+            Coupon(name="half", discount="50%"),
+        ]
+    )
+
+    best = engine.best(Cart([Product(name="cake", price=100, category="food")]))
+
+    assert [(b.coupon, b.total_discounted_price) for b in best] == [
+        ("half", 50),
+        ("small", 90),
+    ]
+
+
+def test_best_should_not_walk_coupons_out_of_their_window() -> None:
+    engine = CouponSearchEngine()
+    engine.rebuild(
+        [
+            Coupon(
+                name=f"expired_{i}",
+                discount=90,
+                validity=("2015-01-01", "2016-01-01"),
+            )
+            for i in range(100)
+        ]
+        + [Coupon(name="small", discount=10)]
+    )
+    walked = []
+    saving = engine._saving
+    engine._saving = lambda name, *args: walked.append(name) or saving(name, *args)
+
+    best = engine.best(Cart([Product(name="cake", price=100, category="food")]))
+
+    assert [b.coupon for b in best] == ["small"]
+    assert walked == ["small"]
+
+
+def test_best_worst_case_walks_coupons_excluded_by_their_price() -> None:
+    # Price conditions are not partitioned, every coupon beating the top-k is
+    # checked even when its price_above excludes the whole cart
+    engine = CouponSearchEngine()
+    engine.rebuild(
+        [
+            Coupon(name=f"expensive_{i}", discount=90, condition={"price_above": 100})
+            for i in range(100)
+        ]
+        + [Coupon(name="small", discount=10)]
+    )
+    walked = []
+    saving = engine._saving
+    engine._saving = lambda name, *args: walked.append(name) or saving(name, *args)
+
+    best = engine.best(Cart([Product(name="cake", price=100, category="food")]))
+
+    assert [b.coupon for b in best] == ["small"]
+    assert len(walked) == 101
+
+
+def test_best_should_follow_windowed_coupons_upserts() -> None:
+    cart = Cart([Product(name="cake", price=100, category="food")])
+    engine = CouponSearchEngine()
+    engine.rebuild([Coupon(name="coupon_1", discount=10)])
+    assert [b.coupon for b in engine.best(cart)] == ["coupon_1"]
+
+    engine.upsert(
+        Coupon(name="coupon_2", discount=20, validity=("2015-01-01", "2099-01-01"))
+    )
+    assert [b.coupon for b in engine.best(cart)] == ["coupon_2", "coupon_1"]
+
+    engine.upsert(
+        Coupon(name="coupon_2", discount=20, validity=("2015-01-01", "2016-01-01"))
+    )
+    assert [b.coupon for b in engine.best(cart)] == ["coupon_1"]
+
+
+def test_upsert_and_remove_should_update_the_ranking() -> None:
+    cart = Cart([Product(name="cake", price=100, category="food")])
+    engine = CouponSearchEngine()
+    engine.rebuild([Coupon(name="coupon_1", discount=10)])
+
+    engine.upsert(Coupon(name="coupon_2", discount=20))
+    assert [b.coupon for b in engine.best(cart)] == ["coupon_2", "coupon_1"]
+
+    engine.upsert(Coupon(name="coupon_1", discount=30))
+    assert [b.coupon for b in engine.best(cart)] == ["coupon_1", "coupon_2"]
+
+    engine.remove("coupon_1")
+    assert [b.coupon for b in engine.best(cart)] == ["coupon_2"]
+    assert len(engine) == 1
+
+
+@pytest.mark.asyncio
+async def test_reload_racing_with_a_write_should_mark_the_engine_stale() -> None:
+    coupon_storage = InMemoryCouponStorage([Coupon(name="coupon_1", discount=10)])
+    engine = CouponSearchEngine()
+    get_all = coupon_storage.get_all
+
+    async def get_all_then_write() -> list[Coupon]:
+        # The coupons are read, then a request creates one before the rebuild
+        coupons = await get_all()
+        created = await coupon_storage.create(
+            CouponCreate(name="coupon_2", discount=20)
+        )
+        engine.upsert(created)
+        return coupons
+
+    coupon_storage.get_all = get_all_then_write  # type: ignore[method-assign]
+    await engine.load(coupon_storage)
+    assert engine.loaded_at is None
+
+    coupon_storage.get_all = get_all  # type: ignore[method-assign]
+    await engine.refresh_if_stale(coupon_storage, max_age=60)
+    assert "coupon_2" in engine
+    assert engine.loaded_at is not None
@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from typer.testing import CliRunner
+
+from coupon_challenge.cli import app
+from coupon_challenge.models.coupon import Coupon
+from coupon_challenge.services.storage.memory import InMemoryCouponStorage
+from coupon_challenge.settings import (
+    AppChallengeSettings,
+    DBBackendEnum,
+    SQLiteSettings,
+)
+
+# Microseconds spent importing modules while running a command, about twice what it
+# takes on a laptop (--help, rendered by rich, is the slowest). Database drivers are
+# checked apart, they are not imported at all
+IMPORT_TIME_BUDGET = 800_000
+
+# Only imported when a command needs them
+LAZY_MODULES = {"motor", "pymongo", "sqlite3"}
+
+
+def measure_imports(*args: str) -> tuple[int, set[str]]:
+    """Run the CLI with `python -X importtime`, returning the time spent importing
+    modules once the interpreter is started (site excluded) and their names."""
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import sys; from coupon_challenge.cli import app; app(sys.argv[1:])",
+            *args,
+        ],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "COUPON_CHALLENGE_DB_BACKEND": "memory"},
+    )
+    assert process.returncode == 0, process.stderr
+
+    elapsed, modules, started = 0, set(), False
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        modules.add(name.strip())
+        # Modules imported at top level, their cumulative time covers their own imports
+        if name.startswith(" ") and not name.startswith("  "):
+            if started:
+                elapsed += int(cumulative)
+            started = started or name.strip() == "site"
+
+    return elapsed, modules
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        pytest.param(["--help"], id="Help"),
+        pytest.param(["coupons", "--help"], id="Coupons help"),
+        pytest.param(["coupons", "list"], id="List coupons"),
+        pytest.param(["coupons", "get", "coupon_1"], id="Get a coupon"),
+    ],
+)
+def test_cli_should_start_within_import_budget(args: list[str]) -> None:
+    elapsed, modules = measure_imports(*args)
+
+    assert not {module.split(".")[0] for module in modules} & LAZY_MODULES
+    assert elapsed < IMPORT_TIME_BUDGET
+
+
+@pytest.mark.parametrize(
+    ("args", "initialized"),
+    [
+        pytest.param(["coupons", "list"], True, id="Commands initialize the storage"),
+        pytest.param(["db", "check"], False, id="Check leaves indexes missing"),
+    ],
+)
+def test_cli_should_initialize_and_close_storage(
+    args: list[str], initialized: bool
+) -> None:
+    coupon_storage = InMemoryCouponStorage()
+    coupon_storage.initialize = AsyncMock()  # type: ignore[method-assign]
+    coupon_storage.close = Mock()  # type: ignore[method-assign]
+
+    with patch(
+        "coupon_challenge.services.storage.registry.create_coupon_storage",
+        return_value=coupon_storage,
+    ):
+        result = CliRunner().invoke(app, args)
+
+    assert result.exit_code == 0, result.output
+    assert coupon_storage.initialize.await_count == int(initialized)
+    coupon_storage.close.assert_called_once()
+
+
+def test_migrate_legacy_should_migrate_within_the_database_of_the_storage(
+    tmp_path: Path,
+) -> None:
+    # legacy.py and the SQLite storage both default to coupon.db
+    path = tmp_path / "coupon.db"
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE coupon "
+        "(name TEXT UNIQUE PRIMARY KEY, discount TEXT, condition TEXT, validity TEXT)"
+    )
+    connection.executemany(
+        "INSERT INTO coupon VALUES (?, ?, ?, ?)",
+        [("fixed", "10", "", ""), ("percent", "25%", "", "")],
+    )
+    connection.commit()
+    connection.close()
+
+    with (
+        patch(
+            "coupon_challenge.cli.get_app_settings",
+            return_value=AppChallengeSettings(db_backend=DBBackendEnum.sqlite),
+        ),
+        patch(
+            "coupon_challenge.services.storage.registry.get_sqlite_settings",
+            return_value=SQLiteSettings(db_path=str(path)),
+        ),
+    ):
+        result = CliRunner().invoke(app, ["migrate", "legacy", str(path)])
+
+    assert result.exit_code == 0, result.output
+    assert "2 coupons migrated, 0 rejected" in result.output
+    connection = sqlite3.connect(path)
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM coupon").fetchone() == (2,)
+        assert connection.execute(
+            "SELECT name, discount, is_percent FROM coupons ORDER BY name"
+        ).fetchall() == [("fixed", 10, 0), ("percent", 25, 1)]
+    finally:
+        connection.close()
+
+
+def test_update_should_reject_a_null_discount() -> None:
+    coupon_storage = InMemoryCouponStorage([Coupon(name="coupon_1", discount=10)])
+    coupon_storage.update = AsyncMock()  # type: ignore[method-assign]
+
+    with patch(
+        "coupon_challenge.services.storage.registry.create_coupon_storage",
+        return_value=coupon_storage,
+    ):
+        result = CliRunner().invoke(
+            app, ["coupons", "update", '{"name": "coupon_1", "discount": null}']
+        )
+
+    # Refused by the argument parser, like the HTTP route refuses it with a 422
+    assert result.exit_code == 2
+    assert "Invalid value" in result.output
+    coupon_storage.update.assert_not_awaited()
@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from coupon_challenge.main import app
+from coupon_challenge.routers.coupons import COUPONS_ROUTE_PREFIX
+from coupon_challenge.services.storage.registry import CouponStorageRegistry
+from coupon_challenge.services.storage.sqlite import SQLiteCouponStorage
+from coupon_challenge.settings import DBBackendEnum, get_app_settings
+
+
+@pytest.fixture
+def sqlite_settings(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("COUPON_CHALLENGE_DB_BACKEND", "sqlite")
+    get_app_settings.cache_clear()
+    yield get_app_settings()
+    get_app_settings.cache_clear()
+
+
+@pytest.mark.usefixtures("sqlite_settings")
+def test_lifespan_should_share_a_single_storage_across_requests() -> None:
+    with patch(
+        "coupon_challenge.services.storage.sqlite.SQLiteCouponStorage",
+        wraps=SQLiteCouponStorage,
+    ) as storage_cls_mock:
+        with TestClient(app) as client:
+            registry: CouponStorageRegistry = app.state.coupon_storage_registry
+            storage = registry.get(DBBackendEnum.sqlite)
+
+            for _ in range(3):
+                response = client.get(f"{COUPONS_ROUTE_PREFIX}/coupon_1")
+                assert response.status_code == 404
+
+            assert registry.get(DBBackendEnum.sqlite) is storage
+
+    storage_cls_mock.assert_called_once()
+
+
+@pytest.mark.usefixtures("sqlite_settings")
+def test_lifespan_should_close_storage_on_shutdown() -> None:
+    with patch.object(SQLiteCouponStorage, "close") as close_mock:
+        with TestClient(app) as client:
+            client.get(f"{COUPONS_ROUTE_PREFIX}/")
+            close_mock.assert_not_called()
+
+    close_mock.assert_called_once()
+
+
+@pytest.mark.usefixtures("sqlite_settings")
+def test_default_settings_should_answer_304_without_storage() -> None:
+    with TestClient(app) as client:
+        client.post(f"{COUPONS_ROUTE_PREFIX}/", json={"name": "c", "discount": 10})
+        etag = client.get(f"{COUPONS_ROUTE_PREFIX}/c").headers["ETag"]
+
+        with patch.object(SQLiteCouponStorage, "get") as get_mock:
+            response = client.get(
+                f"{COUPONS_ROUTE_PREFIX}/c", headers={"If-None-Match": etag}
+            )
+
+    assert response.status_code == 304
+    get_mock.assert_not_called()
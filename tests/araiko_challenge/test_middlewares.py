@@ -0,0 +1,90 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from coupon_challenge.main import app
+from coupon_challenge.middlewares import (
+    PROFILE_HEADER,
+    PROFILE_ID_HEADER,
+    PROFILE_QUERY_PARAMETER,
+)
+from coupon_challenge.routers.coupons import COUPONS_ROUTE_PREFIX
+from coupon_challenge.services.profiling import profile_path, sign_profile_request
+from coupon_challenge.settings import get_app_settings, get_profiling_settings
+
+SECRET = "secret"
+PATH = f"{COUPONS_ROUTE_PREFIX}/coupon_1"
+
+
+@pytest.fixture
+def profiling_settings(monkeypatch, tmp_path):
+    monkeypatch.setenv("COUPON_CHALLENGE_DB_BACKEND", "memory")
+    monkeypatch.setenv("COUPON_CHALLENGE_PROFILING_ENABLED", "true")
+    monkeypatch.setenv("COUPON_CHALLENGE_PROFILING_DIRECTORY", str(tmp_path))
+    monkeypatch.setenv("COUPON_CHALLENGE_PROFILING_SECRET", SECRET)
+    get_app_settings.cache_clear()
+    get_profiling_settings.cache_clear()
+    yield get_profiling_settings()
+    get_app_settings.cache_clear()
+    get_profiling_settings.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "headers, params",
+    [
+        pytest.param(
+            {PROFILE_HEADER: sign_profile_request(SECRET, PATH)}, {}, id="Header"
+        ),
+        pytest.param(
+            {},
+            {PROFILE_QUERY_PARAMETER: sign_profile_request(SECRET, PATH)},
+            id="Query parameter",
+        ),
+    ],
+)
+def test_signed_request_is_profiled(profiling_settings, headers, params) -> None:
+    with TestClient(app) as client:
+        response = client.get(PATH, headers=headers, params=params)
+
+    assert response.status_code == 404
+    profile_id = response.headers[PROFILE_ID_HEADER]
+    assert profile_path(profiling_settings.directory, profile_id).is_file()
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        pytest.param({}, id="No signature"),
+        pytest.param({PROFILE_HEADER: "forged"}, id="Wrong signature"),
+        pytest.param(
+            {PROFILE_HEADER: sign_profile_request(SECRET, "/other")},
+            id="Signature of another path",
+        ),
+    ],
+)
+def test_unsigned_request_is_not_profiled(profiling_settings, headers) -> None:
+    with TestClient(app) as client:
+        response = client.get(PATH, headers=headers)
+
+    assert PROFILE_ID_HEADER not in response.headers
+
+
+def test_requests_are_sampled(profiling_settings, monkeypatch) -> None:
+    monkeypatch.setenv("COUPON_CHALLENGE_PROFILING_SAMPLE_EVERY", "3")
+    get_profiling_settings.cache_clear()
+
+    with TestClient(app) as client:
+        responses = [client.get(PATH) for _ in range(9)]
+
+    assert sum(PROFILE_ID_HEADER in response.headers for response in responses) == 3
+
+
+def test_profiling_disabled(profiling_settings, monkeypatch) -> None:
+    monkeypatch.setenv("COUPON_CHALLENGE_PROFILING_ENABLED", "false")
+    get_app_settings.cache_clear()
+
+    with TestClient(app) as client:
+        response = client.get(
+            PATH, headers={PROFILE_HEADER: sign_profile_request(SECRET, PATH)}
+        )
+
+    assert PROFILE_ID_HEADER not in response.headers